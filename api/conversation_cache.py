@@ -0,0 +1,150 @@
+import asyncio
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from time import monotonic
+from typing import AsyncIterator, Awaitable, Callable, Dict, Optional, Tuple
+
+from phi.conversation import Conversation
+
+from api.settings import api_settings
+
+# (conversation_type, conversation_id)
+CacheKey = Tuple[str, str]
+
+
+@dataclass
+class CachedConversationEntry:
+    conversation: Conversation
+    expires_at: float
+
+
+class ConversationCache:
+    def __init__(
+        self,
+        max_size: int = api_settings.conversation_cache_size,
+        ttl: float = api_settings.conversation_cache_ttl,
+    ):
+        """
+        LRU cache of conversations which have been read from storage, used by the Api endpoints.
+
+        A conversation is checked out by one request at a time, so messages sent to the same conversation
+        are answered one after the other. Conversations are dropped when a request fails, because their memory
+        may no longer match the database, and expire after ttl seconds so writes from other processes are seen.
+        The cache is used from the event loop only.
+
+        :param max_size: Maximum number of conversations kept in memory, 0 disables the cache.
+        :param ttl: Number of seconds a conversation is used after it was last read or written.
+        """
+        self.max_size: int = max_size
+        self.ttl: float = ttl
+        self.entries: OrderedDict[CacheKey, CachedConversationEntry] = OrderedDict()
+        self.locks: Dict[CacheKey, asyncio.Lock] = {}
+        self.lock_users: Dict[CacheKey, int] = {}
+
+        # Metrics
+        self.hits: int = 0
+        self.misses: int = 0
+        self.expirations: int = 0
+        self.evictions: int = 0
+        self.invalidations: int = 0
+
+    def get(self, key: CacheKey) -> Optional[Conversation]:
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        if entry.expires_at <= monotonic():
+            del self.entries[key]
+            self.expirations += 1
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry.conversation
+
+    def peek(self, key: CacheKey) -> Optional[Conversation]:
+        """Returns the cached conversation without counting a lookup"""
+
+        entry = self.entries.get(key)
+        return entry.conversation if entry is not None and entry.expires_at > monotonic() else None
+
+    def put(self, conversation_type: str, conversation: Conversation) -> None:
+        """Add or refresh a conversation which matches the database"""
+
+        if self.max_size <= 0 or conversation.id is None or conversation.database_row is None:
+            return
+        key = (conversation_type, conversation.id)
+        self.entries[key] = CachedConversationEntry(
+            conversation=conversation, expires_at=monotonic() + self.ttl
+        )
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, conversation_type: str, conversation_id: Optional[str]) -> None:
+        if (
+            conversation_id is not None
+            and self.entries.pop((conversation_type, conversation_id), None) is not None
+        ):
+            self.invalidations += 1
+
+    @asynccontextmanager
+    async def checkout(
+        self,
+        conversation_type: str,
+        conversation_id: Optional[str],
+        load: Callable[[], Awaitable[Conversation]],
+    ) -> AsyncIterator[Conversation]:
+        """Use the cached conversation, or the conversation returned by load, while holding its lock.
+
+        The conversation is cached when the block exits and dropped if it raises.
+        """
+
+        if conversation_id is None:
+            conversation = await load()
+            yield conversation
+            self.put(conversation_type, conversation)
+            return
+
+        key = (conversation_type, conversation_id)
+        lock = self.locks.setdefault(key, asyncio.Lock())
+        self.lock_users[key] = self.lock_users.get(key, 0) + 1
+        try:
+            async with lock:
+                cached = self.get(key)
+                conversation = cached or await load()
+                database_row = conversation.database_row
+                try:
+                    yield conversation
+                except BaseException:
+                    # Also raised when the client disconnects from a streamed response
+                    self.invalidate(conversation_type, conversation_id)
+                    raise
+                # The ttl restarts when the conversation is read or written
+                if cached is None or conversation.database_row is not database_row:
+                    self.put(conversation_type, conversation)
+        finally:
+            self.lock_users[key] -= 1
+            if self.lock_users[key] == 0:
+                del self.lock_users[key]
+                del self.locks[key]
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self.entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups > 0 else 0,
+            "expirations": self.expirations,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "locked": len(self.locks),
+        }
+
+
+# Conversations of the PDF endpoints
+pdf_conversation_cache = ConversationCache()
@@ -1,8 +1,30 @@
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
+
 from fastapi import FastAPI
 from starlette.middleware.cors import CORSMiddleware
 
 from api.settings import api_settings
 from api.routes.v1_router import v1_router
+from llm.ingestion.jobs import IngestionWorker
+from llm.knowledge_base import ingestion_jobs, knowledge_bases
+from llm.storage import (
+    pdf_conversation_async_storage,
+    website_conversation_async_storage,
+)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI) -> AsyncIterator[None]:
+    """Run queued knowledge base loads while the Api is running"""
+
+    worker = IngestionWorker(jobs=ingestion_jobs, knowledge_bases=knowledge_bases)
+    if api_settings.ingestion_worker_enabled:
+        worker.start()
+    yield
+    worker.stop()
+    for async_storage in (pdf_conversation_async_storage, website_conversation_async_storage):
+        await async_storage.close()
 
 
 def create_app() -> FastAPI:
@@ -19,6 +41,7 @@ def create_app() -> FastAPI:
         docs_url="/docs" if api_settings.docs_enabled else None,
         redoc_url="/redoc" if api_settings.docs_enabled else None,
         openapi_url="/openapi.json" if api_settings.docs_enabled else None,
+        lifespan=lifespan,
     )
 
     # Add v1 router
@@ -0,0 +1,145 @@
+from typing import List, Literal, Optional, Union
+
+from fastapi import APIRouter, BackgroundTasks, Depends, Header, HTTPException
+from phi.vectordb.pgvector.index import HNSW, Ivfflat
+from pydantic import BaseModel
+
+from api.conversation_cache import pdf_conversation_cache
+from api.routes.endpoints import endpoints
+from api.settings import api_settings
+from api.sse import stream_stats
+from llm.admission import admission_controller
+from llm.coalescing import request_coalescer
+from llm.knowledge_base import embedder, vector_dbs
+from llm.settings import llm_settings
+from llm.vectordb import IndexStatus, PgVectorDb
+from utils.log import logger
+
+
+def verify_admin_key(x_admin_key: Optional[str] = Header(None)) -> None:
+    """Admin endpoints require the X-Admin-Key header, or the dev runtime_env when no key is set"""
+
+    if api_settings.admin_api_key is None:
+        if api_settings.runtime_env != "dev":
+            raise HTTPException(status_code=403, detail="Admin endpoints are disabled")
+        return
+    if x_admin_key != api_settings.admin_api_key:
+        raise HTTPException(status_code=401, detail="Invalid admin key")
+
+
+######################################################
+## Router for Admin operations
+######################################################
+
+admin_router = APIRouter(prefix=endpoints.ADMIN, tags=["Admin"], dependencies=[Depends(verify_admin_key)])
+
+
+def get_vector_db(collection: str) -> PgVectorDb:
+    if collection not in vector_dbs:
+        raise HTTPException(status_code=404, detail=f"Collection {collection} not found")
+    return vector_dbs[collection]
+
+
+@admin_router.get("/indexes", response_model=List[IndexStatus])
+def get_indexes():
+    """Get the vector indexes and build progress for all collections"""
+
+    return [vector_db.get_index_status() for vector_db in vector_dbs.values()]
+
+
+@admin_router.get("/indexes/{collection}", response_model=IndexStatus)
+def get_index(collection: str):
+    """Get the vector indexes and build progress for a collection"""
+
+    return get_vector_db(collection).get_index_status()
+
+
+class CreateIndexRequest(BaseModel):
+    index_type: Literal["hnsw", "ivfflat"] = llm_settings.vector_index_type
+    # hnsw parameters
+    m: int = llm_settings.hnsw_m
+    ef_construction: int = llm_settings.hnsw_ef_construction
+    ef_search: int = llm_settings.hnsw_ef_search
+    # ivfflat parameters, lists is derived from the number of documents when not provided
+    lists: Optional[int] = None
+    probes: int = llm_settings.ivfflat_probes
+    # Index quantized embeddings, "none" indexes the full precision embeddings
+    # and the current quantization of the collection is kept when not provided
+    quantization: Optional[Literal["none", "halfvec", "binary"]] = None
+    # Replace existing indexes on the collection
+    rebuild: bool = False
+
+
+def build_index(
+    vector_db: PgVectorDb,
+    index: Union[HNSW, Ivfflat],
+    rebuild: bool,
+    quantization: Optional[Literal["none", "halfvec", "binary"]] = None,
+) -> None:
+    try:
+        vector_db.create_index(index=index, rebuild=rebuild, quantization=quantization)
+    except Exception as e:
+        # The error is reported by the index status endpoints
+        logger.error(f"Index build failed for {vector_db.collection}: {e}")
+
+
+@admin_router.post("/indexes/{collection}", response_model=IndexStatus, status_code=202)
+def create_index(collection: str, body: CreateIndexRequest, background_tasks: BackgroundTasks):
+    """Create or rebuild the vector index for a collection.
+
+    The index is built in the background, use the status endpoints to follow its progress.
+    """
+
+    vector_db = get_vector_db(collection)
+    index: Union[HNSW, Ivfflat]
+    if body.index_type == "ivfflat":
+        index = Ivfflat(lists=body.lists or 100, probes=body.probes, dynamic_lists=body.lists is None)
+    else:
+        index = HNSW(m=body.m, ef_construction=body.ef_construction, ef_search=body.ef_search)
+
+    logger.debug(f"CreateIndexRequest for {collection}: {body}")
+    background_tasks.add_task(
+        build_index,
+        vector_db=vector_db,
+        index=index,
+        rebuild=body.rebuild,
+        quantization=body.quantization,
+    )
+    return vector_db.get_index_status()
+
+
+@admin_router.delete("/indexes/{collection}", response_model=IndexStatus)
+def drop_index(collection: str):
+    """Drop the vector indexes for a collection, searches fall back to an exact scan"""
+
+    vector_db = get_vector_db(collection)
+    vector_db.drop_indexes()
+    return vector_db.get_index_status()
+
+
+@admin_router.get("/cache-stats")
+def get_cache_stats():
+    """Get the hit rates of the embedding and conversation caches in this process"""
+
+    return {"embedder": embedder.stats(), "pdf_conversations": pdf_conversation_cache.stats()}
+
+
+@admin_router.get("/stream-stats")
+def get_stream_stats():
+    """Get the number of completed, abandoned and failed chat streams in this process"""
+
+    return stream_stats.stats()
+
+
+@admin_router.get("/admission-stats")
+def get_admission_stats():
+    """Get the number of admitted, queued and rejected llm requests in this process"""
+
+    return admission_controller.stats()
+
+
+@admin_router.get("/coalescing-stats")
+def get_coalescing_stats():
+    """Get the number of answers in flight, started and joined by identical requests in this process"""
+
+    return request_coalescer.stats()
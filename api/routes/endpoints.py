@@ -6,6 +6,8 @@ class ApiEndpoints:
     PING: str = "/ping"
     HEALTH: str = "/health"
     PDF_CONVERSATION: str = "/pdf/conversation"
+    ADMIN: str = "/admin"
+    JOBS: str = "/jobs"
 
 
 endpoints = ApiEndpoints()
@@ -0,0 +1,30 @@
+from typing import List, Optional
+
+from fastapi import APIRouter, HTTPException
+
+from api.routes.endpoints import endpoints
+from llm.ingestion.jobs import IngestionJob
+from llm.knowledge_base import ingestion_jobs
+
+######################################################
+## Router for knowledge base ingestion jobs
+######################################################
+
+job_router = APIRouter(prefix=endpoints.JOBS, tags=["Jobs"])
+
+
+@job_router.get("", response_model=List[IngestionJob])
+def get_jobs(knowledge_base: Optional[str] = None, limit: int = 20):
+    """Get the most recent ingestion jobs, optionally for a single knowledge base"""
+
+    return ingestion_jobs.get_jobs(knowledge_base=knowledge_base, limit=min(limit, 100))
+
+
+@job_router.get("/{job_id}", response_model=IngestionJob)
+def get_job(job_id: str):
+    """Get the status and progress of an ingestion job"""
+
+    job = ingestion_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    return job
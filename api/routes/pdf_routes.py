@@ -1,14 +1,29 @@
-from typing import Generator, Optional, List, Dict, Any, Literal
+import math
+from threading import Lock
+from typing import AsyncGenerator, Generator, Optional, List, Dict, Any, Literal
 
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Query, Request
+from fastapi.concurrency import run_in_threadpool
 from fastapi.responses import StreamingResponse
 from phi.conversation import Conversation, ConversationRow
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
+from starlette.background import BackgroundTask
 
+from api.conversation_cache import pdf_conversation_cache
+from api.settings import api_settings
 from api.routes.endpoints import endpoints
+from api.sse import event_stream, format_event
+from llm.admission import Admission, AdmissionRejected, admission_controller, estimate_tokens
+from llm.batch import parse_questions, run_batch
+from llm.conversation_storage import ConversationPage
 from llm.conversations.pdf_rag import get_pdf_rag_conversation
 from llm.conversations.pdf_auto import get_pdf_auto_conversation
+from llm.conversations.rag import RAGConversation
+from llm.ingestion.jobs import IngestionJob
+from llm.knowledge_base import ingestion_jobs, pdf_knowledge_base
+from llm.settings import llm_settings
 from llm.storage import pdf_conversation_storage
+from llm.vectordb import PgVectorDb
 from utils.log import logger
 
 ######################################################
@@ -34,14 +49,44 @@ def get_conversation(
         )
 
 
-@pdf_router.post("/load-knowledge-base")
-def load_knowledge_base():
-    """Loads the knowledge base for the PDF LLM"""
+async def load_conversation(
+    conversation_type: ConversationType, conversation_id: Optional[str] = None
+) -> Conversation:
+    """Get a conversation and read it from storage, used when it is not in the conversation cache"""
 
-    pdf_rag_conversation = get_pdf_rag_conversation()
-    if pdf_rag_conversation.knowledge_base:
-        pdf_rag_conversation.knowledge_base.load(recreate=False)
-    return {"message": "Knowledge base loaded"}
+    conversation: Conversation = get_conversation(
+        conversation_type=conversation_type, conversation_id=conversation_id
+    )
+    if isinstance(conversation, RAGConversation):
+        conversation.cached_in_memory = True
+        if conversation.async_storage is not None:
+            await conversation.aread_from_storage()
+            return conversation
+    await run_in_threadpool(conversation.read_from_storage)
+    return conversation
+
+
+def checkout_conversation(conversation_type: ConversationType, conversation_id: Optional[str] = None):
+    """Use the cached conversation while no other request uses it"""
+
+    return pdf_conversation_cache.checkout(
+        conversation_type=conversation_type,
+        conversation_id=conversation_id,
+        load=lambda: load_conversation(conversation_type=conversation_type, conversation_id=conversation_id),
+    )
+
+
+@pdf_router.post("/load-knowledge-base", response_model=IngestionJob, status_code=202)
+def load_knowledge_base(recreate: bool = False):
+    """Queues a load of the knowledge base for the PDF LLM.
+
+    Returns the ingestion job, or the job which is already loading the knowledge base.
+    Use /v1/jobs/{job_id} to follow its progress.
+    """
+
+    if not isinstance(pdf_knowledge_base.vector_db, PgVectorDb):
+        raise HTTPException(status_code=400, detail="Knowledge base cannot be loaded in the background")
+    return ingestion_jobs.submit(knowledge_base=pdf_knowledge_base.vector_db.collection, recreate=recreate)
 
 
 class CreateConversationRequest(BaseModel):
@@ -55,7 +100,7 @@ class CreateConversationResponse(BaseModel):
 
 
 @pdf_router.post("/create", response_model=CreateConversationResponse)
-def create_conversation(body: CreateConversationRequest):
+async def create_conversation(body: CreateConversationRequest):
     """Create a new conversation and return the conversation_id"""
 
     logger.debug(f"CreateConversationRequest: {body}")
@@ -65,11 +110,16 @@ def create_conversation(body: CreateConversationRequest):
 
     # start() will log the conversation in the database and return the conversation_id
     # which is returned to the frontend to retrieve the conversation later
-    conversation_id: Optional[str] = conversation.start()
+    conversation_id: Optional[str] = await run_in_threadpool(conversation.start)
     if conversation_id is None:
         raise HTTPException(status_code=500, detail="Failed to create conversation")
     logger.debug(f"Created Conversation: {conversation_id}")
 
+    # The first message is answered without reading the conversation again
+    if isinstance(conversation, RAGConversation):
+        conversation.cached_in_memory = True
+    pdf_conversation_cache.put(body.conversation_type, conversation)
+
     return CreateConversationResponse(
         user_name=conversation.user_name,
         conversation_id=conversation_id,
@@ -77,11 +127,6 @@ def create_conversation(body: CreateConversationRequest):
     )
 
 
-def chat_response_streamer(conversation: Conversation, message: str) -> Generator:
-    for chunk in conversation.run(message):
-        yield chunk
-
-
 class ChatRequest(BaseModel):
     message: str
     stream: bool = True
@@ -89,22 +134,186 @@ class ChatRequest(BaseModel):
     conversation_type: ConversationType = "RAG"
 
 
+async def answer_message(conversation: Conversation, message: str, stream: bool) -> AsyncGenerator[str, None]:
+    """Answer the message using a conversation checked out by the caller"""
+
+    # RAG conversations are answered on the event loop, so streams do not hold a threadpool thread
+    if isinstance(conversation, RAGConversation) and conversation.supports_async():
+        chunks = conversation.arun(message)
+        try:
+            async for chunk in chunks:
+                yield chunk
+        finally:
+            # Cancels the llm request and saves the partial answer when the client disconnected
+            await chunks.aclose()
+        return
+
+    # Other conversations block while they are answered, so they run in the threadpool.
+    # run() starts searching the knowledge base before the response is streamed.
+    response = await run_in_threadpool(conversation.run, message, stream=stream)
+    if not isinstance(response, Generator):
+        yield str(response)
+        return
+
+    # A disconnect can cancel the request while a thread reads the next chunk, the lock makes close wait for it
+    lock = Lock()
+
+    def next_chunk() -> Optional[str]:
+        with lock:
+            return next(response, None)
+
+    def close() -> None:
+        with lock:
+            response.close()
+
+    try:
+        while True:
+            text = await run_in_threadpool(next_chunk)
+            if text is None:
+                break
+            yield text
+    finally:
+        # Stops the llm stream and saves the partial answer when the client disconnected
+        await run_in_threadpool(close)
+
+
+async def get_chat_user_name(body: ChatRequest) -> str:
+    """Returns the user of the conversation, from the conversation cache if it has the conversation"""
+
+    if body.conversation_id is not None:
+        conversation = pdf_conversation_cache.peek((body.conversation_type, body.conversation_id))
+        if conversation is not None and conversation.user_name is not None:
+            return conversation.user_name
+        user_name = await run_in_threadpool(pdf_conversation_storage.get_user_name, body.conversation_id)
+        if user_name is not None:
+            return user_name
+    return "anonymous"
+
+
+async def admit_chat(body: ChatRequest) -> Optional[Admission]:
+    """Wait for the llm within the user's limits, responds with 429 when the request is rejected"""
+
+    if not llm_settings.admission_enabled:
+        return None
+    user_name = await get_chat_user_name(body)
+    # PDF conversations use gpt_4
+    model = llm_settings.gpt_4
+    try:
+        return await admission_controller.aadmit(
+            user_name, model, estimate_tokens(model, llm_settings.default_max_tokens)
+        )
+    except AdmissionRejected as e:
+        logger.info(f"Rejected chat of {user_name}: {e.reason}")
+        raise HTTPException(
+            status_code=429, detail=str(e), headers={"Retry-After": str(math.ceil(e.retry_after))}
+        )
+
+
+def record_used_tokens(admission: Optional[Admission], conversation: Conversation) -> None:
+    """The unused part of the tokens reserved by the admission is returned to the user on release"""
+
+    if admission is not None and isinstance(conversation, RAGConversation):
+        admission.used_tokens = conversation.get_used_tokens()
+
+
+async def chat_events(body: ChatRequest, admission: Optional[Admission] = None) -> AsyncGenerator[str, None]:
+    """Stream the answer as server-sent events.
+
+    The references event is sent before the first token event, the usage and done events after the last.
+    Other messages to the conversation wait until the answer has been streamed.
+    """
+
+    async with checkout_conversation(body.conversation_type, body.conversation_id) as conversation:
+        chunks = answer_message(conversation, body.message, stream=True)
+        num_chunks = 0
+        try:
+            async for chunk in chunks:
+                if num_chunks == 0 and isinstance(conversation, RAGConversation):
+                    if conversation.context_report is not None:
+                        yield format_event(
+                            "references", {"references": conversation.context_report.references}
+                        )
+                num_chunks += 1
+                yield format_event("token", {"content": chunk})
+        except Exception as e:
+            logger.error(f"Failed to answer message: {e}")
+            yield format_event("error", {"detail": "Failed to answer the message"})
+            raise
+        finally:
+            await chunks.aclose()
+            if admission is not None:
+                record_used_tokens(admission, conversation)
+                admission_controller.release(admission)
+
+        usage: Dict[str, Any] = {"completion_tokens": num_chunks}
+        if isinstance(conversation, RAGConversation):
+            if conversation.context_report is not None:
+                usage["prompt_tokens"] = conversation.context_report.total_tokens
+            usage["timings"] = {stage: round(seconds, 3) for stage, seconds in conversation.timings.items()}
+        yield format_event("usage", usage)
+        yield format_event("done", {"conversation_id": conversation.id})
+
+
 @pdf_router.post("/chat")
-def chat(body: ChatRequest):
-    """Send a message to the PDF LLM and return the response"""
+async def chat(body: ChatRequest):
+    """Send a message to the PDF LLM and return the response.
 
-    logger.debug(f"ChatRequest: {body}")
-    conversation: Conversation = get_conversation(
-        conversation_type=body.conversation_type, conversation_id=body.conversation_id
-    )
+    Streamed responses are server-sent events: references, token, usage, done and error, with heartbeat comments
+    while the answer is not ready. When the client disconnects the answer is cancelled and the partial answer saved.
+    Requests over the user's token bucket, or waiting too long for the llm, are rejected with 429 and Retry-After.
+    """
 
+    logger.debug(f"ChatRequest: {body}")
+    admission = await admit_chat(body)
     if body.stream:
         return StreamingResponse(
-            chat_response_streamer(conversation, body.message),
+            event_stream(chat_events(body, admission)),
             media_type="text/event-stream",
+            # Frees the slot if the client disconnected before the events started, release is idempotent
+            background=BackgroundTask(admission_controller.release, admission)
+            if admission is not None
+            else None,
         )
-    else:
-        return conversation.run(body.message, stream=False)
+
+    try:
+        async with checkout_conversation(body.conversation_type, body.conversation_id) as conversation:
+            try:
+                return "".join(
+                    [chunk async for chunk in answer_message(conversation, body.message, stream=False)]
+                )
+            finally:
+                record_used_tokens(admission, conversation)
+    finally:
+        if admission is not None:
+            admission_controller.release(admission)
+
+
+@pdf_router.post("/batch")
+async def answer_batch(
+    request: Request,
+    concurrency: int = Query(llm_settings.batch_concurrency, ge=1, le=api_settings.batch_max_concurrency),
+    user_name: str = Query("batch", min_length=1),
+):
+    """Answer a JSONL batch of questions, e.g. {"id": "1", "question": "..."} per line.
+
+    Each question is answered by a new RAG conversation which is not stored. Answers are streamed back
+    as JSONL in the order they finish, with their latency, token usage and reference ids.
+    Questions are admitted within the llm limits of user_name, waiting when the user is over their token bucket.
+    """
+
+    try:
+        questions = parse_questions((await request.body()).decode().splitlines())
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    logger.debug(f"Answering a batch of {len(questions)} questions")
+
+    async def answers() -> AsyncGenerator[str, None]:
+        async for answer in run_batch(
+            questions, concurrency=concurrency, conversation_type="pdf", user_name=user_name
+        ):
+            yield answer.model_dump_json() + "\n"
+
+    return StreamingResponse(answers(), media_type="application/x-ndjson")
 
 
 class ChatHistoryRequest(BaseModel):
@@ -113,17 +322,12 @@ class ChatHistoryRequest(BaseModel):
 
 
 @pdf_router.post("/history", response_model=List[Dict[str, Any]])
-def get_chat_history(body: ChatHistoryRequest):
+async def get_chat_history(body: ChatHistoryRequest):
     """Return the chat history for a conversation"""
 
     logger.debug(f"ChatHistoryRequest: {body}")
-    conversation: Conversation = get_conversation(
-        conversation_type=body.conversation_type, conversation_id=body.conversation_id
-    )
-    # Load the conversation from the database
-    conversation.read_from_storage()
-
-    return conversation.memory.get_chat_history()
+    async with checkout_conversation(body.conversation_type, body.conversation_id) as conversation:
+        return conversation.memory.get_chat_history()
 
 
 class GetConversationRequest(BaseModel):
@@ -132,15 +336,35 @@ class GetConversationRequest(BaseModel):
 
 
 @pdf_router.post("/get", response_model=Optional[ConversationRow])
-def get_conversation_row(body: GetConversationRequest):
+async def get_conversation_row(body: GetConversationRequest):
     """Return a conversation using the conversation_id"""
 
     logger.debug(f"GetConversationRequest: {body}")
-    conversation: Conversation = get_conversation(
-        conversation_type=body.conversation_type, conversation_id=body.conversation_id
-    )
+    async with checkout_conversation(body.conversation_type, body.conversation_id) as conversation:
+        return conversation.database_row
+
+
+class ListConversationsRequest(BaseModel):
+    user_name: str
+    limit: int = Field(20, ge=1, le=100)
+    # next_cursor of the previous page
+    cursor: Optional[str] = None
+
+
+@pdf_router.post("/list", response_model=ConversationPage)
+def list_conversations(body: ListConversationsRequest):
+    """Return a page of conversations for a user, most recently updated first.
 
-    return conversation.read_from_storage()
+    Conversations are listed without their memory, use /get or /history to read a conversation.
+    """
+
+    logger.debug(f"ListConversationsRequest: {body}")
+    try:
+        return pdf_conversation_storage.list_conversations(
+            user_name=body.user_name, limit=body.limit, cursor=body.cursor
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 
 class GetAllConversationsRequest(BaseModel):
@@ -149,7 +373,7 @@ class GetAllConversationsRequest(BaseModel):
 
 @pdf_router.post("/get-all", response_model=List[ConversationRow])
 def get_conversations(body: GetAllConversationsRequest):
-    """Return all conversations for a user"""
+    """Return all conversations for a user, including their memory. Use /list to page through conversations."""
 
     logger.debug(f"GetAllConversationsRequest: {body}")
     return pdf_conversation_storage.get_all_conversations(user_name=body.user_name)
@@ -179,14 +403,12 @@ class RenameConversationResponse(BaseModel):
 
 
 @pdf_router.post("/rename", response_model=RenameConversationResponse)
-def rename_conversation(body: RenameConversationRequest):
+async def rename_conversation(body: RenameConversationRequest):
     """Rename a conversation"""
 
     logger.debug(f"RenameConversationRequest: {body}")
-    conversation: Conversation = get_conversation(
-        conversation_type=body.conversation_type, conversation_id=body.conversation_id
-    )
-    conversation.rename(body.name)
+    async with checkout_conversation(body.conversation_type, body.conversation_id) as conversation:
+        await run_in_threadpool(conversation.rename, body.name)
 
     return RenameConversationResponse(
         name=conversation.name,
@@ -205,14 +427,12 @@ class AutoRenameConversationResponse(BaseModel):
 
 
 @pdf_router.post("/autorename", response_model=AutoRenameConversationResponse)
-def autorename_conversation(body: AutoRenameConversationRequest):
+async def autorename_conversation(body: AutoRenameConversationRequest):
     """Rename a conversation using the LLM"""
 
     logger.debug(f"AutoRenameConversationRequest: {body}")
-    conversation: Conversation = get_conversation(
-        conversation_type=body.conversation_type, conversation_id=body.conversation_id
-    )
-    conversation.auto_rename()
+    async with checkout_conversation(body.conversation_type, body.conversation_id) as conversation:
+        await run_in_threadpool(conversation.auto_rename)
 
     return RenameConversationResponse(
         name=conversation.name,
@@ -226,13 +446,13 @@ class EndConversationRequest(BaseModel):
 
 
 @pdf_router.post("/end", response_model=Optional[ConversationRow])
-def end_conversation(body: EndConversationRequest):
+async def end_conversation(body: EndConversationRequest):
     """End a conversation"""
 
     logger.debug(f"EndConversationRequest: {body}")
-    conversation: Conversation = get_conversation(
-        conversation_type=body.conversation_type, conversation_id=body.conversation_id
-    )
-    conversation.end()
-
-    return conversation.read_from_storage()
+    async with checkout_conversation(body.conversation_type, body.conversation_id) as conversation:
+        await run_in_threadpool(conversation.end)
+        row = await run_in_threadpool(conversation.read_from_storage)
+    # end() writes to storage directly, ended conversations are not kept in memory
+    pdf_conversation_cache.invalidate(body.conversation_type, body.conversation_id)
+    return row
@@ -2,7 +2,11 @@ from fastapi import APIRouter
 
 from api.routes.status_routes import status_router
 from api.routes.pdf_routes import pdf_router
+from api.routes.admin_routes import admin_router
+from api.routes.job_routes import job_router
 
 v1_router = APIRouter(prefix="/v1")
 v1_router.include_router(status_router)
 v1_router.include_router(pdf_router)
+v1_router.include_router(admin_router)
+v1_router.include_router(job_router)
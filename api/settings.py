@@ -28,6 +28,25 @@ class ApiSettings(BaseSettings):
     # default cors origin list.
     cors_origin_list: Optional[List[str]] = Field(None, validate_default=True)
 
+    # Key required in the X-Admin-Key header by admin endpoints.
+    # When not set, admin endpoints are only available in the dev runtime_env
+    admin_api_key: Optional[str] = None
+
+    # Run queued knowledge base loads in a background thread of the Api process.
+    # Set to False when loads are run by dedicated workers.
+    ingestion_worker_enabled: bool = True
+
+    # Number of conversations kept in memory between requests, 0 disables the cache.
+    # Conversations written by other processes are read again after conversation_cache_ttl seconds.
+    conversation_cache_size: int = 256
+    conversation_cache_ttl: float = 60
+
+    # Seconds without events after which a heartbeat frame is sent on chat streams
+    sse_heartbeat_interval: float = 15
+
+    # Maximum number of questions answered at once by a batch request
+    batch_max_concurrency: int = 64
+
     @field_validator("runtime_env")
     def validate_runtime_env(cls, runtime_env):
         """Validate runtime_env."""
@@ -0,0 +1,92 @@
+import asyncio
+import json
+from typing import Any, AsyncGenerator, AsyncIterator, Dict, Set
+
+from api.settings import api_settings
+from utils.log import logger
+
+# Comment frame sent while no event is ready, keeps proxies from closing idle streams
+HEARTBEAT = ": heartbeat\n\n"
+
+
+def format_event(event: str, data: Dict[str, Any]) -> str:
+    """Format a server-sent event with a json payload"""
+
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+class StreamStats:
+    """Outcomes of the server-sent event streams of this process"""
+
+    def __init__(self):
+        self.started: int = 0
+        self.completed: int = 0
+        # The client disconnected before the last event was sent
+        self.abandoned: int = 0
+        self.failed: int = 0
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "started": self.started,
+            "active": self.started - self.completed - self.abandoned - self.failed,
+            "completed": self.completed,
+            "abandoned": self.abandoned,
+            "failed": self.failed,
+        }
+
+
+stream_stats = StreamStats()
+
+# Event generators which are closed in the background after their client disconnected
+_closing: Set[asyncio.Future] = set()
+
+
+async def next_event(events: AsyncGenerator[str, None]) -> str:
+    return await events.__anext__()
+
+
+async def event_stream(
+    events: AsyncGenerator[str, None],
+    heartbeat_interval: float = api_settings.sse_heartbeat_interval,
+) -> AsyncIterator[str]:
+    """Send the events with heartbeats in between, for a StreamingResponse.
+
+    The events are produced in their own task. When the client disconnects Starlette cancels the response,
+    the events are then cancelled or closed in that task so they can still clean up, e.g. save a partial answer.
+    """
+
+    stream_stats.started += 1
+    outcome = "abandoned"
+    pending = asyncio.ensure_future(next_event(events))
+    try:
+        while True:
+            done, _ = await asyncio.wait({pending}, timeout=heartbeat_interval)
+            if not done:
+                yield HEARTBEAT
+                continue
+            try:
+                event = pending.result()
+            except StopAsyncIteration:
+                outcome = "completed"
+                return
+            except Exception:
+                outcome = "failed"
+                raise
+            yield event
+            pending = asyncio.ensure_future(next_event(events))
+    finally:
+        if outcome == "completed":
+            stream_stats.completed += 1
+        elif outcome == "failed":
+            stream_stats.failed += 1
+        else:
+            stream_stats.abandoned += 1
+            logger.info("Client disconnected, closing the event stream")
+            closing: asyncio.Future
+            if not pending.done():
+                pending.cancel()
+                closing = pending
+            else:
+                closing = asyncio.ensure_future(events.aclose())
+            _closing.add(closing)
+            closing.add_done_callback(_closing.discard)
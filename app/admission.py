@@ -0,0 +1,27 @@
+from typing import Any, Iterator
+
+import streamlit as st
+from phi.conversation import Conversation
+
+from llm.admission import AdmissionRejected, admission_controller, estimate_tokens
+from llm.conversations.rag import RAGConversation
+from llm.settings import llm_settings
+
+
+def stream_response(conversation: Conversation, message: Any) -> Iterator[str]:
+    """Stream the response within the user's llm limits, shows a warning when the request is rejected"""
+
+    if not llm_settings.admission_enabled:
+        yield from conversation.run(message)  # type: ignore
+        return
+
+    user_name = conversation.user_name or "anonymous"
+    model = conversation.llm.model
+    tokens = estimate_tokens(model, getattr(conversation.llm, "max_tokens", None))
+    try:
+        with admission_controller.admit(user_name, model, tokens) as admission:
+            yield from conversation.run(message)  # type: ignore
+            if isinstance(conversation, RAGConversation):
+                admission.used_tokens = conversation.get_used_tokens()
+    except AdmissionRejected as e:
+        st.warning(f"Too many requests, please retry in {e.retry_after:.0f} seconds")
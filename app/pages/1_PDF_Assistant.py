@@ -2,15 +2,16 @@ from typing import List
 
 import streamlit as st
 from phi.conversation import Conversation
-from phi.document import Document
-from phi.document.reader.pdf import PDFReader
 
+from app.admission import stream_response
 from app.openai_key import get_openai_key
 from app.password import check_password
 from app.reload import reload_button
 from app.user_name import get_user_name
 from llm.conversations.pdf_auto import get_pdf_auto_conversation
 from llm.conversations.pdf_rag import get_pdf_rag_conversation
+from llm.ingestion.knowledge_base import PipelinedKnowledgeBase
+from llm.ingestion.pdf_reader import StreamingPDFReader
 from utils.log import logger
 
 
@@ -109,11 +110,13 @@ def main() -> None:
         with st.chat_message("assistant"):
             response = ""
             resp_container = st.empty()
-            for delta in pdf_conversation.run(question):
+            for delta in stream_response(pdf_conversation, question):
                 response += delta  # type: ignore
                 resp_container.markdown(response)
 
-            st.session_state["messages"].append({"role": "assistant", "content": response})
+            # Rejected requests have no response
+            if response != "":
+                st.session_state["messages"].append({"role": "assistant", "content": response})
 
     if st.sidebar.button("New Conversation"):
         restart_conversation()
@@ -146,11 +149,19 @@ def main() -> None:
             alert = st.sidebar.info("Processing PDF...", icon="ℹ️")
             pdf_name = uploaded_file.name.split(".")[0]
             if f"{pdf_name}_uploaded" not in st.session_state:
-                reader = PDFReader()
-                pdf_documents: List[Document] = reader.read(uploaded_file)
-                if pdf_documents:
-                    pdf_conversation.knowledge_base.load_documents(pdf_documents)
+                chunker = getattr(pdf_conversation.knowledge_base, "chunker", None)
+                reader = StreamingPDFReader(chunk=chunker is None)
+                pdf_documents = reader.iter_documents(uploaded_file)
+                if chunker is not None:
+                    pdf_documents = chunker.iter_chunks(pdf_documents)
+                # Pages are embedded and inserted in batches as they are read
+                if isinstance(pdf_conversation.knowledge_base, PipelinedKnowledgeBase):
+                    num_documents = pdf_conversation.knowledge_base.load_document_stream(pdf_documents)
                 else:
+                    pdf_document_list = list(pdf_documents)
+                    pdf_conversation.knowledge_base.load_documents(pdf_document_list)
+                    num_documents = len(pdf_document_list)
+                if num_documents == 0:
                     st.sidebar.error("Could not read PDF")
                 st.session_state[f"{pdf_name}_uploaded"] = True
             alert.empty()
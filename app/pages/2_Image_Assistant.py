@@ -6,6 +6,7 @@ import streamlit as st
 from PIL import Image
 from phi.conversation import Conversation
 
+from app.admission import stream_response
 from app.openai_key import get_openai_key
 from app.password import check_password
 from app.reload import reload_button
@@ -211,10 +212,12 @@ def main() -> None:
         with st.chat_message("assistant"):
             response = ""
             resp_container = st.empty()
-            for delta in image_conversation.run(question):
+            for delta in stream_response(image_conversation, question):
                 response += delta  # type: ignore
                 resp_container.markdown(response)
-            st.session_state["messages"].append({"role": "assistant", "content": response})
+            # Rejected requests have no response
+            if response != "":
+                st.session_state["messages"].append({"role": "assistant", "content": response})
 
     if image_conversation.storage:
         all_image_conversation_ids: List[str] = image_conversation.storage.get_all_conversation_ids(
@@ -4,6 +4,7 @@ import streamlit as st
 from phi.conversation import Conversation
 from phi.knowledge.website import WebsiteKnowledgeBase
 
+from app.admission import stream_response
 from app.openai_key import get_openai_key
 from app.password import check_password
 from app.reload import reload_button
@@ -106,11 +107,13 @@ def main() -> None:
         with st.chat_message("assistant"):
             response = ""
             resp_container = st.empty()
-            for delta in website_conversation.run(question):
+            for delta in stream_response(website_conversation, question):
                 response += delta  # type: ignore
                 resp_container.markdown(response)
 
-            st.session_state["messages"].append({"role": "assistant", "content": response})
+            # Rejected requests have no response
+            if response != "":
+                st.session_state["messages"].append({"role": "assistant", "content": response})
 
     if st.sidebar.button("New Conversation"):
         restart_conversation()
@@ -0,0 +1,40 @@
+"""Vector indexes
+
+Revision ID: 173382b9e54c
+Revises:
+Create Date: 2026-10-18 09:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "173382b9e54c"
+down_revision: Union[str, None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Vector db collections created in llm/knowledge_base.py
+collections = ["url_pdf_documents", "local_pdf_documents", "pdf_documents", "website_documents"]
+
+
+def upgrade() -> None:
+    # Collections are created when a knowledge base is first loaded so only index the existing ones.
+    # Indexes are built concurrently, which can not run inside a transaction.
+    with op.get_context().autocommit_block():
+        for collection in collections:
+            if op.get_bind().execute(sa.text(f"SELECT to_regclass('llm.{collection}')")).scalar() is None:
+                continue
+            op.execute(
+                f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {collection}_hnsw_index ON llm.{collection} "
+                "USING hnsw (embedding vector_cosine_ops) WITH (m = 16, ef_construction = 64)"
+            )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        for collection in collections:
+            op.execute(f"DROP INDEX CONCURRENTLY IF EXISTS llm.{collection}_hnsw_index")
@@ -0,0 +1,45 @@
+"""Conversation list indexes
+
+Revision ID: 4b8e1f6a2d7c
+Revises: 9d4f2b7c1e3a
+Create Date: 2026-10-18 14:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "4b8e1f6a2d7c"
+down_revision: Union[str, None] = "9d4f2b7c1e3a"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Conversation tables created in llm/storage.py
+tables = ["pdf_conversations", "vision_conversations", "website_conversations"]
+
+
+def upgrade() -> None:
+    # PagedConversationStorage lists conversations from (user_name, updated_at, id), rows written before
+    # it set updated_at on every upsert would be missing from the lists.
+    for table in tables:
+        if op.get_bind().execute(sa.text(f"SELECT to_regclass('llm.{table}')")).scalar() is None:
+            continue
+        op.execute(f"UPDATE llm.{table} SET updated_at = created_at WHERE updated_at IS NULL")
+
+    with op.get_context().autocommit_block():
+        for table in tables:
+            if op.get_bind().execute(sa.text(f"SELECT to_regclass('llm.{table}')")).scalar() is None:
+                continue
+            op.execute(
+                f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {table}_user_updated_idx "
+                f"ON llm.{table} (user_name, updated_at DESC, id DESC)"
+            )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        for table in tables:
+            op.execute(f"DROP INDEX CONCURRENTLY IF EXISTS llm.{table}_user_updated_idx")
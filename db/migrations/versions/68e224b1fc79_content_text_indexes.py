@@ -0,0 +1,39 @@
+"""Content text indexes
+
+Revision ID: 68e224b1fc79
+Revises: 173382b9e54c
+Create Date: 2026-10-18 10:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "68e224b1fc79"
+down_revision: Union[str, None] = "173382b9e54c"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Vector db collections created in llm/knowledge_base.py
+collections = ["url_pdf_documents", "local_pdf_documents", "pdf_documents", "website_documents"]
+
+
+def upgrade() -> None:
+    # GIN indexes used by hybrid search, the expression must match PgVectorDb._content_tsvector()
+    with op.get_context().autocommit_block():
+        for collection in collections:
+            if op.get_bind().execute(sa.text(f"SELECT to_regclass('llm.{collection}')")).scalar() is None:
+                continue
+            op.execute(
+                f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {collection}_content_fts_index ON llm.{collection} "
+                "USING gin (to_tsvector('english', content))"
+            )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        for collection in collections:
+            op.execute(f"DROP INDEX CONCURRENTLY IF EXISTS llm.{collection}_content_fts_index")
@@ -0,0 +1,39 @@
+"""Content hash indexes
+
+Revision ID: 9d4f2b7c1e3a
+Revises: 68e224b1fc79
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "9d4f2b7c1e3a"
+down_revision: Union[str, None] = "68e224b1fc79"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Vector db collections created in llm/knowledge_base.py
+collections = ["url_pdf_documents", "local_pdf_documents", "pdf_documents", "website_documents"]
+
+
+def upgrade() -> None:
+    # Used to find existing documents and to merge the staging table written by PgVectorDb.copy_embedded
+    with op.get_context().autocommit_block():
+        for collection in collections:
+            if op.get_bind().execute(sa.text(f"SELECT to_regclass('llm.{collection}')")).scalar() is None:
+                continue
+            op.execute(
+                f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {collection}_content_hash_index "
+                f"ON llm.{collection} (content_hash)"
+            )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        for collection in collections:
+            op.execute(f"DROP INDEX CONCURRENTLY IF EXISTS llm.{collection}_content_hash_index")
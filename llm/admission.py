@@ -0,0 +1,309 @@
+import asyncio
+import threading
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from time import monotonic
+from typing import Callable, Deque, Dict, Iterator, List, Optional
+
+import numpy as np
+
+from llm.settings import llm_settings
+
+
+class AdmissionRejected(Exception):
+    """Raised when a request is not admitted, retry_after is the number of seconds to wait before retrying"""
+
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(f"Request rejected: {reason}, retry after {retry_after:.0f}s")
+        self.reason: str = reason
+        self.retry_after: float = retry_after
+
+
+def estimate_tokens(model: str, max_tokens: Optional[int] = None) -> int:
+    """Returns the llm tokens reserved for a request: the prompt token budget of the model and its max_tokens"""
+
+    budget = llm_settings.context_token_budgets.get(model, llm_settings.context_token_budget)
+    return budget + (max_tokens or llm_settings.default_max_tokens)
+
+
+class TokenBucket:
+    def __init__(self, capacity: float, rate: float):
+        """
+        :param capacity: Maximum number of tokens in the bucket.
+        :param rate: Number of tokens added per second.
+        """
+        self.capacity: float = capacity
+        self.rate: float = rate
+        self.tokens: float = capacity
+        self.updated_at: float = monotonic()
+
+    def refill(self, now: float) -> None:
+        # now can be taken before the bucket was created
+        if now <= self.updated_at:
+            return
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def take(self, tokens: float, now: float) -> float:
+        """Take the tokens and return 0, or return the seconds until the bucket has them"""
+
+        self.refill(now)
+        if self.tokens >= tokens:
+            self.tokens -= tokens
+            return 0
+        return (tokens - self.tokens) / self.rate
+
+    def give(self, tokens: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + tokens)
+
+
+@dataclass
+class Admission:
+    """A request holding a slot of its model, release it when the llm has answered"""
+
+    user_name: str
+    model: str
+    tokens: int
+    enqueued_at: float
+    admitted_at: Optional[float] = None
+    released: bool = False
+    # Set by the caller before release, the unused part of the reserved tokens is returned to the user
+    used_tokens: Optional[int] = None
+    # Called when a queued request is admitted
+    notify: Optional[Callable[[], None]] = None
+
+
+@dataclass
+class ModelQueue:
+    """Requests running and waiting for a model, waiting requests are queued per user and admitted round robin"""
+
+    max_concurrency: int
+    running: int = 0
+    waiting: "OrderedDict[str, Deque[Admission]]" = field(default_factory=OrderedDict)
+    num_waiting: int = 0
+
+    def next(self) -> Admission:
+        user_name, admissions = next(iter(self.waiting.items()))
+        admission = admissions.popleft()
+        # The user moves to the back of the queue
+        del self.waiting[user_name]
+        if len(admissions) > 0:
+            self.waiting[user_name] = admissions
+        self.num_waiting -= 1
+        return admission
+
+    def remove(self, admission: Admission) -> None:
+        admissions = self.waiting[admission.user_name]
+        admissions.remove(admission)
+        if len(admissions) == 0:
+            del self.waiting[admission.user_name]
+        self.num_waiting -= 1
+
+
+class AdmissionController:
+    def __init__(
+        self,
+        user_tokens: int = llm_settings.admission_user_tokens,
+        user_tokens_per_minute: int = llm_settings.admission_user_tokens_per_minute,
+        max_concurrency: Optional[Dict[str, int]] = None,
+        default_max_concurrency: int = llm_settings.llm_default_max_concurrency,
+        queue_size: int = llm_settings.admission_queue_size,
+        queue_timeout: float = llm_settings.admission_queue_timeout,
+    ):
+        """
+        Admits llm requests within per user token buckets and a concurrency limit per model.
+
+        Requests over the user's token bucket are rejected. Requests over the model's concurrency
+        limit wait in a queue shared fairly between users, and are rejected when the queue is full
+        or they waited queue_timeout seconds. Limits apply to the requests of this process, so the
+        effective cap per model is its max_concurrency times the number of Api and Streamlit processes.
+
+        :param user_tokens: Size of each user's token bucket, in llm tokens.
+        :param user_tokens_per_minute: Tokens added to each user's bucket per minute.
+        :param max_concurrency: Maximum number of requests in flight per model.
+        :param default_max_concurrency: Maximum number of requests in flight for models not in max_concurrency.
+        :param queue_size: Maximum number of requests waiting per model.
+        :param queue_timeout: Maximum number of seconds a request waits.
+        """
+        self.user_tokens: int = user_tokens
+        self.user_tokens_per_minute: int = user_tokens_per_minute
+        self.max_concurrency: Dict[str, int] = (
+            max_concurrency if max_concurrency is not None else llm_settings.llm_max_concurrency
+        )
+        self.default_max_concurrency: int = default_max_concurrency
+        self.queue_size: int = queue_size
+        self.queue_timeout: float = queue_timeout
+
+        self.lock = threading.Lock()
+        self.buckets: Dict[str, TokenBucket] = {}
+        self.models: Dict[str, ModelQueue] = {}
+
+        # Metrics
+        self.admitted: int = 0
+        self.queued: int = 0
+        self.rejected: Dict[str, int] = {"rate_limited": 0, "queue_full": 0, "queue_timeout": 0}
+        self.wait_times: Deque[float] = deque(maxlen=1000)
+        # Moving average of the seconds a request holds its slot, used to estimate retry_after
+        self.average_duration: float = 10
+
+    def get_model_queue(self, model: str) -> ModelQueue:
+        if model not in self.models:
+            self.models[model] = ModelQueue(
+                max_concurrency=self.max_concurrency.get(model, self.default_max_concurrency)
+            )
+        return self.models[model]
+
+    def reserve(self, user_name: str, model: str, tokens: int, notify: Callable[[], None]) -> Admission:
+        """Take the tokens and a slot of the model, or queue the request. Raises AdmissionRejected."""
+
+        now = monotonic()
+        with self.lock:
+            bucket = self.buckets.get(user_name)
+            if bucket is None:
+                bucket = TokenBucket(capacity=self.user_tokens, rate=self.user_tokens_per_minute / 60)
+                self.buckets[user_name] = bucket
+            # Requests larger than the bucket are admitted when it is full
+            retry_after = bucket.take(min(tokens, bucket.capacity), now)
+            if retry_after > 0:
+                self.rejected["rate_limited"] += 1
+                raise AdmissionRejected("rate_limited", retry_after)
+
+            admission = Admission(
+                user_name=user_name, model=model, tokens=tokens, enqueued_at=now, notify=notify
+            )
+            queue = self.get_model_queue(model)
+            if queue.running < queue.max_concurrency and queue.num_waiting == 0:
+                self._admit(queue, admission, now)
+                return admission
+
+            if queue.num_waiting >= self.queue_size:
+                bucket.give(min(tokens, bucket.capacity))
+                self.rejected["queue_full"] += 1
+                raise AdmissionRejected(
+                    "queue_full", self.average_duration * (queue.num_waiting + 1) / queue.max_concurrency
+                )
+            queue.waiting.setdefault(user_name, deque()).append(admission)
+            queue.num_waiting += 1
+            self.queued += 1
+            return admission
+
+    def _admit(self, queue: ModelQueue, admission: Admission, now: float) -> None:
+        queue.running += 1
+        admission.admitted_at = now
+        self.admitted += 1
+        self.wait_times.append(now - admission.enqueued_at)
+
+    def cancel(self, admission: Admission) -> bool:
+        """Remove a queued request, returns False if it was admitted in the meantime"""
+
+        with self.lock:
+            if admission.admitted_at is not None:
+                return False
+            self.get_model_queue(admission.model).remove(admission)
+            bucket = self.buckets.get(admission.user_name)
+            if bucket is not None:
+                bucket.give(min(admission.tokens, bucket.capacity))
+            return True
+
+    def release(self, admission: Admission) -> None:
+        """Free the slot of an admitted request and admit the next queued request"""
+
+        now = monotonic()
+        to_notify: List[Admission] = []
+        with self.lock:
+            if admission.released or admission.admitted_at is None:
+                return
+            admission.released = True
+            self.average_duration = 0.9 * self.average_duration + 0.1 * (now - admission.admitted_at)
+            bucket = self.buckets.get(admission.user_name)
+            if admission.used_tokens is not None and bucket is not None:
+                reserved = min(admission.tokens, bucket.capacity)
+                if admission.used_tokens < reserved:
+                    bucket.give(reserved - admission.used_tokens)
+
+            queue = self.get_model_queue(admission.model)
+            queue.running -= 1
+            while queue.running < queue.max_concurrency and queue.num_waiting > 0:
+                next_admission = queue.next()
+                self._admit(queue, next_admission, now)
+                to_notify.append(next_admission)
+        for next_admission in to_notify:
+            if next_admission.notify is not None:
+                next_admission.notify()
+
+    def timeout(self, admission: Admission) -> None:
+        """Reject a request which waited too long, unless it was admitted in the meantime"""
+
+        if self.cancel(admission):
+            with self.lock:
+                self.rejected["queue_timeout"] += 1
+            raise AdmissionRejected("queue_timeout", self.average_duration)
+
+    @contextmanager
+    def admit(self, user_name: str, model: str, tokens: int) -> Iterator[Admission]:
+        """Hold a slot of the model while the block runs, waiting in the queue if needed. Raises AdmissionRejected."""
+
+        admitted = threading.Event()
+        admission = self.reserve(user_name, model, tokens, notify=admitted.set)
+        if admission.admitted_at is None and not admitted.wait(self.queue_timeout):
+            self.timeout(admission)
+        try:
+            yield admission
+        finally:
+            self.release(admission)
+
+    async def aadmit(self, user_name: str, model: str, tokens: int) -> Admission:
+        """Wait for a slot of the model without blocking the event loop, the caller releases it.
+
+        Raises AdmissionRejected.
+        """
+
+        loop = asyncio.get_running_loop()
+        admitted = asyncio.Event()
+
+        def notify() -> None:
+            # release can be called from any thread
+            loop.call_soon_threadsafe(admitted.set)
+
+        admission = self.reserve(user_name, model, tokens, notify=notify)
+        if admission.admitted_at is not None:
+            return admission
+        try:
+            await asyncio.wait_for(admitted.wait(), timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.timeout(admission)
+        except asyncio.CancelledError:
+            if not self.cancel(admission):
+                self.release(admission)
+            raise
+        return admission
+
+    def stats(self) -> Dict:
+        with self.lock:
+            wait_times = list(self.wait_times)
+            models = {
+                model: {
+                    "max_concurrency": queue.max_concurrency,
+                    "running": queue.running,
+                    "waiting": queue.num_waiting,
+                    "waiting_users": len(queue.waiting),
+                }
+                for model, queue in self.models.items()
+            }
+            stats = {
+                "admitted": self.admitted,
+                "queued": self.queued,
+                "rejected": dict(self.rejected),
+                "users": len(self.buckets),
+                "average_duration": self.average_duration,
+                "models": models,
+            }
+        if len(wait_times) > 0:
+            p50, p95, p99 = np.percentile(wait_times, [50, 95, 99])
+            stats["wait_time"] = {"p50": p50, "p95": p95, "p99": p99, "max": max(wait_times)}
+        return stats
+
+
+# Shared by the requests of this process
+admission_controller = AdmissionController()
@@ -0,0 +1,199 @@
+from dataclasses import dataclass
+from typing import List, Optional
+
+from pgvector.sqlalchemy import Vector
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.engine import Engine, create_engine
+from sqlalchemy.inspection import inspect
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.schema import Column, Index, MetaData, Table
+from sqlalchemy.sql.expression import func, select, text
+from sqlalchemy.types import BigInteger, DateTime, Integer, String
+
+from utils.log import logger
+
+
+@dataclass
+class AnswerLookup:
+    # Version of the knowledge base the lookup was made against, answers are stored with this version
+    version: int
+    answer: Optional[str] = None
+
+
+class AnswerCache:
+    def __init__(
+        self,
+        table_name: str = "answer_cache",
+        schema: Optional[str] = "llm",
+        db_url: Optional[str] = None,
+        db_engine: Optional[Engine] = None,
+        similarity_threshold: float = 0.95,
+        ttl: Optional[int] = None,
+    ):
+        """
+        Stores answers keyed by (knowledge base version, question embedding).
+
+        A question is answered from the cache when a stored question for the same collection
+        and version has a cosine similarity of at least similarity_threshold.
+        Invalidating a collection increments its version, so answers created from
+        the previous contents are no longer returned.
+
+        :param table_name: The name of the table to store answers in.
+        :param schema: The schema to store the table in.
+        :param db_url: The database URL to connect to.
+        :param db_engine: The database engine to use.
+        :param similarity_threshold: Minimum cosine similarity between questions for a cache hit.
+        :param ttl: Number of seconds an answer is returned for, answers never expire when None.
+        """
+        _engine: Optional[Engine] = db_engine
+        if _engine is None and db_url is not None:
+            _engine = create_engine(db_url)
+
+        if _engine is None:
+            raise ValueError("Must provide either db_url or db_engine")
+
+        # Database attributes
+        self.table_name: str = table_name
+        self.schema: Optional[str] = schema
+        self.db_engine: Engine = _engine
+        self.metadata: MetaData = MetaData(schema=self.schema)
+
+        # Lookup attributes
+        self.similarity_threshold: float = similarity_threshold
+        self.ttl: Optional[int] = ttl
+
+        # Database session
+        self.Session: sessionmaker[Session] = sessionmaker(bind=self.db_engine)
+
+        # Database tables for the answers and the knowledge base versions
+        self.table: Table = self.get_table()
+        self.versions_table: Table = self.get_versions_table()
+        self.table_created: bool = False
+
+    def get_table(self) -> Table:
+        return Table(
+            self.table_name,
+            self.metadata,
+            Column("id", BigInteger, primary_key=True, autoincrement=True),
+            # Vector db collection of the knowledge base used to answer the question
+            Column("collection", String, nullable=False),
+            # Version of the collection when the answer was created
+            Column("version", Integer, nullable=False),
+            Column("question", postgresql.TEXT),
+            # Untyped vector so collections with different embedders share the table
+            Column("embedding", Vector()),
+            Column("answer", postgresql.TEXT),
+            Column("hits", Integer, server_default=text("0")),
+            Column("created_at", DateTime(timezone=True), server_default=text("now()")),
+            Column("last_hit_at", DateTime(timezone=True)),
+            Index(f"{self.table_name}_collection_version_idx", "collection", "version"),
+            extend_existing=True,
+        )
+
+    def get_versions_table(self) -> Table:
+        return Table(
+            f"{self.table_name}_versions",
+            self.metadata,
+            Column("collection", String, primary_key=True),
+            Column("version", Integer, nullable=False),
+            Column("updated_at", DateTime(timezone=True), server_default=text("now()")),
+            extend_existing=True,
+        )
+
+    def table_exists(self) -> bool:
+        logger.debug(f"Checking if table exists: {self.table.name}")
+        try:
+            return inspect(self.db_engine).has_table(self.table.name, schema=self.schema)
+        except Exception as e:
+            logger.error(e)
+            return False
+
+    def create(self) -> None:
+        if self.table_created:
+            return
+        if not self.table_exists():
+            with self.Session() as sess, sess.begin():
+                logger.debug("Creating extension: vector")
+                sess.execute(text("create extension if not exists vector;"))
+                if self.schema is not None:
+                    logger.debug(f"Creating schema: {self.schema}")
+                    sess.execute(text(f"create schema if not exists {self.schema};"))
+            logger.debug(f"Creating table: {self.table_name}")
+            self.metadata.create_all(self.db_engine, tables=[self.table, self.versions_table])
+        self.table_created = True
+
+    def lookup(self, collection: str, embedding: List[float]) -> AnswerLookup:
+        """Returns the current version of the collection and the answer to the most similar question"""
+
+        self.create()
+        with self.Session() as sess, sess.begin():
+            version = (
+                sess.execute(
+                    select(self.versions_table.c.version).where(
+                        self.versions_table.c.collection == collection
+                    )
+                ).scalar()
+                or 0
+            )
+
+            distance = self.table.c.embedding.cosine_distance(embedding)
+            stmt = (
+                select(self.table.c.id, self.table.c.answer)
+                .where(
+                    self.table.c.collection == collection,
+                    self.table.c.version == version,
+                    distance <= 1 - self.similarity_threshold,
+                )
+                .order_by(distance)
+                .limit(1)
+            )
+            if self.ttl is not None:
+                stmt = stmt.where(
+                    self.table.c.created_at > func.now() - text(f"interval '{int(self.ttl)} seconds'")
+                )
+            row = sess.execute(stmt).first()
+            if row is None:
+                return AnswerLookup(version=version)
+
+            sess.execute(
+                self.table.update()
+                .where(self.table.c.id == row.id)
+                .values(hits=self.table.c.hits + 1, last_hit_at=func.now())
+            )
+            return AnswerLookup(version=version, answer=row.answer)
+
+    def store(
+        self, collection: str, version: int, question: str, embedding: List[float], answer: str
+    ) -> None:
+        """Store an answer created from the given version of the collection"""
+
+        self.create()
+        with self.Session() as sess, sess.begin():
+            sess.execute(
+                self.table.insert().values(
+                    collection=collection,
+                    version=version,
+                    question=question,
+                    embedding=embedding,
+                    answer=answer,
+                )
+            )
+
+    def invalidate(self, collection: str) -> None:
+        """Increment the version of the collection and delete the answers for previous versions"""
+
+        self.create()
+        with self.Session() as sess, sess.begin():
+            stmt = postgresql.insert(self.versions_table).values(collection=collection, version=1)
+            version = sess.execute(
+                stmt.on_conflict_do_update(
+                    index_elements=["collection"],
+                    set_=dict(version=self.versions_table.c.version + 1, updated_at=func.now()),
+                ).returning(self.versions_table.c.version)
+            ).scalar_one()
+            sess.execute(
+                self.table.delete().where(
+                    self.table.c.collection == collection, self.table.c.version < version
+                )
+            )
+        logger.debug(f"Invalidated answer cache for {collection}, version: {version}")
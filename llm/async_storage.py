@@ -0,0 +1,83 @@
+from typing import Any, Optional
+
+from phi.conversation import ConversationRow
+from phi.storage.conversation.postgres import PgConversationStorage
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+from sqlalchemy.sql.expression import func, select
+
+from llm.settings import llm_settings
+
+
+class AsyncConversationStorage:
+    def __init__(
+        self,
+        storage: PgConversationStorage,
+        pool_size: int = llm_settings.async_db_pool_size,
+        max_overflow: int = llm_settings.async_db_max_overflow,
+    ):
+        """
+        Reads and writes the conversations of a PgConversationStorage without blocking the event loop.
+
+        The table is created by the synchronous storage, conversations are created with Conversation.start().
+
+        :param storage: The storage whose table is used.
+        :param pool_size: Number of connections kept open by the async engine.
+        :param max_overflow: Number of connections opened beyond pool_size under load.
+        """
+        self.storage: PgConversationStorage = storage
+        self.pool_size: int = pool_size
+        self.max_overflow: int = max_overflow
+        self._engine: Optional[AsyncEngine] = None
+
+    @property
+    def engine(self) -> AsyncEngine:
+        # Created on first use so the engine belongs to the event loop of the Api
+        if self._engine is None:
+            if self.storage.db_url is None:
+                raise ValueError("AsyncConversationStorage requires a storage created with a db_url")
+            self._engine = create_async_engine(
+                self.storage.db_url,
+                pool_size=self.pool_size,
+                max_overflow=self.max_overflow,
+                pool_pre_ping=True,
+            )
+        return self._engine
+
+    async def read(self, conversation_id: str) -> Optional[ConversationRow]:
+        table = self.storage.table
+        async with self.engine.connect() as conn:
+            row = (await conn.execute(select(table).where(table.c.id == conversation_id))).first()
+        return ConversationRow.model_validate(row) if row is not None else None
+
+    async def upsert(self, conversation: ConversationRow) -> Optional[ConversationRow]:
+        """Create or update the conversation and return the stored row"""
+
+        table = self.storage.table
+        values: Any = dict(
+            name=conversation.name,
+            user_name=conversation.user_name,
+            user_type=conversation.user_type,
+            is_active=conversation.is_active,
+            llm=conversation.llm,
+            memory=conversation.memory,
+            meta_data=conversation.meta_data,
+            extra_data=conversation.extra_data,
+            # on_conflict_do_update does not apply the onupdate of the column
+            updated_at=func.now(),
+        )
+        # Returns the row from the upsert instead of reading it again like PgConversationStorage.upsert
+        stmt = (
+            postgresql.insert(table)
+            .values(id=conversation.id, **values)
+            .on_conflict_do_update(index_elements=["id"], set_=values)
+            .returning(table)
+        )
+        async with self.engine.begin() as conn:
+            row = (await conn.execute(stmt)).first()
+        return ConversationRow.model_validate(row) if row is not None else None
+
+    async def close(self) -> None:
+        if self._engine is not None:
+            await self._engine.dispose()
+            self._engine = None
@@ -0,0 +1,204 @@
+import asyncio
+from pathlib import Path
+from time import perf_counter
+from typing import AsyncIterator, Callable, Dict, Iterable, List, Optional
+
+import numpy as np
+import typer
+from phi.conversation import Conversation
+from pydantic import BaseModel, ValidationError
+
+from llm.admission import Admission, AdmissionRejected, admission_controller, estimate_tokens
+from llm.conversations.pdf_rag import get_pdf_rag_conversation
+from llm.conversations.rag import RAGConversation
+from llm.conversations.website_rag import get_website_rag_conversation
+from llm.settings import llm_settings
+from utils.log import logger
+
+# Conversations which can answer batches of questions
+batch_conversations: Dict[str, Callable[..., Conversation]] = {
+    "pdf": get_pdf_rag_conversation,
+    "website": get_website_rag_conversation,
+}
+
+
+class BatchQuestion(BaseModel):
+    question: str
+    # Copied to the answer to match answers to questions
+    id: Optional[str] = None
+
+
+class BatchAnswer(BaseModel):
+    # Line of the question in the batch
+    index: int
+    id: Optional[str] = None
+    question: str
+    answer: Optional[str] = None
+    error: Optional[str] = None
+    # Seconds until the first token and the full answer
+    first_token_latency: Optional[float] = None
+    latency: float = 0
+    prompt_tokens: Optional[int] = None
+    completion_tokens: Optional[int] = None
+    # Ids of the references sent to the llm, in rank order
+    references: List[str] = []
+    timings: Dict[str, float] = {}
+
+
+def parse_questions(lines: Iterable[str]) -> List[BatchQuestion]:
+    """Parse a JSONL batch of questions, blank lines are skipped"""
+
+    questions: List[BatchQuestion] = []
+    for line_number, line in enumerate(lines, start=1):
+        if line.strip() == "":
+            continue
+        try:
+            questions.append(BatchQuestion.model_validate_json(line))
+        except ValidationError as e:
+            raise ValueError(f"Invalid question on line {line_number}: {e}")
+    return questions
+
+
+def get_batch_conversation(conversation_type: str = "pdf") -> Conversation:
+    """Get a conversation which is not stored, monitored, answered from the answer cache or coalesced"""
+
+    if conversation_type not in batch_conversations:
+        raise ValueError(f"Unknown conversation type: {conversation_type}")
+    conversation = batch_conversations[conversation_type](use_answer_cache=False, coalesce_requests=False)
+    conversation.storage = None
+    conversation.monitoring = False
+    if isinstance(conversation, RAGConversation):
+        conversation.async_storage = None
+    return conversation
+
+
+def get_completion_tokens(conversation: Conversation) -> Optional[int]:
+    for message in reversed(conversation.memory.llm_messages):
+        if message.role == "assistant":
+            return message.metrics.get("completion_tokens")
+    return None
+
+
+async def answer_question(index: int, question: BatchQuestion, conversation: Conversation) -> BatchAnswer:
+    """Answer the question with a new conversation and record its latency, token usage and references"""
+
+    result = BatchAnswer(index=index, id=question.id, question=question.question)
+    start = perf_counter()
+    try:
+        if isinstance(conversation, RAGConversation) and conversation.supports_async():
+            answer = "".join([chunk async for chunk in conversation.arun(question.question)])
+        else:
+            answer = str(await asyncio.to_thread(conversation.run, question.question, stream=False))
+        result.answer = answer.strip()
+    except Exception as e:
+        logger.warning(f"Failed to answer question {index}: {e}")
+        result.error = str(e)
+    result.latency = perf_counter() - start
+
+    result.completion_tokens = get_completion_tokens(conversation)
+    if isinstance(conversation, RAGConversation):
+        result.first_token_latency = conversation.timings.get("first_token")
+        result.timings = conversation.timings
+        if conversation.context_report is not None:
+            result.prompt_tokens = conversation.context_report.total_tokens
+            result.references = conversation.context_report.references
+    return result
+
+
+async def admit_question(user_name: str, conversation: Conversation) -> Admission:
+    """Wait until the question is admitted, batch questions wait for the user's token bucket instead of failing"""
+
+    model = conversation.llm.model
+    tokens = estimate_tokens(model, getattr(conversation.llm, "max_tokens", None))
+    while True:
+        try:
+            return await admission_controller.aadmit(user_name, model, tokens)
+        except AdmissionRejected as e:
+            logger.debug(f"Batch question of {user_name} {e.reason}, retrying in {e.retry_after:.1f}s")
+            await asyncio.sleep(e.retry_after)
+
+
+async def run_batch(
+    questions: List[BatchQuestion],
+    concurrency: int = llm_settings.batch_concurrency,
+    conversation_type: str = "pdf",
+    user_name: Optional[str] = None,
+) -> AsyncIterator[BatchAnswer]:
+    """Answer the questions with at most concurrency questions in flight, yielding answers as they finish.
+
+    When user_name is set each question is admitted within the user's llm limits, like a chat message.
+    """
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def answer(index: int, question: BatchQuestion) -> BatchAnswer:
+        async with semaphore:
+            conversation = get_batch_conversation(conversation_type)
+            if user_name is None or not llm_settings.admission_enabled:
+                return await answer_question(index, question, conversation)
+            admission = await admit_question(user_name, conversation)
+            try:
+                result = await answer_question(index, question, conversation)
+                if result.prompt_tokens is not None:
+                    admission.used_tokens = result.prompt_tokens + (result.completion_tokens or 0)
+                return result
+            finally:
+                admission_controller.release(admission)
+
+    tasks = [asyncio.ensure_future(answer(index, question)) for index, question in enumerate(questions)]
+    try:
+        for next_answer in asyncio.as_completed(tasks):
+            yield await next_answer
+    finally:
+        # Stops the remaining questions when the batch is abandoned
+        for task in tasks:
+            task.cancel()
+
+
+def summarize(answers: List[BatchAnswer], elapsed: float) -> str:
+    summary = (
+        f"{len(answers)} questions in {elapsed:.1f}s, {sum(a.error is not None for a in answers)} failed"
+    )
+    for label, values in (
+        ("latency", [a.latency for a in answers if a.error is None]),
+        ("first token", [a.first_token_latency for a in answers if a.first_token_latency is not None]),
+    ):
+        if len(values) > 0:
+            p50, p95, p99 = np.percentile(values, [50, 95, 99])
+            summary += f"\n{label:<12} p50: {p50:.2f}s  p95: {p95:.2f}s  p99: {p99:.2f}s"
+    return summary
+
+
+def main(
+    questions_file: Path = typer.Argument(
+        ..., help="JSONL file of questions, e.g. {'id': '1', 'question': '...'}"
+    ),
+    answers_file: Path = typer.Argument(..., help="JSONL file the answers are written to"),
+    concurrency: int = typer.Option(llm_settings.batch_concurrency, min=1, help="Questions answered at once"),
+    conversation_type: str = typer.Option("pdf", help=f"One of {', '.join(batch_conversations)}"),
+) -> None:
+    """Answer a batch of questions without storing conversations.
+
+    Answers are written in the order they finish: python -m llm.batch questions.jsonl answers.jsonl
+    """
+
+    questions = parse_questions(questions_file.read_text().splitlines())
+
+    async def run() -> List[BatchAnswer]:
+        answers: List[BatchAnswer] = []
+        with answers_file.open("w") as out:
+            async for answer in run_batch(
+                questions, concurrency=concurrency, conversation_type=conversation_type
+            ):
+                out.write(answer.model_dump_json() + "\n")
+                out.flush()
+                answers.append(answer)
+        return answers
+
+    start = perf_counter()
+    answers = asyncio.run(run())
+    logger.info(summarize(answers, perf_counter() - start))
+
+
+if __name__ == "__main__":
+    typer.run(main)
@@ -0,0 +1,129 @@
+import asyncio
+from typing import AsyncGenerator, Callable, Coroutine, Dict, Hashable, List, Optional, Set
+
+from phi.llm.message import Message
+from phi.task.llm import References
+
+from llm.context import ContextReport
+from utils.log import logger
+
+
+class Flight:
+    """An answer being streamed, its chunks are sent to every request subscribed to it"""
+
+    def __init__(self) -> None:
+        self.chunks: List[str] = []
+        self.done: bool = False
+        self.error: Optional[BaseException] = None
+        # Set before the first chunk, None when the answer came from the answer cache
+        self.messages: Optional[List[Message]] = None
+        self.references: Optional[References] = None
+        self.context_report: Optional[ContextReport] = None
+        self.subscribers: int = 0
+        self.task: Optional[asyncio.Task] = None
+        # Resolved and replaced whenever a chunk is published or the flight finishes
+        self.updated: asyncio.Future = asyncio.get_running_loop().create_future()
+
+    def notify(self) -> None:
+        self.updated.set_result(None)
+        self.updated = asyncio.get_running_loop().create_future()
+
+    def publish(self, chunk: str) -> None:
+        self.chunks.append(chunk)
+        self.notify()
+
+    def finish(self, error: Optional[BaseException] = None) -> None:
+        if self.done:
+            return
+        self.done = True
+        self.error = error
+        self.notify()
+
+
+class RequestCoalescer:
+    def __init__(self) -> None:
+        """
+        Answers identical requests which arrive while one is being answered with a single llm stream.
+
+        The answer is produced in its own task and fanned out to every subscriber, a subscriber which joins
+        late first receives the chunks already streamed. The answer is cancelled when its last subscriber leaves.
+        Flights are shared by the requests of this process, on one event loop.
+        """
+        self.flights: Dict[Hashable, Flight] = {}
+        # Keeps the answer tasks alive until they finish
+        self.tasks: Set[asyncio.Task] = set()
+
+        # Metrics
+        self.started: int = 0
+        self.joined: int = 0
+
+    def get(self, key: Hashable) -> Optional[Flight]:
+        flight = self.flights.get(key)
+        if (
+            flight is not None
+            and flight.task is not None
+            and flight.task.get_loop() is not asyncio.get_running_loop()
+        ):
+            return None
+        return flight
+
+    def start(self, key: Optional[Hashable], produce: Callable[[Flight], Coroutine]) -> Flight:
+        """Start producing an answer, requests with the same key join it until it is done. A None key is not shared."""
+
+        flight = Flight()
+
+        async def run() -> None:
+            try:
+                await produce(flight)
+                flight.finish()
+            except Exception as e:
+                flight.finish(e)
+            except asyncio.CancelledError as e:
+                flight.finish(e)
+                raise
+            finally:
+                if key is not None and self.flights.get(key) is flight:
+                    del self.flights[key]
+
+        if key is not None:
+            self.flights[key] = flight
+            self.started += 1
+        flight.task = asyncio.ensure_future(run())
+        self.tasks.add(flight.task)
+        flight.task.add_done_callback(self.tasks.discard)
+        return flight
+
+    def join(self, key: Hashable) -> Optional[Flight]:
+        flight = self.get(key)
+        if flight is not None:
+            self.joined += 1
+            logger.debug(f"Joining the answer in flight for {key}")
+        return flight
+
+    async def subscribe(self, flight: Flight) -> AsyncGenerator[str, None]:
+        """Yield the chunks of the answer, raises the error of the answer if it failed"""
+
+        flight.subscribers += 1
+        index = 0
+        try:
+            while True:
+                while index < len(flight.chunks):
+                    index += 1
+                    yield flight.chunks[index - 1]
+                if flight.done:
+                    break
+                await asyncio.shield(flight.updated)
+            if flight.error is not None:
+                raise flight.error
+        finally:
+            flight.subscribers -= 1
+            if flight.subscribers == 0 and not flight.done and flight.task is not None:
+                logger.info("Every request left, cancelling the answer")
+                flight.task.cancel()
+
+    def stats(self) -> Dict[str, int]:
+        return {"in_flight": len(self.flights), "started": self.started, "joined": self.joined}
+
+
+# Shared by the requests of this process
+request_coalescer = RequestCoalescer()
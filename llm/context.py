@@ -0,0 +1,164 @@
+import json
+from typing import Dict, List, Optional, Tuple
+
+from phi.document import Document
+from phi.llm.message import Message
+from pydantic import BaseModel
+
+from llm.ingestion.chunker import get_encoding
+from llm.settings import llm_settings
+from llm.vectordb import get_content_hash
+
+# Tokens added by the chat format around each message
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+def get_reference_id(document: Document) -> str:
+    """Returns an identifier for a reference, its name followed by its page and chunk when known"""
+
+    parts = [document.name or get_content_hash(document.content)]
+    for key in ("page", "chunk"):
+        if document.meta_data.get(key) is not None:
+            parts.append(f"{key[0]}{document.meta_data[key]}")
+    return ":".join(parts)
+
+
+class ContextReport(BaseModel):
+    """Tokens used and dropped when assembling the prompt for a message"""
+
+    model: str
+    budget: int
+    # System prompt and user prompt without references
+    prompt_tokens: int = 0
+    history_tokens: int = 0
+    history_messages: int = 0
+    dropped_history_messages: int = 0
+    reference_tokens: int = 0
+    # Ids of the references added to the prompt, in rank order
+    references: List[str] = []
+    # References which did not fit the budget
+    dropped_references: List[str] = []
+    # Candidates with the same content as a higher ranked candidate
+    duplicate_references: int = 0
+
+    @property
+    def total_tokens(self) -> int:
+        return self.prompt_tokens + self.history_tokens + self.reference_tokens
+
+    def summary(self) -> str:
+        return (
+            f"Context for {self.model}: {self.total_tokens}/{self.budget} tokens, "
+            f"prompt: {self.prompt_tokens}, "
+            f"history: {self.history_tokens} ({self.history_messages} messages, "
+            f"{self.dropped_history_messages} dropped), "
+            f"references: {self.reference_tokens} ({len(self.references)} used, "
+            f"{len(self.dropped_references)} dropped, {self.duplicate_references} duplicates)"
+        )
+
+
+class ContextAssembler(BaseModel):
+    """Fits the chat history and knowledge base references of a RAG prompt into a token budget.
+
+    The system prompt and message are always sent. Up to history_share of the remaining budget is
+    reserved for the most recent chat messages, references fill the rest in rank order and any
+    tokens left over are used for older chat messages.
+    """
+
+    # Prompt tokens per model, models which are not listed use default_budget
+    budgets: Dict[str, int] = llm_settings.context_token_budgets
+    default_budget: int = llm_settings.context_token_budget
+    # Fraction of the budget after the prompt reserved for the chat history
+    history_share: float = llm_settings.context_history_share
+    # Number of candidate references searched for per reference in the knowledge base's num_documents
+    candidate_multiplier: int = llm_settings.context_candidate_multiplier
+    encoding_name: str = "cl100k_base"
+
+    def get_budget(self, model: str) -> int:
+        return self.budgets.get(model, self.default_budget)
+
+    def count_tokens(self, text: str) -> int:
+        return len(get_encoding(self.encoding_name).encode_ordinary(text))
+
+    def count_message_tokens(self, message: Message) -> int:
+        content = message.content if isinstance(message.content, str) else json.dumps(message.content)
+        return self.count_tokens(content or "") + MESSAGE_OVERHEAD_TOKENS
+
+    def count_reference_tokens(self, document: Document) -> int:
+        # References are sent as a json list, each followed by a separator
+        return self.count_tokens(json.dumps(document.to_dict())) + 1
+
+    def deduplicate(self, candidates: List[Document]) -> Tuple[List[Document], int]:
+        """Remove candidates whose content is the same as, or contained in, a higher ranked candidate"""
+
+        unique: List[Document] = []
+        contents: List[str] = []
+        for document in candidates:
+            content = " ".join(document.content.split())
+            if any(content in other for other in contents):
+                continue
+            unique.append(document)
+            contents.append(content)
+        return unique, len(candidates) - len(unique)
+
+    def assemble(
+        self,
+        model: str,
+        prompts: List[str],
+        history: List[Message],
+        candidates: List[Document],
+    ) -> Tuple[List[Message], List[Document], ContextReport]:
+        """Returns the chat history and references to send along with the report.
+
+        :param model: The model the prompt is sent to, which determines the budget.
+        :param prompts: Text which is always sent, the system prompt and the user prompt without references.
+        :param history: The chat history to send, oldest first.
+        :param candidates: The candidate references, most relevant first.
+        """
+
+        report = ContextReport(model=model, budget=self.get_budget(model))
+        report.prompt_tokens = sum(self.count_tokens(prompt) + MESSAGE_OVERHEAD_TOKENS for prompt in prompts)
+        available = max(report.budget - report.prompt_tokens, 0)
+
+        # Reserve part of the budget for the most recent chat messages
+        history_tokens = [self.count_message_tokens(message) for message in history]
+        num_history = self.fit_history(history_tokens, int(available * self.history_share))
+        report.history_tokens = sum(history_tokens[len(history) - num_history :])
+
+        # Fill the rest in rank order, skipping references which do not fit so smaller ones can be used
+        unique, report.duplicate_references = self.deduplicate(candidates)
+        references: List[Document] = []
+        for document in unique:
+            num_tokens = self.count_reference_tokens(document)
+            if report.history_tokens + report.reference_tokens + num_tokens <= available:
+                references.append(document)
+                report.references.append(get_reference_id(document))
+                report.reference_tokens += num_tokens
+            else:
+                report.dropped_references.append(get_reference_id(document))
+
+        # Use the tokens left over for older chat messages
+        num_history = self.fit_history(history_tokens, available - report.reference_tokens)
+        report.history_tokens = sum(history_tokens[len(history) - num_history :])
+        report.history_messages = num_history
+        report.dropped_history_messages = len(history) - num_history
+        return history[len(history) - num_history :], references, report
+
+    def fit_history(self, history_tokens: List[int], budget: int) -> int:
+        """Returns the number of most recent messages which fit the budget"""
+
+        num_messages = 0
+        used = 0
+        for num_tokens in reversed(history_tokens):
+            if used + num_tokens > budget:
+                break
+            used += num_tokens
+            num_messages += 1
+        return num_messages
+
+
+def format_references(references: List[Document]) -> Optional[str]:
+    """Format references as the json list used by phi's default references"""
+
+    if len(references) == 0:
+        return None
+    return json.dumps([document.to_dict() for document in references])
@@ -0,0 +1,162 @@
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import datetime
+from typing import Any, List, Optional, Tuple
+
+from phi.conversation import ConversationRow
+from phi.storage.conversation.postgres import PgConversationStorage
+from pydantic import BaseModel
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.sql.expression import func, literal, select, text, tuple_
+
+from utils.log import logger
+
+
+class ConversationSummary(BaseModel):
+    """Columns shown in conversation lists, without the conversation memory"""
+
+    id: str
+    name: Optional[str] = None
+    updated_at: Optional[datetime] = None
+    message_count: int = 0
+
+
+class ConversationPage(BaseModel):
+    conversations: List[ConversationSummary]
+    # Pass to list_conversations to get the next page, None on the last page
+    next_cursor: Optional[str] = None
+
+
+def encode_cursor(updated_at: datetime, conversation_id: str) -> str:
+    return urlsafe_b64encode(json.dumps([updated_at.isoformat(), conversation_id]).encode()).decode()
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, str]:
+    try:
+        updated_at, conversation_id = json.loads(urlsafe_b64decode(cursor.encode()))
+        return datetime.fromisoformat(updated_at), str(conversation_id)
+    except Exception:
+        raise ValueError(f"Invalid cursor: {cursor}")
+
+
+class PagedConversationStorage(PgConversationStorage):
+    """PgConversationStorage which lists a user's conversations a page at a time, most recently updated first.
+
+    updated_at is set on every upsert, so pages are read from the (user_name, updated_at, id) index.
+    """
+
+    @property
+    def list_index_name(self) -> str:
+        return f"{self.table_name}_user_updated_idx"
+
+    def create(self) -> None:
+        if not self.table_exists():
+            super().create()
+            # Existing tables are indexed by db/migrations/versions/4b8e1f6a2d7c_conversation_list_indexes.py
+            table_name = f"{self.schema}.{self.table_name}" if self.schema is not None else self.table_name
+            with self.Session() as sess, sess.begin():
+                sess.execute(
+                    text(
+                        f"CREATE INDEX IF NOT EXISTS {self.list_index_name} "
+                        f"ON {table_name} (user_name, updated_at DESC, id DESC)"
+                    )
+                )
+
+    def get_all_conversation_ids(self, user_name: Optional[str] = None) -> List[str]:
+        # Only reads the ids, PgConversationStorage reads every row including its memory
+        try:
+            with self.Session() as sess, sess.begin():
+                stmt = select(self.table.c.id).where(self.table.c.id.is_not(None))
+                if user_name is not None:
+                    stmt = stmt.where(self.table.c.user_name == user_name)
+                stmt = stmt.order_by(self.table.c.created_at.desc())
+                return list(sess.execute(stmt).scalars().all())
+        except Exception:
+            logger.debug(f"Table does not exist: {self.table.name}")
+        return []
+
+    def get_user_name(self, conversation_id: str) -> Optional[str]:
+        try:
+            with self.Session() as sess, sess.begin():
+                stmt = select(self.table.c.user_name).where(self.table.c.id == conversation_id)
+                return sess.execute(stmt).scalar()
+        except Exception:
+            logger.debug(f"Table does not exist: {self.table.name}")
+        return None
+
+    def list_conversations(
+        self, user_name: str, limit: int = 20, cursor: Optional[str] = None
+    ) -> ConversationPage:
+        """Return a page of the user's conversations, most recently updated first.
+
+        :param user_name: The user whose conversations are listed.
+        :param limit: The maximum number of conversations on the page.
+        :param cursor: The next_cursor of the previous page.
+        """
+
+        table = self.table
+        stmt = (
+            select(
+                table.c.id,
+                table.c.name,
+                table.c.updated_at,
+                func.coalesce(func.jsonb_array_length(table.c.memory["chat_history"]), 0).label(
+                    "message_count"
+                ),
+            )
+            .where(table.c.user_name == user_name)
+            .where(table.c.updated_at.is_not(None))
+            .order_by(table.c.updated_at.desc(), table.c.id.desc())
+            # One more row than the page tells if there is a next page
+            .limit(limit + 1)
+        )
+        if cursor is not None:
+            updated_at, conversation_id = decode_cursor(cursor)
+            stmt = stmt.where(
+                tuple_(table.c.updated_at, table.c.id) < tuple_(literal(updated_at), literal(conversation_id))
+            )
+
+        try:
+            with self.Session() as sess, sess.begin():
+                rows = sess.execute(stmt).fetchall()
+        except Exception:
+            logger.debug(f"Table does not exist: {self.table.name}")
+            return ConversationPage(conversations=[])
+
+        conversations = [ConversationSummary.model_validate(row._mapping) for row in rows[:limit]]
+        next_cursor: Optional[str] = None
+        if len(rows) > limit:
+            last = conversations[-1]
+            next_cursor = encode_cursor(last.updated_at, last.id)  # type: ignore
+        return ConversationPage(conversations=conversations, next_cursor=next_cursor)
+
+    def upsert(self, conversation: ConversationRow) -> Optional[ConversationRow]:
+        """Create or update the conversation, setting updated_at"""
+
+        values: Any = dict(
+            name=conversation.name,
+            user_name=conversation.user_name,
+            user_type=conversation.user_type,
+            is_active=conversation.is_active,
+            llm=conversation.llm,
+            memory=conversation.memory,
+            meta_data=conversation.meta_data,
+            extra_data=conversation.extra_data,
+            # on_conflict_do_update does not apply the onupdate of the column
+            updated_at=func.now(),
+        )
+        stmt = (
+            postgresql.insert(self.table)
+            .values(id=conversation.id, **values)
+            .on_conflict_do_update(index_elements=["id"], set_=values)
+            .returning(self.table)
+        )
+        try:
+            with self.Session() as sess, sess.begin():
+                row = sess.execute(stmt).first()
+        except Exception:
+            # Create table and try again
+            self.create()
+            with self.Session() as sess, sess.begin():
+                row = sess.execute(stmt).first()
+        return ConversationRow.model_validate(row) if row is not None else None
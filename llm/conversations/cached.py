@@ -0,0 +1,130 @@
+import re
+from typing import Dict, Iterator, List, Optional, Tuple, Union
+
+from phi.conversation import Conversation
+from phi.llm.message import Message
+from pydantic import BaseModel
+
+from llm.answer_cache import AnswerCache, AnswerLookup
+from llm.ingestion.knowledge_base import PipelinedKnowledgeBase
+from llm.vectordb import PgVectorDb
+from utils.log import logger
+
+
+class CachedConversation(Conversation):
+    """Conversation which answers repeated questions from the knowledge base's AnswerCache.
+
+    Only the first message of a conversation is looked up, later messages depend on the chat history.
+    """
+
+    use_answer_cache: bool = False
+
+    def run(
+        self, message: Optional[Union[List[Dict], str]] = None, stream: bool = True
+    ) -> Union[Iterator[str], str, BaseModel]:
+        answer_cache = self.get_answer_cache()
+        if answer_cache is None or not isinstance(message, str) or self.output_model is not None:
+            return super().run(message=message, stream=stream)
+
+        self.read_from_storage()
+        if len(self.memory.chat_history) > 0:
+            return super().run(message=message, stream=stream)
+
+        cached = self.lookup_answer(answer_cache, message)
+        if cached is None:
+            return super().run(message=message, stream=stream)
+
+        embedding, lookup = cached
+        if lookup.answer is not None:
+            logger.debug(f"Answer cache hit for: {message}")
+            self.add_cached_answer(message=message, answer=lookup.answer)
+            if stream:
+                return self.stream_answer(lookup.answer)
+            return f"{lookup.answer}\n\n"
+
+        response = super().run(message=message, stream=stream)
+        if stream:
+            return self.store_when_complete(
+                response,  # type: ignore
+                answer_cache=answer_cache,
+                lookup=lookup,
+                message=message,
+                embedding=embedding,
+            )
+        if isinstance(response, str):
+            self.store_answer(answer_cache, lookup, message, embedding, response)
+        return response
+
+    def get_answer_cache(self) -> Optional[AnswerCache]:
+        if (
+            self.use_answer_cache
+            and isinstance(self.knowledge_base, PipelinedKnowledgeBase)
+            and isinstance(self.knowledge_base.vector_db, PgVectorDb)
+        ):
+            return self.knowledge_base.answer_cache
+        return None
+
+    def lookup_answer(
+        self, answer_cache: AnswerCache, message: str
+    ) -> Optional[Tuple[List[float], AnswerLookup]]:
+        """Returns the embedding of the message and its answer cache lookup, or None if the cache is unavailable"""
+
+        vector_db: PgVectorDb = self.knowledge_base.vector_db  # type: ignore
+        try:
+            embedding = vector_db.embedder.get_embedding(message)
+            return embedding, answer_cache.lookup(collection=vector_db.collection, embedding=embedding)
+        except Exception as e:
+            # The cache is an optimization, answer the question if it is unavailable
+            logger.warning(f"Failed to read answer cache: {e}")
+            return None
+
+    def add_cached_answer(self, message: str, answer: str) -> None:
+        """Record a cached answer in the conversation as if the llm had responded"""
+
+        self.memory.add_chat_message(Message(role="user", content=message))
+        self.memory.add_chat_message(Message(role="assistant", content=answer))
+        self.output = f"{answer}\n\n"
+        self.write_to_storage()
+
+    def stream_answer(self, answer: str) -> Iterator[str]:
+        # Stream word by word followed by the separator yielded after each task by Conversation.run
+        for chunk in re.findall(r"\S+\s*|\s+", answer):
+            yield chunk
+        yield "\n\n"
+
+    def store_when_complete(
+        self,
+        response: Iterator[str],
+        answer_cache: AnswerCache,
+        lookup: AnswerLookup,
+        message: str,
+        embedding: List[float],
+    ) -> Iterator[str]:
+        chunks: List[str] = []
+        for chunk in response:
+            chunks.append(chunk)
+            yield chunk
+        # Only complete responses are stored, an interrupted stream does not reach this point
+        self.store_answer(answer_cache, lookup, message, embedding, "".join(chunks))
+
+    def store_answer(
+        self,
+        answer_cache: AnswerCache,
+        lookup: AnswerLookup,
+        message: str,
+        embedding: List[float],
+        response: str,
+    ) -> None:
+        answer = response.removesuffix("\n\n")
+        if answer.strip() == "":
+            return
+        try:
+            answer_cache.store(
+                collection=self.knowledge_base.vector_db.collection,  # type: ignore
+                version=lookup.version,
+                question=message,
+                embedding=embedding,
+                answer=answer,
+            )
+        except Exception as e:
+            logger.warning(f"Failed to write answer cache: {e}")
@@ -3,8 +3,10 @@ from typing import Optional
 from phi.conversation import Conversation
 from phi.llm.openai import OpenAIChat
 
+from llm.context import ContextAssembler
+from llm.conversations.rag import RAGConversation
 from llm.settings import llm_settings
-from llm.storage import pdf_conversation_storage
+from llm.storage import pdf_conversation_async_storage, pdf_conversation_storage
 from llm.knowledge_base import pdf_knowledge_base
 
 
@@ -12,10 +14,12 @@ def get_pdf_rag_conversation(
     user_name: Optional[str] = None,
     conversation_id: Optional[str] = None,
     debug_mode: bool = False,
+    use_answer_cache: bool = llm_settings.answer_cache_enabled,
+    coalesce_requests: bool = llm_settings.coalesce_requests,
 ) -> Conversation:
     """Get a RAG conversation with the PDF knowledge base"""
 
-    return Conversation(
+    return RAGConversation(
         id=conversation_id,
         user_name=user_name,
         llm=OpenAIChat(
@@ -24,6 +28,8 @@ def get_pdf_rag_conversation(
             temperature=llm_settings.default_temperature,
         ),
         storage=pdf_conversation_storage,
+        # Used by the async chat endpoint
+        async_storage=pdf_conversation_async_storage,
         knowledge_base=pdf_knowledge_base,
         debug_mode=debug_mode,
         monitoring=True,
@@ -50,7 +56,13 @@ def get_pdf_rag_conversation(
         """,
         # This setting populates the "references" argument of the user prompt function
         add_references_to_prompt=True,
-        # This setting adds the last 8 messages to the API call
+        # This setting adds up to the last 8 messages to the API call
         add_chat_history_to_messages=True,
+        # Fit the chat history and references into the token budget of the llm
+        context_assembler=ContextAssembler(),
         meta_data={"conversation_type": "RAG"},
+        # Answer repeated first questions from the knowledge base's answer cache
+        use_answer_cache=use_answer_cache,
+        # Identical first questions asked at the same time share one answer from the llm
+        coalesce_requests=coalesce_requests,
     )
@@ -0,0 +1,548 @@
+import asyncio
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from functools import lru_cache
+from os import getenv
+from time import perf_counter
+from typing import Any, AsyncGenerator, AsyncIterator, Callable, Dict, Iterator, List, Optional, Tuple, Union
+
+import httpx
+from openai import DEFAULT_TIMEOUT, AsyncOpenAI, AsyncStream
+from openai.types.chat import ChatCompletionChunk
+from phi.document import Document
+from phi.knowledge.base import KnowledgeBase
+from phi.llm.message import Message
+from phi.conversation import ConversationRow
+from phi.llm.openai import OpenAIChat
+from phi.task.llm import LLMTask, References
+from pydantic import BaseModel
+
+from llm.async_storage import AsyncConversationStorage
+from llm.coalescing import Flight, request_coalescer
+from llm.context import ContextAssembler, ContextReport, format_references
+from llm.conversations.cached import CachedConversation
+from llm.settings import llm_settings
+from utils.log import logger
+
+# Searches the knowledge base while the conversation is read from storage
+_retrieval_executor = ThreadPoolExecutor(
+    max_workers=llm_settings.retrieval_workers, thread_name_prefix="retrieval"
+)
+
+
+def get_num_candidates(
+    knowledge_base: KnowledgeBase,
+    context_assembler: Optional[ContextAssembler],
+    num_documents: Optional[int] = None,
+) -> int:
+    """Returns the number of references to search for, more than are sent when they are packed into a budget"""
+
+    num_documents = num_documents or knowledge_base.num_documents
+    if context_assembler is None:
+        return num_documents
+    return num_documents * context_assembler.candidate_multiplier
+
+
+@dataclass
+class PrefetchedReferences:
+    """Knowledge base search started when the message is received"""
+
+    query: str
+    num_documents: int
+    future: Future
+
+
+class ContextLLMTask(LLMTask):
+    """LLMTask which fits the chat history and references into the model's token budget.
+
+    The history sent to the llm is trimmed by lowering num_history_messages before the task builds its messages.
+    """
+
+    context_assembler: Optional[ContextAssembler] = None
+    # Called with the report of the tokens used and dropped for the message
+    context_callback: Optional[Callable[[ContextReport], None]] = None
+    context_report: Optional[ContextReport] = None
+    # Search started by the conversation before the task runs
+    prefetched_references: Optional[PrefetchedReferences] = None
+    # Called with the name and number of seconds of the retrieval stages
+    timing_callback: Optional[Callable[[str, float], None]] = None
+
+    def get_references_from_knowledge_base(
+        self, query: str, num_documents: Optional[int] = None
+    ) -> Optional[str]:
+        if self.knowledge_base is None or self.references_function is not None:
+            return super().get_references_from_knowledge_base(query=query, num_documents=num_documents)
+
+        candidates = self.get_candidates(query=query, num_documents=num_documents)
+        if self.context_assembler is None:
+            return format_references(candidates)
+
+        history: List[Message] = []
+        memory = self.conversation_memory or self.memory
+        if self.add_chat_history_to_messages and memory is not None:
+            history = memory.get_last_n_messages(last_n=self.num_history_messages)
+
+        user_prompt = self.get_user_prompt(message=query, references="", chat_history=None)
+        prompts = [self.get_system_prompt() or "", user_prompt if isinstance(user_prompt, str) else query]
+        history, references, report = self.context_assembler.assemble(
+            model=self.llm.model if self.llm is not None else "",  # type: ignore
+            prompts=prompts,
+            history=history,
+            candidates=candidates,
+        )
+
+        # get_last_n_messages returns every message for 0, so the history is turned off instead
+        if len(history) == 0:
+            self.add_chat_history_to_messages = False
+        else:
+            self.num_history_messages = len(history)
+
+        logger.info(report.summary())
+        self.context_report = report
+        if self.context_callback is not None:
+            self.context_callback(report)
+        return format_references(references)
+
+    def get_candidates(self, query: str, num_documents: Optional[int] = None) -> List[Document]:
+        """Returns the prefetched search results for the query, or searches the knowledge base"""
+
+        knowledge_base: KnowledgeBase = self.knowledge_base  # type: ignore
+        num_candidates = get_num_candidates(knowledge_base, self.context_assembler, num_documents)
+        prefetched = self.prefetched_references
+        if (
+            prefetched is not None
+            and prefetched.query == query
+            and prefetched.num_documents == num_candidates
+        ):
+            start = perf_counter()
+            try:
+                candidates: List[Document] = prefetched.future.result()
+                return candidates
+            except Exception as e:
+                logger.warning(f"Prefetched search failed, searching again: {e}")
+            finally:
+                self.record_timing("retrieval_wait", perf_counter() - start)
+        start = perf_counter()
+        candidates = knowledge_base.search(query=query, num_documents=num_candidates)
+        self.record_timing("retrieval", perf_counter() - start)
+        return candidates
+
+    def record_timing(self, stage: str, seconds: float) -> None:
+        if self.timing_callback is not None:
+            self.timing_callback(stage, seconds)
+
+    def get_messages(self, message: str) -> Tuple[List[Message], Optional[References]]:
+        """Build the messages sent to the llm and the references to store, as LLMTask._run does"""
+
+        self.prepare_task()
+        system_prompt = self.get_system_prompt()
+
+        references: Optional[References] = None
+        user_prompt_references: Optional[str] = None
+        if self.add_references_to_prompt:
+            start = perf_counter()
+            user_prompt_references = self.get_references_from_knowledge_base(query=message)
+            references = References(
+                query=message, references=user_prompt_references, time=round(perf_counter() - start, 4)
+            )
+
+        chat_history = self.get_formatted_chat_history() if self.add_chat_history_to_prompt else None
+        user_prompt = self.get_user_prompt(
+            message=message, references=user_prompt_references, chat_history=chat_history
+        )
+
+        messages: List[Message] = []
+        if system_prompt:
+            messages.append(Message(role="system", content=system_prompt))
+        memory = self.conversation_memory or self.memory
+        if self.add_chat_history_to_messages and memory is not None:
+            messages += memory.get_last_n_messages(last_n=self.num_history_messages)
+        messages.append(Message(role="user", content=user_prompt))
+        return messages, references
+
+    async def aresponse_stream(self, messages: List[Message]) -> AsyncIterator[str]:
+        """Stream the response of the llm using the async OpenAI client"""
+
+        llm: OpenAIChat = self.llm  # type: ignore
+        start = perf_counter()
+        completion_tokens = 0
+        content = ""
+        response: AsyncStream[ChatCompletionChunk] = await get_async_openai_client().chat.completions.create(
+            model=llm.model,
+            messages=[m.to_dict() for m in messages],  # type: ignore
+            stream=True,
+            **llm.api_kwargs,
+        )  # type: ignore
+        try:
+            async for chunk in response:
+                completion_tokens += 1
+                if len(chunk.choices) > 0 and chunk.choices[0].delta.content is not None:
+                    content += chunk.choices[0].delta.content
+                    yield chunk.choices[0].delta.content
+        finally:
+            # Closing the connection stops the completion when the stream is abandoned
+            await response.response.aclose()
+
+        # Record the response like OpenAIChat.parsed_response_stream
+        assistant_message = Message(role="assistant", content=content)
+        assistant_message.metrics["time"] = perf_counter() - start
+        assistant_message.metrics["completion_tokens"] = completion_tokens
+        llm.metrics.setdefault("response_times", []).append(assistant_message.metrics["time"])
+        llm.metrics["completion_tokens"] = llm.metrics.get("completion_tokens", 0) + completion_tokens
+        messages.append(assistant_message)
+
+    def add_response(
+        self, message: str, messages: List[Message], response: str, references: Optional[References]
+    ) -> None:
+        """Add the message and response to the task and conversation memory, as LLMTask._run does"""
+
+        user_message = Message(role="user", content=message)
+        llm_message = Message(role="assistant", content=response)
+        memories: List[Any] = [self.memory]
+        if self.conversation_memory is not None:
+            memories.append(self.conversation_memory)
+        for memory in memories:
+            memory.add_chat_message(message=user_message)
+            memory.add_llm_messages(messages=messages)
+            memory.add_chat_message(message=llm_message)
+            if references:
+                memory.add_references(references=references)
+        if self.conversation_tasks is not None:
+            self.conversation_tasks.append(self.to_dict())
+        self.output = response
+
+    def to_dict(self) -> Dict[str, Any]:
+        # Included in the conversation event sent for monitoring
+        _dict = super().to_dict()
+        if self.context_report is not None:
+            _dict["context"] = self.context_report.model_dump()
+        return _dict
+
+
+@lru_cache(maxsize=None)
+def get_async_openai_client() -> AsyncOpenAI:
+    """Returns the AsyncOpenAI client shared by async chat requests, created on first use in the event loop"""
+
+    limits = httpx.Limits(
+        max_connections=llm_settings.async_llm_max_connections,
+        max_keepalive_connections=llm_settings.async_llm_max_connections,
+    )
+    return AsyncOpenAI(http_client=httpx.AsyncClient(limits=limits, timeout=DEFAULT_TIMEOUT))
+
+
+class RAGConversation(CachedConversation):
+    """Conversation which assembles its prompts within the token budget of its llm.
+
+    Retrieval does not depend on the chat history, so the knowledge base is searched while
+    the conversation is read from storage.
+    """
+
+    context_assembler: Optional[ContextAssembler] = None
+    # Tokens used and dropped for the last message
+    context_report: Optional[ContextReport] = None
+    # Search the knowledge base as soon as a message is received
+    prefetch_references: bool = True
+    prefetched_references: Optional[PrefetchedReferences] = None
+    # Seconds spent in each stage of the last message
+    timings: Dict[str, float] = {}
+    # Whether the conversation has been read from storage for the current message, None outside of a run
+    hydrated: Optional[bool] = None
+    # Storage used by arun, which reads and writes the same table as storage
+    async_storage: Optional[AsyncConversationStorage] = None
+    # Answer first messages asking a question which is already being answered with that answer
+    coalesce_requests: bool = False
+    # Whether the last message was answered by another request's answer
+    coalesced: bool = False
+    # Set when the conversation is kept in memory between messages by the Api's conversation cache.
+    # It is written on every message, so it is not read from storage again.
+    cached_in_memory: bool = False
+
+    @property
+    def llm_task(self) -> LLMTask:
+        task = super().llm_task
+        return ContextLLMTask(
+            **dict(task),
+            context_assembler=self.context_assembler,
+            context_callback=self.set_context_report,
+            prefetched_references=self.prefetched_references,
+            timing_callback=self.set_timing,
+        )
+
+    def set_context_report(self, report: ContextReport) -> None:
+        self.context_report = report
+
+    def set_timing(self, stage: str, seconds: float) -> None:
+        self.timings[stage] = seconds
+
+    def run(
+        self, message: Optional[Union[List[Dict], str]] = None, stream: bool = True
+    ) -> Union[Iterator[str], str, BaseModel]:
+        start = perf_counter()
+        self.timings = {}
+        self.context_report = None
+        self.hydrated = self.is_hydrated()
+        self.prefetched_references = None
+        if isinstance(message, str):
+            self.prefetched_references = self.prefetch(message)
+
+        response = super().run(message=message, stream=stream)
+        if stream and isinstance(response, Iterator):
+            return self.timed_stream(response, start)
+        self.finish_run(start)
+        return response
+
+    def prefetch(self, message: str) -> Optional[PrefetchedReferences]:
+        """Start searching the knowledge base for the message in the background"""
+
+        if (
+            not self.prefetch_references
+            or not self.add_references_to_prompt
+            or self.knowledge_base is None
+            or self.references_function is not None
+        ):
+            return None
+
+        num_documents = get_num_candidates(self.knowledge_base, self.context_assembler)
+        knowledge_base = self.knowledge_base
+        timings = self.timings
+
+        def search() -> List[Document]:
+            search_start = perf_counter()
+            documents = knowledge_base.search(query=message, num_documents=num_documents)
+            timings["retrieval"] = perf_counter() - search_start
+            return documents
+
+        return PrefetchedReferences(
+            query=message,
+            num_documents=num_documents,
+            future=_retrieval_executor.submit(search),
+        )
+
+    def is_hydrated(self) -> bool:
+        return self.cached_in_memory and self.database_row is not None
+
+    def read_from_storage(self) -> Optional[ConversationRow]:
+        # CachedConversation and Conversation both read the conversation, it is only read once per message
+        if self.hydrated:
+            return self.database_row
+        start = perf_counter()
+        row = super().read_from_storage()
+        if self.hydrated is not None:
+            self.timings["hydrate"] = perf_counter() - start
+            self.hydrated = True
+        return row
+
+    def timed_stream(self, response: Iterator[str], start: float) -> Iterator[str]:
+        try:
+            for chunk in response:
+                if "first_token" not in self.timings:
+                    self.timings["first_token"] = perf_counter() - start
+                yield chunk
+        finally:
+            self.finish_run(start)
+
+    def finish_run(self, start: float) -> None:
+        self.timings["total"] = perf_counter() - start
+        self.hydrated = None
+        prefetched = self.prefetched_references
+        # The prefetched search is not used when the answer comes from the answer cache
+        if prefetched is not None and not prefetched.future.done():
+            prefetched.future.cancel()
+        self.prefetched_references = None
+        logger.info(
+            "Chat timings: "
+            + ", ".join(f"{stage}: {seconds:.3f}s" for stage, seconds in self.timings.items())
+        )
+
+    def get_used_tokens(self) -> Optional[int]:
+        """Returns the prompt and completion tokens of the last message"""
+
+        if self.context_report is None:
+            return None
+        # The llm was called by the request which started the answer
+        if self.coalesced:
+            return 0
+        for message in reversed(self.memory.llm_messages):
+            if message.role == "assistant":
+                return self.context_report.total_tokens + message.metrics.get("completion_tokens", 0)
+        return None
+
+    def supports_async(self) -> bool:
+        """Returns True if arun can answer messages, it supports OpenAI RAG conversations without tools"""
+
+        return (
+            isinstance(self.llm, OpenAIChat)
+            and self.llm.openai is None
+            and getenv("OPENAI_API_KEY") is not None
+            and not self.function_calls
+            and self.tools is None
+            and (self.tasks is None or len(self.tasks) == 0)
+            and self.output_model is None
+            and (self.storage is None or self.async_storage is not None)
+        )
+
+    def get_coalescing_key(self, message: str) -> Optional[Tuple[str, str, str]]:
+        """Returns the key shared by first messages asking the same question, None if they are not coalesced"""
+
+        if not self.coalesce_requests or self.knowledge_base is None:
+            return None
+        vector_db = getattr(self.knowledge_base, "vector_db", None)
+        collection = getattr(vector_db, "collection", None) or str(id(self.knowledge_base))
+        return collection, self.llm.model, " ".join(message.lower().split())
+
+    async def arun(self, message: str) -> AsyncGenerator[str, None]:
+        """Stream the response to a message without blocking the event loop.
+
+        The conversation is read and written using async_storage and the llm is called with the async
+        OpenAI client. The knowledge base search runs on the retrieval thread pool.
+        First messages asking a question which is already being answered subscribe to that answer.
+        When the stream is cancelled or closed before the end, the llm request is closed and the partial answer saved.
+        """
+
+        start = perf_counter()
+        self.timings = {}
+        self.context_report = None
+        self.coalesced = False
+        key = self.get_coalescing_key(message)
+        # Requests joining an answer in flight do not search the knowledge base
+        if key is None or request_coalescer.get(key) is None:
+            self.prefetched_references = self.prefetch(message)
+        try:
+            if not self.is_hydrated():
+                await self.aread_from_storage()
+
+            task: ContextLLMTask = self.llm_task  # type: ignore
+            conversation_tasks: List[Dict[str, Any]] = []
+            task.conversation_id = self.id
+            task.conversation_memory = self.memory
+            task.conversation_message = message
+            task.conversation_tasks = conversation_tasks
+            task.parse_output = False
+
+            # Answers depend on the chat history, so only first messages are coalesced
+            if key is None or len(self.memory.chat_history) > 0:
+                key = None
+            flight = request_coalescer.join(key) if key is not None else None
+            if flight is not None:
+                self.coalesced = True
+            else:
+                prefetched = self.prefetched_references
+                flight = request_coalescer.start(
+                    key, lambda f: self.produce_answer(task, message, prefetched, f)
+                )
+                # The answer owns the prefetched search, it can outlive this request
+                self.prefetched_references = None
+
+            response = ""
+            chunks = request_coalescer.subscribe(flight)
+            try:
+                async for chunk in chunks:
+                    if "first_token" not in self.timings:
+                        self.timings["first_token"] = perf_counter() - start
+                        self.context_report = flight.context_report
+                    response += chunk
+                    yield chunk
+            except (asyncio.CancelledError, GeneratorExit):
+                # The stream was abandoned, the partial answer is kept in the conversation
+                if response != "" and flight.messages is not None:
+                    logger.info(f"Saving partial answer of {len(response)} characters")
+                    task.context_report = flight.context_report
+                    task.add_response(message, list(flight.messages), response, flight.references)
+                    self.output = response
+                    await self.awrite_to_storage()
+                raise
+            finally:
+                await chunks.aclose()
+
+            self.context_report = flight.context_report
+            if flight.messages is None:
+                # Answered from the answer cache
+                self.memory.add_chat_message(Message(role="user", content=message))
+                self.memory.add_chat_message(Message(role="assistant", content=response.removesuffix("\n\n")))
+                self.output = response
+                await self.awrite_to_storage()
+                return
+
+            task.context_report = flight.context_report
+            task.add_response(
+                message, list(flight.messages), response.removesuffix("\n\n"), flight.references
+            )
+            self.output = response
+            await self.awrite_to_storage()
+
+            # Monitoring events are sent to the phi api using a blocking client
+            event_data = {
+                "user_message": message,
+                "llm_response": self.output,
+                "info": {"tasks": conversation_tasks, "coalesced": self.coalesced},
+                "metrics": self.llm.metrics,
+            }
+            await asyncio.to_thread(self._api_log_conversation_event, event_type="run", event_data=event_data)
+        finally:
+            self.finish_run(start)
+
+    async def produce_answer(
+        self,
+        task: ContextLLMTask,
+        message: str,
+        prefetched: Optional[PrefetchedReferences],
+        flight: Flight,
+    ) -> None:
+        """Answer the message from the answer cache or the llm, publishing the chunks to the flight"""
+
+        try:
+            # Answer repeated first questions from the answer cache
+            answer_cache = self.get_answer_cache()
+            cached = None
+            if answer_cache is not None and len(self.memory.chat_history) == 0:
+                cached = await asyncio.to_thread(self.lookup_answer, answer_cache, message)
+                if cached is not None and cached[1].answer is not None:
+                    for chunk in self.stream_answer(cached[1].answer):
+                        flight.publish(chunk)
+                    return
+
+            # Wait for the prefetched search without blocking. Messages are built in a thread, they tokenize
+            # the prompt and a failed prefetch falls back to a blocking knowledge base search.
+            if prefetched is not None:
+                wait_start = perf_counter()
+                await asyncio.wait([asyncio.wrap_future(prefetched.future)])
+                self.timings["retrieval_wait"] = perf_counter() - wait_start
+            messages, references = await asyncio.to_thread(task.get_messages, message)
+            flight.messages = messages
+            flight.references = references
+            flight.context_report = task.context_report
+
+            response = ""
+            async for chunk in task.aresponse_stream(messages):
+                response += chunk
+                flight.publish(chunk)
+            flight.publish("\n\n")
+            # Subscribers finish while the answer is stored
+            flight.finish()
+
+            if answer_cache is not None and cached is not None:
+                await asyncio.to_thread(
+                    self.store_answer, answer_cache, cached[1], message, cached[0], response
+                )
+        finally:
+            if prefetched is not None and not prefetched.future.done():
+                prefetched.future.cancel()
+
+    async def aread_from_storage(self) -> Optional[ConversationRow]:
+        if self.async_storage is None or self.id is None:
+            return await asyncio.to_thread(self.read_from_storage)
+        start = perf_counter()
+        row = await self.async_storage.read(conversation_id=self.id)
+        self.timings["hydrate"] = perf_counter() - start
+        if row is not None:
+            self.database_row = row
+            self.from_database_row(row=row)
+        return row
+
+    async def awrite_to_storage(self) -> Optional[ConversationRow]:
+        if self.async_storage is None:
+            return await asyncio.to_thread(self.write_to_storage)
+        row = await self.async_storage.upsert(conversation=self.to_database_row())
+        if row is not None:
+            self.database_row = row
+        return row
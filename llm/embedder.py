@@ -0,0 +1,322 @@
+import random
+from concurrent.futures import ThreadPoolExecutor
+from threading import BoundedSemaphore, Lock
+from time import monotonic, sleep
+from typing import Any, Dict, List, Optional, Tuple
+
+from openai import APIConnectionError, APIStatusError, InternalServerError, OpenAI, RateLimitError
+from phi.document import Document
+from phi.embedder import Embedder
+from phi.embedder.openai import OpenAIEmbedder
+from phi.utils.env import get_from_env
+from pydantic import PrivateAttr, model_validator
+
+from llm.embedding_cache import EmbeddingCache, get_text_hash
+from llm.settings import llm_settings
+from utils.log import logger
+from utils.lru import LRUCache
+
+
+def embed_texts(embedder: Embedder, texts: List[str]) -> Tuple[List[List[float]], int]:
+    """Embed a batch of texts and return the embeddings and the number of tokens used.
+
+    Batched and cached embedders pack the texts into token limited requests, plain OpenAI
+    embedders send the whole batch in a single request and other embedders fall back
+    to embedding one text at a time.
+    """
+
+    if len(texts) == 0:
+        return [], 0
+
+    if isinstance(embedder, (CachedEmbedder, BatchedOpenAIEmbedder)):
+        return embedder.get_embeddings(texts)
+
+    # The phi-proxy used when OPENAI_API_KEY is not set only accepts a single input
+    if isinstance(embedder, OpenAIEmbedder) and get_from_env("OPENAI_API_KEY") is not None:
+        response = embedder.client.embeddings.create(
+            input=texts,
+            model=embedder.model,
+            encoding_format=embedder.encoding_format,
+        )
+        embeddings: List[List[float]] = [[] for _ in texts]
+        for embedding_data in response.data:
+            embeddings[embedding_data.index] = embedding_data.embedding
+        return embeddings, response.usage.total_tokens
+
+    embeddings = []
+    num_tokens = 0
+    for text in texts:
+        embedding, usage = embedder.get_embedding_and_usage(text)
+        embeddings.append(embedding)
+        if usage is not None:
+            num_tokens += usage.get("total_tokens", 0)
+    return embeddings, num_tokens
+
+
+def embed_documents(embedder: Embedder, documents: List[Document]) -> int:
+    """Embed a batch of documents in place and return the number of tokens used"""
+
+    embeddings, num_tokens = embed_texts(embedder, [document.content for document in documents])
+    for document, embedding in zip(documents, embeddings):
+        document.embedding = embedding
+    return num_tokens
+
+
+class BatchedOpenAIEmbedder(OpenAIEmbedder):
+    """OpenAIEmbedder which packs texts into token limited requests and sends them concurrently.
+
+    Rate limit responses pause all requests from this embedder, the pause grows with
+    consecutive rate limits and shrinks again as requests succeed.
+    """
+
+    # Maximum number of tokens sent in a single request
+    max_batch_tokens: int = llm_settings.embedding_max_batch_tokens
+    # Maximum number of inputs sent in a single request
+    max_batch_size: int = 2048
+    # Inputs longer than this are truncated
+    max_input_tokens: int = 8191
+    # Maximum number of requests in flight across all callers
+    concurrency: int = llm_settings.embedding_concurrency
+    # Number of times a request is retried after a rate limit or server error
+    max_retries: int = llm_settings.embedding_max_retries
+    initial_backoff: float = 1.0
+    max_backoff: float = 60.0
+
+    _client: Optional[OpenAI] = PrivateAttr(default=None)
+    _encoding: Any = PrivateAttr(default=None)
+    _semaphore: Optional[BoundedSemaphore] = PrivateAttr(default=None)
+    _lock: Lock = PrivateAttr(default_factory=Lock)
+    _backoff: float = PrivateAttr(default=0)
+    _resume_at: float = PrivateAttr(default=0)
+
+    def model_post_init(self, __context: Any) -> None:
+        self._semaphore = BoundedSemaphore(max(self.concurrency, 1))
+
+    @property
+    def client(self) -> OpenAI:
+        # Retries are handled by this embedder so rate limits are shared between requests
+        if self._client is None:
+            # A client copied with with_options closes the shared http client when the original is garbage
+            # collected, so the default client is created with max_retries instead of copied
+            self._client = (
+                self.openai.with_options(max_retries=0) if self.openai is not None else OpenAI(max_retries=0)
+            )
+        return self._client
+
+    def get_embedding(self, text: str) -> List[float]:
+        return self.get_embedding_and_usage(text)[0]
+
+    def get_embedding_and_usage(self, text: str) -> Tuple[List[float], Optional[Dict]]:
+        # Search queries are retried with the backoff shared by this embedder, the client does not retry
+        if get_from_env("OPENAI_API_KEY") is None:
+            return super().get_embedding_and_usage(text)
+        texts, _ = self.pack([text])
+        embeddings, num_tokens = self._embed_batch(texts)
+        return embeddings[0], {"prompt_tokens": num_tokens, "total_tokens": num_tokens}
+
+    def get_embeddings(self, texts: List[str]) -> Tuple[List[List[float]], int]:
+        """Returns embeddings for a batch of texts and the number of tokens used"""
+
+        # The phi-proxy used when OPENAI_API_KEY is not set only accepts a single input
+        if get_from_env("OPENAI_API_KEY") is None:
+            embeddings: List[List[float]] = []
+            num_tokens = 0
+            for text in texts:
+                embedding, usage = self.get_embedding_and_usage(text)
+                embeddings.append(embedding)
+                num_tokens += (usage or {}).get("total_tokens", 0)
+            return embeddings, num_tokens
+
+        texts, batches = self.pack(texts)
+        embeddings = [[] for _ in texts]
+        num_tokens = 0
+        with ThreadPoolExecutor(max_workers=max(min(self.concurrency, len(batches)), 1)) as executor:
+            results = executor.map(lambda batch: self._embed_batch([texts[i] for i in batch]), batches)
+            for batch, (batch_embeddings, batch_tokens) in zip(batches, results):
+                for i, embedding in zip(batch, batch_embeddings):
+                    embeddings[i] = embedding
+                num_tokens += batch_tokens
+        return embeddings, num_tokens
+
+    def pack(self, texts: List[str]) -> Tuple[List[str], List[List[int]]]:
+        """Pack texts into batches of indexes which fit within max_batch_tokens and max_batch_size.
+
+        Returns the texts, with inputs longer than max_input_tokens truncated, and the batches.
+        """
+
+        if self._encoding is None:
+            import tiktoken
+
+            try:
+                self._encoding = tiktoken.encoding_for_model(self.model)
+            except KeyError:
+                self._encoding = tiktoken.get_encoding("cl100k_base")
+
+        packed_texts: List[str] = []
+        batches: List[List[int]] = []
+        batch: List[int] = []
+        batch_tokens = 0
+        for i, (text, tokens) in enumerate(zip(texts, self._encoding.encode_ordinary_batch(texts))):
+            if len(tokens) > self.max_input_tokens:
+                logger.warning(f"Truncating input from {len(tokens)} to {self.max_input_tokens} tokens")
+                tokens = tokens[: self.max_input_tokens]
+                text = self._encoding.decode(tokens)
+            packed_texts.append(text)
+
+            if len(batch) > 0 and (
+                batch_tokens + len(tokens) > self.max_batch_tokens or len(batch) >= self.max_batch_size
+            ):
+                batches.append(batch)
+                batch, batch_tokens = [], 0
+            batch.append(i)
+            batch_tokens += len(tokens)
+        if len(batch) > 0:
+            batches.append(batch)
+        return packed_texts, batches
+
+    def _embed_batch(self, texts: List[str]) -> Tuple[List[List[float]], int]:
+        attempt = 0
+        while True:
+            self._wait_for_backoff()
+            try:
+                with self._semaphore:  # type: ignore
+                    response = self.client.embeddings.create(
+                        input=texts, model=self.model, encoding_format=self.encoding_format
+                    )
+            except (RateLimitError, InternalServerError, APIConnectionError) as e:
+                # Other requests are paused even when this one is out of retries
+                self._increase_backoff(e)
+                attempt += 1
+                if attempt > self.max_retries:
+                    raise
+                continue
+
+            self._decrease_backoff()
+            embeddings: List[List[float]] = [[] for _ in texts]
+            for embedding_data in response.data:
+                embeddings[embedding_data.index] = embedding_data.embedding
+            return embeddings, response.usage.total_tokens
+
+    def _wait_for_backoff(self) -> None:
+        with self._lock:
+            delay = self._resume_at - monotonic()
+        if delay > 0:
+            sleep(delay)
+
+    def _increase_backoff(self, error: Exception) -> None:
+        retry_after: Optional[float] = None
+        if isinstance(error, APIStatusError):
+            try:
+                retry_after = float(error.response.headers.get("retry-after", ""))
+            except ValueError:
+                pass
+
+        with self._lock:
+            self._backoff = min(max(self._backoff * 2, self.initial_backoff), self.max_backoff)
+            # Add jitter so paused requests do not all resume at the same time
+            delay = retry_after if retry_after is not None else self._backoff * random.uniform(0.5, 1.5)
+            self._resume_at = max(self._resume_at, monotonic() + delay)
+        logger.warning(f"Embedding request failed, pausing requests for {delay:.1f}s: {error}")
+
+    def _decrease_backoff(self) -> None:
+        with self._lock:
+            self._backoff = self._backoff / 2 if self._backoff > self.initial_backoff else 0
+
+
+class CachedEmbedder(Embedder):
+    """Embedder which checks an EmbeddingCache before calling the wrapped embedder.
+
+    Single texts, which are the search queries, are also kept in an in-process query_cache
+    so repeated questions skip the round trip to the shared EmbeddingCache.
+    """
+
+    embedder: Embedder = OpenAIEmbedder()
+    # Shared by all processes, set to None to only use the in-process query_cache
+    cache: Optional[EmbeddingCache] = None
+    query_cache: Optional[LRUCache[str, List[float]]] = None
+
+    _hits: int = PrivateAttr(default=0)
+    _misses: int = PrivateAttr(default=0)
+    _lock: Lock = PrivateAttr(default_factory=Lock)
+
+    @model_validator(mode="after")  # type: ignore
+    def set_dimensions(self) -> "CachedEmbedder":
+        self.dimensions = self.embedder.dimensions
+        return self  # type: ignore
+
+    @property
+    def model(self) -> str:
+        return getattr(self.embedder, "model", self.embedder.__class__.__name__)
+
+    def get_embedding(self, text: str) -> List[float]:
+        return self.get_embedding_and_usage(text)[0]
+
+    def get_embedding_and_usage(self, text: str) -> Tuple[List[float], Optional[Dict]]:
+        text_hash = get_text_hash(text)
+        if self.query_cache is not None:
+            embedding = self.query_cache.get(text_hash)
+            if embedding is not None:
+                return embedding, None
+
+        cached = self._get_cached([text_hash])
+        if text_hash in cached:
+            embedding, usage = cached[text_hash], None
+        else:
+            embedding, usage = self.embedder.get_embedding_and_usage(text)
+            self._set_cached({text_hash: embedding})
+
+        if self.query_cache is not None:
+            self.query_cache.set(text_hash, embedding)
+        return embedding, usage
+
+    def get_embeddings(self, texts: List[str]) -> Tuple[List[List[float]], int]:
+        """Returns embeddings for a batch of texts, only sending cache misses to the wrapped embedder"""
+
+        text_hashes = [get_text_hash(text) for text in texts]
+        embeddings = self._get_cached(list(set(text_hashes)))
+
+        # Embed each missing text once even if it appears multiple times in the batch
+        missing = {h: text for h, text in zip(text_hashes, texts) if h not in embeddings}
+        num_tokens = 0
+        if len(missing) > 0:
+            missing_embeddings, num_tokens = embed_texts(self.embedder, list(missing.values()))
+            new_embeddings = dict(zip(missing.keys(), missing_embeddings))
+            self._set_cached(new_embeddings)
+            embeddings.update(new_embeddings)
+        return [embeddings[h] for h in text_hashes], num_tokens
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        """Returns the hit and miss counters of the query cache and the shared cache for this process"""
+
+        with self._lock:
+            lookups = self._hits + self._misses
+            shared_stats: Dict[str, float] = {
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": self._hits / lookups if lookups > 0 else 0,
+            }
+        return {
+            "query_cache": self.query_cache.stats() if self.query_cache is not None else {},
+            "shared_cache": shared_stats,
+        }
+
+    def _get_cached(self, text_hashes: List[str]) -> Dict[str, List[float]]:
+        cached: Dict[str, List[float]] = {}
+        if self.cache is not None:
+            # The cache is an optimization, embeddings are still returned if it is unavailable
+            try:
+                cached = self.cache.get(model=self.model, text_hashes=text_hashes)
+            except Exception as e:
+                logger.warning(f"Failed to read embedding cache: {e}")
+        with self._lock:
+            self._hits += len(cached)
+            self._misses += len(text_hashes) - len(cached)
+        return cached
+
+    def _set_cached(self, embeddings: Dict[str, List[float]]) -> None:
+        if self.cache is None:
+            return
+        try:
+            self.cache.set(model=self.model, embeddings=embeddings)
+        except Exception as e:
+            logger.warning(f"Failed to write embedding cache: {e}")
@@ -0,0 +1,198 @@
+import unicodedata
+from hashlib import sha256
+from typing import Dict, List, Optional
+
+from pgvector.sqlalchemy import Vector
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.engine import Engine, create_engine
+from sqlalchemy.inspection import inspect
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.schema import Column, Index, MetaData, PrimaryKeyConstraint, Table
+from sqlalchemy.sql.expression import func, select, text, tuple_
+from sqlalchemy.types import DateTime, String
+
+from utils.log import logger
+
+
+def normalize_text(text: str) -> str:
+    """Normalize unicode and whitespace so trivially different texts share a cache entry"""
+
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+def get_text_hash(text: str) -> str:
+    return sha256(normalize_text(text).encode()).hexdigest()
+
+
+class EmbeddingCache:
+    def __init__(
+        self,
+        table_name: str = "embedding_cache",
+        schema: Optional[str] = "llm",
+        db_url: Optional[str] = None,
+        db_engine: Optional[Engine] = None,
+        max_entries: Optional[int] = None,
+        evict_every: int = 1000,
+        touch_after: int = 24 * 60 * 60,
+    ):
+        """
+        Content-addressed store of embeddings keyed by (embedding model, normalized text hash).
+
+        :param table_name: The name of the table to store embeddings in.
+        :param schema: The schema to store the table in.
+        :param db_url: The database URL to connect to.
+        :param db_engine: The database engine to use.
+        :param max_entries: Least recently used entries are evicted when the cache grows past max_entries.
+        :param evict_every: Number of new entries written between eviction runs.
+        :param touch_after: Number of seconds after which a read entry's last_used_at is updated.
+        """
+        _engine: Optional[Engine] = db_engine
+        if _engine is None and db_url is not None:
+            _engine = create_engine(db_url)
+
+        if _engine is None:
+            raise ValueError("Must provide either db_url or db_engine")
+
+        # Database attributes
+        self.table_name: str = table_name
+        self.schema: Optional[str] = schema
+        self.db_engine: Engine = _engine
+        self.metadata: MetaData = MetaData(schema=self.schema)
+
+        # Eviction attributes
+        self.max_entries: Optional[int] = max_entries
+        self.evict_every: int = evict_every
+        self.writes_since_eviction: int = 0
+        self.touch_after: int = touch_after
+
+        # Database session
+        self.Session: sessionmaker[Session] = sessionmaker(bind=self.db_engine)
+
+        # Database table for the cache
+        self.table: Table = self.get_table()
+        self.table_created: bool = False
+
+    def get_table(self) -> Table:
+        return Table(
+            self.table_name,
+            self.metadata,
+            # Embedding model used to create the embedding
+            Column("model", String),
+            # Hash of the normalized text
+            Column("text_hash", String),
+            # Untyped vector so models with different dimensions share the table
+            Column("embedding", Vector()),
+            Column("created_at", DateTime(timezone=True), server_default=text("now()")),
+            # Used to evict the least recently used entries
+            Column("last_used_at", DateTime(timezone=True), server_default=text("now()")),
+            PrimaryKeyConstraint("model", "text_hash"),
+            Index(f"{self.table_name}_last_used_at_idx", "last_used_at"),
+            extend_existing=True,
+        )
+
+    def table_exists(self) -> bool:
+        logger.debug(f"Checking if table exists: {self.table.name}")
+        try:
+            return inspect(self.db_engine).has_table(self.table.name, schema=self.schema)
+        except Exception as e:
+            logger.error(e)
+            return False
+
+    def create(self) -> None:
+        if self.table_created:
+            return
+        if not self.table_exists():
+            with self.Session() as sess, sess.begin():
+                logger.debug("Creating extension: vector")
+                sess.execute(text("create extension if not exists vector;"))
+                if self.schema is not None:
+                    logger.debug(f"Creating schema: {self.schema}")
+                    sess.execute(text(f"create schema if not exists {self.schema};"))
+            logger.debug(f"Creating table: {self.table_name}")
+            self.table.create(self.db_engine)
+        self.table_created = True
+
+    def get(self, model: str, text_hashes: List[str]) -> Dict[str, List[float]]:
+        """Returns cached embeddings for the text hashes and marks them as recently used"""
+
+        if len(text_hashes) == 0:
+            return {}
+
+        self.create()
+        stale = self.table.c.last_used_at < func.now() - text(f"interval '{int(self.touch_after)} seconds'")
+        with self.Session() as sess, sess.begin():
+            stmt = select(self.table.c.text_hash, self.table.c.embedding, stale.label("stale")).where(
+                self.table.c.model == model, self.table.c.text_hash.in_(text_hashes)
+            )
+            rows = sess.execute(stmt).fetchall()
+
+        # Reads only write when an entry was last used more than touch_after seconds ago,
+        # so lookups do not lock rows or create dead tuples on every call
+        stale_hashes = [row.text_hash for row in rows if row.stale]
+        if len(stale_hashes) > 0:
+            self.touch(model, stale_hashes)
+        return {row.text_hash: list(map(float, row.embedding)) for row in rows}
+
+    def touch(self, model: str, text_hashes: List[str]) -> None:
+        """Mark entries as recently used, skipping entries which are locked by another transaction"""
+
+        try:
+            with self.Session() as sess, sess.begin():
+                entries = (
+                    select(self.table.c.model, self.table.c.text_hash)
+                    .where(self.table.c.model == model, self.table.c.text_hash.in_(text_hashes))
+                    .with_for_update(skip_locked=True)
+                )
+                sess.execute(
+                    self.table.update()
+                    .where(tuple_(self.table.c.model, self.table.c.text_hash).in_(entries))
+                    .values(last_used_at=func.now())
+                )
+        except Exception as e:
+            # last_used_at only orders evictions
+            logger.warning(f"Failed to update {self.table_name}: {e}")
+
+    def set(self, model: str, embeddings: Dict[str, List[float]]) -> None:
+        """Store embeddings keyed by text hash"""
+
+        if len(embeddings) == 0:
+            return
+
+        self.create()
+        with self.Session() as sess, sess.begin():
+            stmt = postgresql.insert(self.table).on_conflict_do_nothing(index_elements=["model", "text_hash"])
+            sess.execute(
+                stmt,
+                [
+                    dict(model=model, text_hash=text_hash, embedding=embedding)
+                    for text_hash, embedding in embeddings.items()
+                ],
+            )
+
+        self.writes_since_eviction += len(embeddings)
+        if self.max_entries is not None and self.writes_since_eviction >= self.evict_every:
+            self.evict()
+
+    def evict(self) -> int:
+        """Delete the least recently used entries above max_entries and return the number deleted"""
+
+        self.writes_since_eviction = 0
+        if self.max_entries is None:
+            return 0
+
+        with self.Session() as sess, sess.begin():
+            num_entries = sess.execute(select(func.count()).select_from(self.table)).scalar() or 0
+            num_to_evict = num_entries - self.max_entries
+            if num_to_evict <= 0:
+                return 0
+
+            lru_entries = (
+                select(self.table.c.model, self.table.c.text_hash)
+                .order_by(self.table.c.last_used_at.asc())
+                .limit(num_to_evict)
+            )
+            sess.execute(
+                self.table.delete().where(tuple_(self.table.c.model, self.table.c.text_hash).in_(lru_entries))
+            )
+        logger.debug(f"Evicted {num_to_evict} entries from {self.table_name}")
+        return num_to_evict
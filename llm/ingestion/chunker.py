@@ -0,0 +1,165 @@
+import re
+from functools import lru_cache
+from typing import Any, Iterable, Iterator, List, Tuple
+
+from phi.document import Document
+from pydantic import BaseModel
+
+from llm.settings import llm_settings
+
+# Markdown headings and numbered section titles such as "2.1 Storing food"
+HEADING_PATTERN = re.compile(r"^(?:#{1,6}[ \t]+\S|\d+(?:\.\d+)*\.?[ \t]+[A-Z][^\n.!?]{0,80}$)", re.MULTILINE)
+# Whitespace after the end of a sentence or between paragraphs
+SENTENCE_END_PATTERN = re.compile(r"(?<=[.!?])\s+|\n\s*\n\s*")
+
+
+@lru_cache(maxsize=None)
+def get_encoding(encoding_name: str) -> Any:
+    """Returns the tiktoken encoding, loaded once per process"""
+
+    import tiktoken
+
+    return tiktoken.get_encoding(encoding_name)
+
+
+def clean_text(text: str) -> str:
+    """Collapse whitespace while keeping the line breaks used to find headings and paragraphs"""
+
+    text = re.sub(r"[ \t\r\f\v]+", " ", text)
+    text = re.sub(r" ?\n ?", "\n", text)
+    return re.sub(r"\n{3,}", "\n\n", text).strip()
+
+
+class TokenChunker(BaseModel):
+    """Splits documents into chunks measured in tiktoken tokens.
+
+    Chunks start at headings and end at sentence or paragraph boundaries where possible.
+    Sentences longer than chunk_size are split on token boundaries.
+    """
+
+    # Maximum number of tokens in a chunk
+    chunk_size: int = llm_settings.chunk_size
+    # Number of tokens from the end of a chunk repeated at the start of the next chunk
+    chunk_overlap: int = llm_settings.chunk_overlap
+    # Sections smaller than this are merged into the next section instead of forming a chunk
+    min_chunk_size: int = llm_settings.chunk_min_size
+    # Start a new chunk at each heading
+    split_on_headings: bool = True
+    # End chunks at sentence boundaries, otherwise chunks are fixed size token windows
+    split_on_sentences: bool = True
+    encoding_name: str = "cl100k_base"
+
+    def fingerprint(self) -> str:
+        """Returns the chunker configuration, documents need to be chunked again when it changes"""
+
+        return self.model_dump_json()
+
+    def chunk_documents(self, documents: Iterable[Document]) -> List[Document]:
+        return list(self.iter_chunks(documents))
+
+    def iter_chunks(self, documents: Iterable[Document]) -> Iterator[Document]:
+        for document in documents:
+            yield from self.chunk_document(document)
+
+    def chunk_document(self, document: Document) -> List[Document]:
+        """Chunk the document content into documents of at most chunk_size tokens"""
+
+        chunked_documents: List[Document] = []
+        for chunk_number, (chunk, num_tokens) in enumerate(self.chunk_text(document.content), start=1):
+            meta_data = document.meta_data.copy()
+            meta_data["chunk"] = chunk_number
+            meta_data["chunk_size"] = len(chunk)
+            meta_data["chunk_tokens"] = num_tokens
+            chunked_documents.append(Document(name=document.name, meta_data=meta_data, content=chunk))
+        return chunked_documents
+
+    def chunk_text(self, text: str) -> List[Tuple[str, int]]:
+        """Returns the chunks of text along with their number of tokens"""
+
+        text = clean_text(text)
+        if text == "":
+            return []
+
+        sections = self.split_sections(text)
+        if not self.split_on_sentences:
+            return [chunk for section in sections for chunk in self.split_tokens(section, overlap=True)]
+
+        # Sentences are short, so encoding them serially is faster than a threaded batch
+        encode = get_encoding(self.encoding_name).encode_ordinary
+
+        chunks: List[Tuple[str, int]] = []
+        current: List[Tuple[str, int]] = []
+        current_tokens = 0
+        # Tokens in the current chunk which are not repeated from the previous chunk
+        new_tokens = 0
+        for section in sections:
+            # Start sections on a new chunk unless the current chunk is too small
+            if new_tokens >= self.min_chunk_size:
+                chunks.append(self.join(current))
+                current, current_tokens, new_tokens = [], 0, 0
+
+            for unit in self.split_units(section):
+                num_tokens = len(encode(unit))
+                pieces = [(unit, num_tokens)]
+                if num_tokens > self.chunk_size:
+                    pieces = self.split_tokens(unit, overlap=False)
+                for piece, piece_tokens in pieces:
+                    if current_tokens + piece_tokens > self.chunk_size:
+                        if new_tokens > 0:
+                            chunks.append(self.join(current))
+                        current = self.overlap(current) if new_tokens > 0 else []
+                        current_tokens = sum(n for _, n in current)
+                        if current_tokens + piece_tokens > self.chunk_size:
+                            current, current_tokens = [], 0
+                        new_tokens = 0
+                    current.append((piece, piece_tokens))
+                    current_tokens += piece_tokens
+                    new_tokens += piece_tokens
+
+        if new_tokens > 0:
+            chunks.append(self.join(current))
+        return [chunk for chunk in chunks if chunk[0] != ""]
+
+    def split_sections(self, text: str) -> List[str]:
+        if not self.split_on_headings:
+            return [text]
+        starts = [m.start() for m in HEADING_PATTERN.finditer(text) if m.start() > 0]
+        return [text[start:end] for start, end in zip([0] + starts, starts + [len(text)])]
+
+    def split_units(self, section: str) -> List[str]:
+        """Split a section into sentences, each keeping its trailing whitespace"""
+
+        units: List[str] = []
+        start = 0
+        for match in SENTENCE_END_PATTERN.finditer(section):
+            units.append(section[start : match.end()])
+            start = match.end()
+        if start < len(section):
+            units.append(section[start:])
+        return units
+
+    def split_tokens(self, text: str, overlap: bool) -> List[Tuple[str, int]]:
+        """Split text into windows of chunk_size tokens"""
+
+        encoding = get_encoding(self.encoding_name)
+        tokens = encoding.encode_ordinary(text)
+        step = self.chunk_size - self.chunk_overlap if overlap else self.chunk_size
+        return [
+            (encoding.decode(tokens[i : i + self.chunk_size]), len(tokens[i : i + self.chunk_size]))
+            for i in range(0, max(len(tokens) - (self.chunk_size - step), 1), max(step, 1))
+        ]
+
+    def overlap(self, units: List[Tuple[str, int]]) -> List[Tuple[str, int]]:
+        """Returns the trailing units of a chunk with at most chunk_overlap tokens"""
+
+        overlap: List[Tuple[str, int]] = []
+        num_tokens = 0
+        for unit, unit_tokens in reversed(units):
+            if num_tokens + unit_tokens > self.chunk_overlap:
+                break
+            overlap.insert(0, (unit, unit_tokens))
+            num_tokens += unit_tokens
+        return overlap
+
+    def join(self, units: List[Tuple[str, int]]) -> Tuple[str, int]:
+        return "".join(unit for unit, _ in units).strip(), sum(n for _, n in units)
@@ -0,0 +1,176 @@
+import asyncio
+import ipaddress
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from time import monotonic
+from typing import DefaultDict, Dict, Set, Tuple
+from urllib.parse import parse_qsl, urlencode, urljoin, urlparse, urlunparse
+
+import httpx
+from bs4 import BeautifulSoup
+from phi.document.reader.website import WebsiteReader
+
+from llm.settings import llm_settings
+from utils.log import logger
+
+# Links to files which are not html pages
+SKIPPED_EXTENSIONS = (".pdf", ".jpg", ".jpeg", ".png", ".gif", ".svg", ".zip", ".mp4", ".css", ".js")
+
+
+def normalize_url(url: str) -> str:
+    """Normalize a url so different spellings of the same page are only crawled once.
+
+    Lowercases the scheme and host, drops default ports, fragments and trailing slashes
+    and sorts the query parameters.
+    """
+
+    parsed = urlparse(url.strip())
+    scheme = parsed.scheme.lower()
+    host = (parsed.hostname or "").lower()
+    if parsed.port is not None and (scheme, parsed.port) not in (("http", 80), ("https", 443)):
+        host = f"{host}:{parsed.port}"
+    path = parsed.path.rstrip("/") or "/"
+    query = urlencode(sorted(parse_qsl(parsed.query, keep_blank_values=True)))
+    return urlunparse((scheme, host, path, "", query, ""))
+
+
+def get_primary_domain(url: str) -> str:
+    """Returns the domain without subdomains, or the address for ip hosts"""
+
+    host = (urlparse(url).hostname or "").lower()
+    try:
+        ipaddress.ip_address(host)
+        return host
+    except ValueError:
+        return ".".join(host.split(".")[-2:])
+
+
+class AsyncWebsiteReader(WebsiteReader):
+    """WebsiteReader which crawls pages concurrently using asyncio.
+
+    Urls are deduplicated after normalization and the frontier is crawled breadth first.
+    Requests share a single http client so connections are reused, each host is limited
+    to max_per_host concurrent requests and requests to a host start at least host_delay seconds apart.
+    """
+
+    # Maximum number of requests in flight
+    max_concurrency: int = llm_settings.crawl_concurrency
+    # Maximum number of requests in flight to a single host
+    max_per_host: int = llm_settings.crawl_per_host_concurrency
+    # Minimum number of seconds between requests to the same host
+    host_delay: float = llm_settings.crawl_host_delay
+    # Request timeout in seconds
+    timeout: float = llm_settings.crawl_timeout
+
+    def crawl(self, url: str, starting_depth: int = 1) -> Dict[str, str]:
+        """Crawls a website and returns a dictionary of urls and their main content"""
+
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return asyncio.run(self.acrawl(url=url, starting_depth=starting_depth))
+
+        # Called from a running event loop, crawl on a separate thread with its own loop
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            return executor.submit(asyncio.run, self.acrawl(url=url, starting_depth=starting_depth)).result()
+
+    async def acrawl(self, url: str, starting_depth: int = 1) -> Dict[str, str]:
+        """Crawls a website and returns a dictionary of urls and their main content"""
+
+        primary_domain = get_primary_domain(url)
+        crawler_result: Dict[str, str] = {}
+        frontier: asyncio.Queue[Tuple[str, int]] = asyncio.Queue()
+        seen: Set[str] = set()
+        done = asyncio.Event()
+
+        # Per host state used for politeness
+        host_semaphores: DefaultDict[str, asyncio.Semaphore] = defaultdict(
+            lambda: asyncio.Semaphore(max(self.max_per_host, 1))
+        )
+        host_locks: DefaultDict[str, asyncio.Lock] = defaultdict(asyncio.Lock)
+        host_next_request: Dict[str, float] = {}
+
+        def enqueue(link: str, depth: int) -> None:
+            parsed = urlparse(link)
+            if (
+                parsed.scheme not in ("http", "https")
+                or not self._is_same_site(link, primary_domain)
+                or parsed.path.lower().endswith(SKIPPED_EXTENSIONS)
+                or depth > self.max_depth
+            ):
+                return
+            normalized = normalize_url(link)
+            if normalized in seen:
+                return
+            seen.add(normalized)
+            frontier.put_nowait((normalized, depth))
+
+        async def wait_for_turn(host: str) -> None:
+            async with host_locks[host]:
+                now = monotonic()
+                start_at = max(host_next_request.get(host, now), now)
+                host_next_request[host] = start_at + self.host_delay
+            if start_at > now:
+                await asyncio.sleep(start_at - now)
+
+        async def fetch(client: httpx.AsyncClient, page_url: str, depth: int) -> None:
+            host = urlparse(page_url).netloc
+            async with host_semaphores[host]:
+                if done.is_set():
+                    return
+                await wait_for_turn(host)
+                logger.debug(f"Crawling: {page_url}")
+                response = await client.get(page_url)
+
+            if response.status_code >= 400 or "html" not in response.headers.get("content-type", "html"):
+                return
+            # Redirects to a page which was already crawled are skipped
+            final_url = normalize_url(str(response.url))
+            if final_url != page_url:
+                if final_url in seen:
+                    return
+                seen.add(final_url)
+
+            soup = BeautifulSoup(response.content, "html.parser")
+            main_content = self._extract_main_content(soup)
+            if main_content and len(crawler_result) < self.max_links:
+                crawler_result[final_url] = main_content
+                if len(crawler_result) >= self.max_links:
+                    done.set()
+                    return
+
+            for link in soup.find_all("a", href=True):
+                enqueue(urljoin(str(response.url), link["href"]), depth + 1)
+
+        async def worker(client: httpx.AsyncClient) -> None:
+            while True:
+                page_url, depth = await frontier.get()
+                try:
+                    if not done.is_set():
+                        await fetch(client, page_url, depth)
+                except Exception as e:
+                    logger.debug(f"Failed to crawl: {page_url}: {e}")
+                finally:
+                    frontier.task_done()
+
+        enqueue(url, starting_depth)
+        limits = httpx.Limits(
+            max_connections=max(self.max_concurrency, 1),
+            max_keepalive_connections=max(self.max_concurrency, 1),
+        )
+        async with httpx.AsyncClient(timeout=self.timeout, limits=limits, follow_redirects=True) as client:
+            workers = [asyncio.create_task(worker(client)) for _ in range(max(self.max_concurrency, 1))]
+            frontier_empty = asyncio.create_task(frontier.join())
+            max_links_reached = asyncio.create_task(done.wait())
+            await asyncio.wait([frontier_empty, max_links_reached], return_when=asyncio.FIRST_COMPLETED)
+            for task in [*workers, frontier_empty, max_links_reached]:
+                task.cancel()
+            await asyncio.gather(*workers, frontier_empty, max_links_reached, return_exceptions=True)
+
+        logger.debug(f"Crawled {len(crawler_result)} pages from {url}")
+        return crawler_result
+
+    @staticmethod
+    def _is_same_site(url: str, primary_domain: str) -> bool:
+        host = (urlparse(url).hostname or "").lower()
+        return host == primary_domain or host.endswith(f".{primary_domain}")
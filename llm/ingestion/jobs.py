@@ -0,0 +1,411 @@
+import os
+import socket
+from datetime import datetime
+from threading import Event, Lock, Thread
+from typing import Any, Dict, List, Literal, Optional
+from uuid import uuid4
+
+from phi.knowledge.base import KnowledgeBase
+from pydantic import BaseModel
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.engine import Engine, create_engine
+from sqlalchemy.inspection import inspect
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.schema import Column, Index, MetaData, Table
+from sqlalchemy.sql.expression import func, select, text
+from sqlalchemy.types import Boolean, DateTime, Integer, String
+
+from llm.ingestion.knowledge_base import PipelinedKnowledgeBase
+from llm.ingestion.pipeline import IngestionCancelled, IngestionReport
+from llm.settings import llm_settings
+from utils.log import logger
+
+JobStatus = Literal["queued", "running", "succeeded", "failed"]
+
+
+class IngestionJob(BaseModel):
+    """A request to load a knowledge base, along with its progress"""
+
+    id: str
+    # Vector db collection of the knowledge base to load
+    knowledge_base: str
+    status: JobStatus
+    recreate: bool = False
+    report: IngestionReport = IngestionReport()
+    # Estimated fraction of the load which is complete and seconds remaining while the job is running
+    progress: float = 0
+    eta_seconds: Optional[float] = None
+    error: Optional[str] = None
+    attempts: int = 0
+    worker_id: Optional[str] = None
+    created_at: Optional[datetime] = None
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    heartbeat_at: Optional[datetime] = None
+
+
+class IngestionJobs:
+    def __init__(
+        self,
+        table_name: str = "ingestion_jobs",
+        schema: Optional[str] = "llm",
+        db_url: Optional[str] = None,
+        db_engine: Optional[Engine] = None,
+        stale_after: int = llm_settings.ingest_job_stale_after,
+        max_attempts: int = llm_settings.ingest_job_max_attempts,
+    ):
+        """
+        Queue of knowledge base loads shared by all workers using the database.
+
+        Workers claim jobs with FOR UPDATE SKIP LOCKED so a job is only run by one worker at a time,
+        and at most one job per knowledge base is queued or running. A running job whose worker
+        has not sent a heartbeat for stale_after seconds, for example because the worker restarted,
+        is claimed again until it has been attempted max_attempts times.
+
+        :param table_name: The name of the table to store jobs in.
+        :param schema: The schema to store the table in.
+        :param db_url: The database URL to connect to.
+        :param db_engine: The database engine to use.
+        :param stale_after: Number of seconds without a heartbeat after which a running job is claimed again.
+        :param max_attempts: Number of times a job is started before it is failed.
+        """
+        _engine: Optional[Engine] = db_engine
+        if _engine is None and db_url is not None:
+            _engine = create_engine(db_url)
+
+        if _engine is None:
+            raise ValueError("Must provide either db_url or db_engine")
+
+        # Database attributes
+        self.table_name: str = table_name
+        self.schema: Optional[str] = schema
+        self.db_engine: Engine = _engine
+        self.metadata: MetaData = MetaData(schema=self.schema)
+
+        # Job attributes
+        self.stale_after: int = stale_after
+        self.max_attempts: int = max_attempts
+
+        # Database session
+        self.Session: sessionmaker[Session] = sessionmaker(bind=self.db_engine)
+
+        # Database table for the jobs
+        self.table: Table = self.get_table()
+        self.table_created: bool = False
+
+    def get_table(self) -> Table:
+        return Table(
+            self.table_name,
+            self.metadata,
+            Column("id", String, primary_key=True),
+            Column("knowledge_base", String, nullable=False),
+            # queued, running, succeeded or failed
+            Column("status", String, nullable=False),
+            Column("recreate", Boolean, server_default=text("false")),
+            # IngestionReport updated by the worker as the load progresses
+            Column("report", postgresql.JSONB),
+            Column("error", postgresql.TEXT),
+            Column("attempts", Integer, server_default=text("0")),
+            Column("worker_id", String),
+            Column("created_at", DateTime(timezone=True), server_default=text("now()")),
+            Column("started_at", DateTime(timezone=True)),
+            Column("finished_at", DateTime(timezone=True)),
+            Column("heartbeat_at", DateTime(timezone=True)),
+            # Only one active job per knowledge base
+            Index(
+                f"{self.table_name}_active_idx",
+                "knowledge_base",
+                unique=True,
+                postgresql_where=text("status IN ('queued', 'running')"),
+            ),
+            Index(f"{self.table_name}_created_at_idx", "created_at"),
+            extend_existing=True,
+        )
+
+    def table_exists(self) -> bool:
+        logger.debug(f"Checking if table exists: {self.table.name}")
+        try:
+            return inspect(self.db_engine).has_table(self.table.name, schema=self.schema)
+        except Exception as e:
+            logger.error(e)
+            return False
+
+    def create(self) -> None:
+        if self.table_created:
+            return
+        if not self.table_exists():
+            if self.schema is not None:
+                with self.Session() as sess, sess.begin():
+                    logger.debug(f"Creating schema: {self.schema}")
+                    sess.execute(text(f"create schema if not exists {self.schema};"))
+            logger.debug(f"Creating table: {self.table_name}")
+            self.metadata.create_all(self.db_engine, tables=[self.table])
+        self.table_created = True
+
+    def submit(self, knowledge_base: str, recreate: bool = False) -> IngestionJob:
+        """Queue a load of the knowledge base, or return the job which is already queued or running"""
+
+        self.create()
+        with self.Session() as sess, sess.begin():
+            stmt = postgresql.insert(self.table).values(
+                id=str(uuid4()),
+                knowledge_base=knowledge_base,
+                status="queued",
+                recreate=recreate,
+                report=IngestionReport().model_dump(),
+            )
+            row = sess.execute(
+                stmt.on_conflict_do_nothing(
+                    index_elements=["knowledge_base"],
+                    index_where=text("status IN ('queued', 'running')"),
+                ).returning(self.table)
+            ).first()
+            if row is None:
+                row = sess.execute(
+                    select(self.table).where(
+                        self.table.c.knowledge_base == knowledge_base,
+                        self.table.c.status.in_(["queued", "running"]),
+                    )
+                ).first()
+        if row is None:
+            raise RuntimeError(f"Failed to queue a job for {knowledge_base}")
+        return self.to_job(row)
+
+    def get(self, job_id: str) -> Optional[IngestionJob]:
+        self.create()
+        with self.Session() as sess, sess.begin():
+            row = sess.execute(select(self.table).where(self.table.c.id == job_id)).first()
+            return self.to_job(row) if row is not None else None
+
+    def get_jobs(self, knowledge_base: Optional[str] = None, limit: int = 20) -> List[IngestionJob]:
+        """Returns the most recent jobs, optionally for a single knowledge base"""
+
+        self.create()
+        with self.Session() as sess, sess.begin():
+            stmt = select(self.table).order_by(self.table.c.created_at.desc()).limit(limit)
+            if knowledge_base is not None:
+                stmt = stmt.where(self.table.c.knowledge_base == knowledge_base)
+            return [self.to_job(row) for row in sess.execute(stmt)]
+
+    def claim(self, worker_id: str) -> Optional[IngestionJob]:
+        """Start the oldest queued job, or a running job whose worker stopped sending heartbeats"""
+
+        self.create()
+        stale = self.table.c.heartbeat_at < func.now() - text(f"interval '{int(self.stale_after)} seconds'")
+        with self.Session() as sess, sess.begin():
+            # Fail abandoned jobs which have been attempted too many times
+            sess.execute(
+                self.table.update()
+                .where(self.table.c.status == "running", stale, self.table.c.attempts >= self.max_attempts)
+                .values(status="failed", error="Worker stopped responding", finished_at=func.now())
+            )
+            candidate = (
+                select(self.table.c.id)
+                .where((self.table.c.status == "queued") | ((self.table.c.status == "running") & stale))
+                .order_by(self.table.c.created_at)
+                .limit(1)
+                .with_for_update(skip_locked=True)
+                .scalar_subquery()
+            )
+            row = sess.execute(
+                self.table.update()
+                .where(self.table.c.id == candidate)
+                .values(
+                    status="running",
+                    worker_id=worker_id,
+                    attempts=self.table.c.attempts + 1,
+                    started_at=func.now(),
+                    heartbeat_at=func.now(),
+                )
+                .returning(self.table)
+            ).first()
+            return self.to_job(row) if row is not None else None
+
+    def heartbeat(self, job_id: str, worker_id: str, report: Optional[IngestionReport] = None) -> bool:
+        """Record that the worker is running the job and its progress.
+
+        Returns False if the job has been claimed by another worker.
+        """
+
+        values: Dict[str, Any] = dict(heartbeat_at=func.now())
+        if report is not None:
+            values["report"] = report.model_dump()
+        with self.Session() as sess, sess.begin():
+            result = sess.execute(
+                self.table.update()
+                .where(
+                    self.table.c.id == job_id,
+                    self.table.c.worker_id == worker_id,
+                    self.table.c.status == "running",
+                )
+                .values(**values)
+            )
+            return result.rowcount > 0  # type: ignore
+
+    def finish(
+        self,
+        job_id: str,
+        worker_id: str,
+        report: Optional[IngestionReport] = None,
+        error: Optional[str] = None,
+    ) -> bool:
+        """Mark the job as succeeded, or failed when an error is provided.
+
+        Returns False if the job is no longer run by the worker.
+        """
+
+        values: Dict[str, Any] = dict(
+            status="failed" if error is not None else "succeeded", error=error, finished_at=func.now()
+        )
+        if report is not None:
+            values["report"] = report.model_dump()
+        with self.Session() as sess, sess.begin():
+            result = sess.execute(
+                self.table.update()
+                .where(
+                    self.table.c.id == job_id,
+                    self.table.c.worker_id == worker_id,
+                    self.table.c.status == "running",
+                )
+                .values(**values)
+            )
+            return result.rowcount > 0  # type: ignore
+
+    def to_job(self, row: Any) -> IngestionJob:
+        report = IngestionReport(**row.report) if row.report else IngestionReport()
+        job = IngestionJob(
+            id=row.id,
+            knowledge_base=row.knowledge_base,
+            status=row.status,
+            recreate=row.recreate,
+            report=report,
+            error=row.error,
+            attempts=row.attempts,
+            worker_id=row.worker_id,
+            created_at=row.created_at,
+            started_at=row.started_at,
+            finished_at=row.finished_at,
+            heartbeat_at=row.heartbeat_at,
+        )
+        if job.status == "succeeded":
+            job.progress = 1
+        elif job.status == "running":
+            job.progress = report.progress()
+            job.eta_seconds = report.eta()
+        return job
+
+
+class IngestionWorker:
+    def __init__(
+        self,
+        jobs: IngestionJobs,
+        knowledge_bases: Dict[str, KnowledgeBase],
+        poll_interval: float = llm_settings.ingest_job_poll_interval,
+        heartbeat_interval: float = llm_settings.ingest_job_heartbeat_interval,
+    ):
+        """
+        Runs ingestion jobs in a background thread, one job at a time.
+
+        :param jobs: The job queue to claim jobs from.
+        :param knowledge_bases: Knowledge bases which can be loaded, keyed by their vector db collection.
+        :param poll_interval: Number of seconds between checks for new jobs.
+        :param heartbeat_interval: Number of seconds between heartbeats and progress updates of a running job.
+        """
+        self.jobs: IngestionJobs = jobs
+        self.knowledge_bases: Dict[str, KnowledgeBase] = knowledge_bases
+        self.poll_interval: float = poll_interval
+        self.heartbeat_interval: float = heartbeat_interval
+        self.worker_id: str = f"{socket.gethostname()}-{os.getpid()}-{uuid4().hex[:8]}"
+        self.stop_event: Event = Event()
+        self.thread: Optional[Thread] = None
+
+    def start(self) -> None:
+        if self.thread is not None and self.thread.is_alive():
+            return
+        self.stop_event.clear()
+        self.thread = Thread(target=self.run, name="ingestion-worker", daemon=True)
+        self.thread.start()
+        logger.info(f"Started ingestion worker {self.worker_id}")
+
+    def stop(self) -> None:
+        """Stop claiming jobs, a job which is running is claimed again by another worker once it is stale"""
+
+        self.stop_event.set()
+
+    def run(self) -> None:
+        while not self.stop_event.is_set():
+            try:
+                job = self.jobs.claim(worker_id=self.worker_id)
+            except Exception as e:
+                logger.error(f"Failed to claim ingestion job: {e}")
+                job = None
+            if job is None:
+                self.stop_event.wait(self.poll_interval)
+                continue
+            self.run_job(job)
+
+    def run_job(self, job: IngestionJob) -> None:
+        logger.info(f"Running ingestion job {job.id} for {job.knowledge_base} (attempt {job.attempts})")
+        knowledge_base = self.knowledge_bases.get(job.knowledge_base)
+        if knowledge_base is None:
+            self.jobs.finish(job.id, self.worker_id, error=f"Unknown knowledge base: {job.knowledge_base}")
+            return
+
+        # The latest report is written to the job by the heartbeat thread
+        lock = Lock()
+        latest: Dict[str, IngestionReport] = {}
+        done = Event()
+        # Set when the job went stale and was claimed by another worker, the load is then stopped
+        claim_lost = Event()
+
+        def progress(report: IngestionReport) -> None:
+            with lock:
+                latest["report"] = report
+
+        def heartbeat() -> None:
+            while not done.wait(self.heartbeat_interval):
+                with lock:
+                    report = latest.get("report")
+                try:
+                    if not self.jobs.heartbeat(job.id, self.worker_id, report):
+                        logger.warning(f"Ingestion job {job.id} was claimed by another worker, stopping")
+                        claim_lost.set()
+                        return
+                except Exception as e:
+                    logger.warning(f"Failed to update ingestion job {job.id}: {e}")
+
+        heartbeat_thread = Thread(target=heartbeat, name=f"ingestion-heartbeat-{job.id}", daemon=True)
+        heartbeat_thread.start()
+        error: Optional[str] = None
+        try:
+            if isinstance(knowledge_base, PipelinedKnowledgeBase):
+                knowledge_base.load(recreate=job.recreate, progress=progress, cancel=claim_lost)
+            else:
+                knowledge_base.load(recreate=job.recreate)
+        except IngestionCancelled as e:
+            logger.warning(e)
+        except Exception as e:
+            logger.exception(e)
+            error = str(e)
+        finally:
+            done.set()
+            heartbeat_thread.join()
+
+        # A failed load keeps the progress written by the heartbeats, last_report is from a previous load
+        report = None
+        if (
+            error is None
+            and isinstance(knowledge_base, PipelinedKnowledgeBase)
+            and knowledge_base.pipeline is not None
+        ):
+            report = knowledge_base.pipeline.last_report
+        if claim_lost.is_set():
+            logger.info(f"Stopped ingestion job {job.id} for {job.knowledge_base}")
+            return
+        try:
+            if not self.jobs.finish(job.id, self.worker_id, report=report, error=error):
+                logger.warning(f"Ingestion job {job.id} was claimed by another worker before it finished")
+                return
+        except Exception as e:
+            logger.error(f"Failed to finish ingestion job {job.id}: {e}")
+        logger.info(f"Finished ingestion job {job.id} for {job.knowledge_base}")
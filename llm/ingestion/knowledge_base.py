@@ -0,0 +1,167 @@
+from threading import Event
+from typing import Callable, Iterable, Iterator, List, Literal, Optional
+
+from phi.document import Document
+from phi.document.reader.base import Reader
+from phi.document.reader.pdf import PDFReader, PDFUrlReader
+from phi.knowledge.base import KnowledgeBase
+from phi.knowledge.combined import CombinedKnowledgeBase
+from phi.knowledge.pdf import PDFKnowledgeBase, PDFUrlKnowledgeBase
+from phi.knowledge.website import WebsiteKnowledgeBase
+from pydantic import model_validator
+
+from llm.answer_cache import AnswerCache
+from llm.embedder import embed_documents
+from llm.ingestion.chunker import TokenChunker
+from llm.ingestion.crawler import AsyncWebsiteReader
+from llm.ingestion.pipeline import IngestionPipeline, IngestionReport
+from llm.ingestion.sources import get_sources
+from llm.settings import llm_settings
+from llm.vectordb import PgVectorDb, get_content_hash
+from utils.log import logger
+
+
+class PipelinedKnowledgeBase(KnowledgeBase):
+    """Knowledge base which loads using an IngestionPipeline when one is provided"""
+
+    pipeline: Optional[IngestionPipeline] = None
+    # "hybrid" fuses vector and full text search results, which finds exact identifiers
+    # that vector search alone misses
+    search_type: Literal["vector", "hybrid"] = "vector"
+    # Answers created from this knowledge base, invalidated whenever it is loaded
+    answer_cache: Optional[AnswerCache] = None
+    # Chunks documents by tokens instead of using the reader's chunking.
+    # A CombinedKnowledgeBase uses the chunkers of the knowledge bases it is built from.
+    chunker: Optional[TokenChunker] = None
+
+    @model_validator(mode="after")  # type: ignore
+    def disable_reader_chunking(self) -> "PipelinedKnowledgeBase":
+        reader = getattr(self, "reader", None)
+        if self.chunker is not None and isinstance(reader, Reader) and reader.chunk:
+            # Copy the reader as the default reader instance is shared by knowledge bases
+            self.reader = reader.model_copy(update={"chunk": False})
+        return self
+
+    @property
+    def document_lists(self) -> Iterator[List[Document]]:
+        """Iterate over the documents read by the knowledge base, chunked using the chunker"""
+
+        for documents in super().document_lists:
+            if self.chunker is not None and getattr(self, "reader", None) is not None:
+                documents = self.chunker.chunk_documents(documents)
+            yield documents
+
+    def load(
+        self,
+        recreate: bool = False,
+        progress: Optional[Callable[[IngestionReport], None]] = None,
+        cancel: Optional[Event] = None,
+    ) -> None:
+        """Load the knowledge base to the vector db.
+
+        progress is called as the load progresses, and the load stops when cancel is set,
+        when the knowledge base is loaded using its pipeline.
+        """
+
+        if (
+            self.pipeline is not None
+            and isinstance(self.vector_db, PgVectorDb)
+            and get_sources(self) is not None
+        ):
+            self.pipeline.run(knowledge_base=self, recreate=recreate, progress=progress, cancel=cancel)
+        elif self.chunker is not None and isinstance(self.vector_db, PgVectorDb):
+            # Some knowledge bases load from their reader directly, bypassing document_lists
+            if recreate:
+                logger.debug("Deleting collection")
+                self.vector_db.delete()
+            for documents in self.document_lists:
+                self.load_documents(documents)
+        else:
+            super().load(recreate=recreate)
+        self.invalidate_answer_cache()
+
+    def invalidate_answer_cache(self) -> None:
+        """Stop returning cached answers created from the previous contents of the knowledge base"""
+
+        if self.answer_cache is None or self.vector_db is None:
+            return
+        try:
+            self.answer_cache.invalidate(collection=self.vector_db.collection)  # type: ignore
+        except Exception as e:
+            logger.error(f"Failed to invalidate answer cache: {e}")
+
+    def search(self, query: str, num_documents: Optional[int] = None) -> List[Document]:
+        """Returns relevant documents matching the query"""
+
+        if self.search_type == "hybrid" and isinstance(self.vector_db, PgVectorDb):
+            _num_documents = num_documents or self.num_documents
+            logger.debug(
+                f"Getting {_num_documents} relevant documents for query using hybrid search: {query}"
+            )
+            return self.vector_db.hybrid_search(query=query, limit=_num_documents)
+        return super().search(query=query, num_documents=num_documents)
+
+    def load_documents(self, documents: List[Document], skip_existing: bool = True) -> None:
+        """Load documents to the knowledge base, embedding them in batched requests"""
+
+        if not isinstance(self.vector_db, PgVectorDb):
+            super().load_documents(documents=documents, skip_existing=skip_existing)
+            return
+
+        self.vector_db.create()
+
+        # Drop duplicates and documents which already exist using a single query
+        documents_by_hash = {get_content_hash(document.content): document for document in documents}
+        if skip_existing:
+            existing_hashes = self.vector_db.get_existing_content_hashes(list(documents_by_hash.keys()))
+            documents_by_hash = {h: d for h, d in documents_by_hash.items() if h not in existing_hashes}
+        documents_to_load = list(documents_by_hash.values())
+
+        embed_documents(embedder=self.vector_db.embedder, documents=documents_to_load)
+        self.vector_db.insert_embedded(documents_to_load)
+        logger.info(f"Loaded {len(documents_to_load)} documents to knowledge base")
+        if len(documents_to_load) > 0:
+            self.invalidate_answer_cache()
+
+    def load_document_stream(
+        self, documents: Iterable[Document], batch_size: int = llm_settings.ingest_embed_batch_size
+    ) -> int:
+        """Load documents in batches as they are produced and return the number of documents read.
+
+        Only one batch is held in memory at a time and each batch is searchable once it is loaded.
+        """
+
+        num_documents = 0
+        batch: List[Document] = []
+        for document in documents:
+            batch.append(document)
+            num_documents += 1
+            if len(batch) >= batch_size:
+                self.load_documents(batch)
+                batch = []
+        if len(batch) > 0:
+            self.load_documents(batch)
+        return num_documents
+
+
+class PipelinedPDFKnowledgeBase(PipelinedKnowledgeBase, PDFKnowledgeBase):
+    # Redeclared as the reader field of KnowledgeBase, which defaults to None, takes precedence
+    reader: PDFReader = PDFReader()
+
+
+class PipelinedPDFUrlKnowledgeBase(PipelinedKnowledgeBase, PDFUrlKnowledgeBase):
+    reader: PDFUrlReader = PDFUrlReader()
+
+
+class PipelinedCombinedKnowledgeBase(PipelinedKnowledgeBase, CombinedKnowledgeBase):
+    pass
+
+
+class PipelinedWebsiteKnowledgeBase(PipelinedKnowledgeBase, WebsiteKnowledgeBase):
+    @model_validator(mode="after")  # type: ignore
+    def set_reader(self) -> "PipelinedWebsiteKnowledgeBase":
+        if self.reader is None:
+            self.reader = AsyncWebsiteReader(
+                max_depth=self.max_depth, max_links=self.max_links, chunk=self.chunker is None
+            )
+        return self  # type: ignore
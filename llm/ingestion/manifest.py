@@ -0,0 +1,140 @@
+from typing import Dict, List, Optional
+
+from pydantic import BaseModel
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.engine import Engine, create_engine
+from sqlalchemy.inspection import inspect
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.schema import Column, MetaData, PrimaryKeyConstraint, Table
+from sqlalchemy.sql.expression import select, text
+from sqlalchemy.types import DateTime, String
+
+from utils.log import logger
+
+
+class ManifestEntry(BaseModel):
+    """A source loaded into a collection along with the hashes of its content and chunks"""
+
+    source: str
+    source_type: str
+    content_hash: str
+    chunk_hashes: List[str] = []
+
+
+class IngestionManifest:
+    def __init__(
+        self,
+        table_name: str = "ingestion_manifest",
+        schema: Optional[str] = "llm",
+        db_url: Optional[str] = None,
+        db_engine: Optional[Engine] = None,
+    ):
+        """
+        Tracks the sources loaded into each vector db collection so unchanged sources can be skipped,
+        changed sources re-embedded and deleted sources pruned.
+
+        :param table_name: The name of the table to store the manifest in.
+        :param schema: The schema to store the table in.
+        :param db_url: The database URL to connect to.
+        :param db_engine: The database engine to use.
+        """
+        _engine: Optional[Engine] = db_engine
+        if _engine is None and db_url is not None:
+            _engine = create_engine(db_url)
+
+        if _engine is None:
+            raise ValueError("Must provide either db_url or db_engine")
+
+        # Database attributes
+        self.table_name: str = table_name
+        self.schema: Optional[str] = schema
+        self.db_engine: Engine = _engine
+        self.metadata: MetaData = MetaData(schema=self.schema)
+
+        # Database session
+        self.Session: sessionmaker[Session] = sessionmaker(bind=self.db_engine)
+
+        # Database table for the manifest
+        self.table: Table = self.get_table()
+
+    def get_table(self) -> Table:
+        return Table(
+            self.table_name,
+            self.metadata,
+            # Vector db collection the source is loaded into
+            Column("collection", String),
+            # File path or url of the source
+            Column("source", String),
+            Column("source_type", String),
+            # Hash of the source content when it was loaded
+            Column("content_hash", String),
+            # Content hashes of the documents created from the source
+            Column("chunk_hashes", postgresql.JSONB),
+            Column("created_at", DateTime(timezone=True), server_default=text("now()")),
+            Column("updated_at", DateTime(timezone=True), onupdate=text("now()")),
+            PrimaryKeyConstraint("collection", "source"),
+            extend_existing=True,
+        )
+
+    def table_exists(self) -> bool:
+        logger.debug(f"Checking if table exists: {self.table.name}")
+        try:
+            return inspect(self.db_engine).has_table(self.table.name, schema=self.schema)
+        except Exception as e:
+            logger.error(e)
+            return False
+
+    def create(self) -> None:
+        if not self.table_exists():
+            if self.schema is not None:
+                with self.Session() as sess, sess.begin():
+                    logger.debug(f"Creating schema: {self.schema}")
+                    sess.execute(text(f"create schema if not exists {self.schema};"))
+            logger.debug(f"Creating table: {self.table_name}")
+            self.table.create(self.db_engine)
+
+    def get_entries(self, collection: str) -> Dict[str, ManifestEntry]:
+        """Returns the manifest entries for a collection keyed by source"""
+
+        self.create()
+        with self.Session() as sess, sess.begin():
+            stmt = select(self.table).where(self.table.c.collection == collection)
+            return {
+                row.source: ManifestEntry(
+                    source=row.source,
+                    source_type=row.source_type,
+                    content_hash=row.content_hash,
+                    chunk_hashes=row.chunk_hashes or [],
+                )
+                for row in sess.execute(stmt)
+            }
+
+    def upsert(self, collection: str, entries: List[ManifestEntry]) -> None:
+        if len(entries) == 0:
+            return
+
+        self.create()
+        with self.Session() as sess, sess.begin():
+            for entry in entries:
+                stmt = postgresql.insert(self.table).values(collection=collection, **entry.model_dump())
+                stmt = stmt.on_conflict_do_update(
+                    index_elements=["collection", "source"],
+                    set_=dict(
+                        source_type=stmt.excluded.source_type,
+                        content_hash=stmt.excluded.content_hash,
+                        chunk_hashes=stmt.excluded.chunk_hashes,
+                    ),
+                )
+                sess.execute(stmt)
+
+    def delete(self, collection: str, sources: Optional[List[str]] = None) -> None:
+        """Delete the entries for sources in a collection or all entries if sources is None"""
+
+        if not self.table_exists():
+            return
+
+        with self.Session() as sess, sess.begin():
+            stmt = self.table.delete().where(self.table.c.collection == collection)
+            if sources is not None:
+                stmt = stmt.where(self.table.c.source.in_(sources))
+            sess.execute(stmt)
@@ -0,0 +1,42 @@
+from pathlib import Path
+from typing import IO, Any, Iterator, List, Union
+
+from phi.document import Document
+from phi.document.reader.pdf import PDFReader
+
+from utils.log import logger
+
+
+class StreamingPDFReader(PDFReader):
+    """PDFReader which yields documents page by page instead of reading the whole pdf up front"""
+
+    def read(self, pdf: Union[str, Path, IO[Any]]) -> List[Document]:
+        return list(self.iter_documents(pdf))
+
+    def iter_documents(self, pdf: Union[str, Path, IO[Any]]) -> Iterator[Document]:
+        """Yield the documents for each page, chunked if chunk is True, as soon as the page is read"""
+
+        if not pdf:
+            raise ValueError("No pdf provided")
+
+        from pypdf import PdfReader as DocumentReader
+
+        doc_name = ""
+        try:
+            if isinstance(pdf, str):
+                doc_name = pdf.split("/")[-1].split(".")[0].replace(" ", "_")
+            elif isinstance(pdf, Path):
+                doc_name = pdf.stem.replace(" ", "_")
+            else:
+                doc_name = pdf.name.split(".")[0]
+        except Exception:
+            doc_name = "pdf"
+
+        logger.info(f"Reading: {doc_name}")
+        doc_reader = DocumentReader(pdf)
+        for page_number, page in enumerate(doc_reader.pages, start=1):
+            document = Document(name=doc_name, meta_data={"page": page_number}, content=page.extract_text())
+            if self.chunk:
+                yield from self.chunk_document(document)
+            else:
+                yield document
@@ -0,0 +1,443 @@
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from dataclasses import dataclass, field
+from queue import Queue
+from threading import Event, Lock, Thread
+from time import perf_counter
+from typing import Callable, Dict, Generator, List, Optional, Set, Tuple
+
+from phi.document import Document
+from phi.knowledge.base import KnowledgeBase
+from pydantic import BaseModel, ConfigDict
+
+from llm.embedder import embed_documents
+from llm.ingestion.manifest import IngestionManifest, ManifestEntry
+from llm.ingestion.sources import Source, SourceResult, get_source_collections, get_sources, read_source
+from llm.settings import llm_settings
+from llm.vectordb import PgVectorDb, get_content_hash
+from utils.log import logger
+
+# A batch of documents read from the source with the given uri
+Batch = Tuple[str, List[Document]]
+
+
+class IngestionCancelled(Exception):
+    """Raised by IngestionPipeline.run when the load is cancelled"""
+
+
+class IngestionReport(BaseModel):
+    """Counters collected while loading a knowledge base"""
+
+    sources: int = 0
+    # Sources read so far, including unchanged sources and sources which failed to read
+    parsed: int = 0
+    unchanged: int = 0
+    removed: int = 0
+    pages: int = 0
+    chunks: int = 0
+    skipped: int = 0
+    embeddings: int = 0
+    reused_embeddings: int = 0
+    embedding_tokens: int = 0
+    inserted: int = 0
+    deleted: int = 0
+    errors: List[str] = []
+    elapsed: float = 0
+
+    def per_second(self, count: int) -> float:
+        return count / self.elapsed if self.elapsed > 0 else 0
+
+    def progress(self) -> float:
+        """Estimated fraction of the load which is complete, from the sources read and documents inserted"""
+
+        if self.sources == 0:
+            return 0
+        num_to_insert = self.chunks - self.skipped
+        inserted = self.inserted / num_to_insert if num_to_insert > 0 else 1
+        return self.parsed / self.sources * inserted
+
+    def eta(self) -> Optional[float]:
+        """Estimated number of seconds until the load completes"""
+
+        progress = self.progress()
+        if progress <= 0:
+            return None
+        return self.elapsed * (1 - progress) / progress
+
+    def summary(self) -> str:
+        return (
+            f"Loaded {self.inserted} documents from {self.sources} sources in {self.elapsed:.2f}s: "
+            f"{self.per_second(self.pages):.1f} pages/s, "
+            f"{self.per_second(self.chunks):.1f} chunks/s, "
+            f"{self.per_second(self.embeddings):.1f} embeddings/s "
+            f"({self.reused_embeddings} embeddings reused) "
+            f"({self.unchanged} unchanged sources, {self.removed} removed sources, "
+            f"{self.skipped} skipped, {self.deleted} deleted, {len(self.errors)} errors)"
+        )
+
+
+@dataclass
+class IngestionState:
+    """State shared by the stages of a single pipeline run"""
+
+    vector_db: PgVectorDb
+    recreate: bool
+    # Loading into a new collection, documents are copied without upserts and indexed after the load
+    bulk_load: bool = False
+    # Called with a copy of the report as the load progresses
+    progress: Optional[Callable[[IngestionReport], None]] = None
+    start: float = field(default_factory=perf_counter)
+    # Collections with the same embedder to copy existing embeddings from
+    shared_collections: List[PgVectorDb] = field(default_factory=list)
+    report: IngestionReport = field(default_factory=IngestionReport)
+    lock: Lock = field(default_factory=Lock)
+    # Content hashes queued during this run, used to drop duplicate documents
+    seen_hashes: Set[str] = field(default_factory=set)
+    # Manifest entries for sources read during this run
+    entries: Dict[str, ManifestEntry] = field(default_factory=dict)
+    # Sources with documents which failed to embed or insert
+    failed_sources: Set[str] = field(default_factory=set)
+    # Set to stop the load, documents which are queued are dropped
+    cancel: Optional[Event] = None
+
+    def cancelled(self) -> bool:
+        return self.cancel is not None and self.cancel.is_set()
+
+    def report_progress(self) -> None:
+        if self.progress is None:
+            return
+        with self.lock:
+            report = self.report.model_copy(deep=True)
+        report.elapsed = perf_counter() - self.start
+        try:
+            self.progress(report)
+        except Exception as e:
+            logger.warning(f"Failed to report progress: {e}")
+
+    def record_error(self, error: str, sources: Optional[Set[str]] = None) -> None:
+        logger.error(error)
+        with self.lock:
+            self.report.errors.append(error)
+            if sources is not None:
+                self.failed_sources.update(sources)
+
+
+class IngestionPipeline(BaseModel):
+    """Loads a knowledge base by running the parse, embed and insert stages concurrently.
+
+    - Sources are parsed in a process pool.
+    - Parsed documents are batched onto a bounded queue and embedded by a pool of threads.
+      Embeddings which already exist in the collections of a CombinedKnowledgeBase's sources are copied.
+    - Embedded documents are written to the vector db with binary COPY by a single thread.
+      New collections are indexed once all documents are loaded.
+
+    When a manifest is provided, sources whose content is unchanged since the last load are skipped,
+    documents from changed sources are replaced and documents from deleted sources are pruned.
+    """
+
+    parse_workers: int = llm_settings.ingest_parse_workers
+    embed_workers: int = llm_settings.ingest_embed_workers
+    embed_batch_size: int = llm_settings.ingest_embed_batch_size
+    insert_batch_size: int = llm_settings.ingest_insert_batch_size
+    queue_size: int = llm_settings.ingest_queue_size
+    # Manifest of the sources loaded into each collection
+    manifest: Optional[IngestionManifest] = None
+
+    # Report from the most recent run
+    last_report: Optional[IngestionReport] = None
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    def run(
+        self,
+        knowledge_base: KnowledgeBase,
+        recreate: bool = False,
+        progress: Optional[Callable[[IngestionReport], None]] = None,
+        cancel: Optional[Event] = None,
+    ) -> IngestionReport:
+        """Load the knowledge base to its vector db and return an IngestionReport.
+
+        progress is called with a copy of the report as sources are read and documents are inserted.
+        When cancel is set the load stops without indexing or updating the manifest, and raises IngestionCancelled.
+        """
+
+        self.last_report = None
+        vector_db = knowledge_base.vector_db
+        sources = get_sources(knowledge_base)
+        if not isinstance(vector_db, PgVectorDb) or sources is None:
+            raise ValueError(
+                f"{knowledge_base.__class__.__name__} is not supported by the ingestion pipeline"
+            )
+
+        start = perf_counter()
+        state = IngestionState(
+            vector_db=vector_db,
+            recreate=recreate,
+            bulk_load=recreate or not vector_db.exists(),
+            progress=progress,
+            cancel=cancel,
+            shared_collections=[
+                c
+                for c in get_source_collections(knowledge_base)
+                if c.collection != vector_db.collection and vector_db.has_same_embedder(c) and c.exists()
+            ],
+        )
+        report = state.report
+        if recreate:
+            logger.debug("Deleting collection")
+            vector_db.delete()
+            if self.manifest is not None:
+                self.manifest.delete(collection=vector_db.collection)
+
+        logger.debug("Creating collection")
+        vector_db.create(create_indexes=not state.bulk_load)
+
+        previous_entries: Dict[str, ManifestEntry] = {}
+        if self.manifest is not None and not recreate:
+            previous_entries = self.manifest.get_entries(collection=vector_db.collection)
+
+        # Websites need to be crawled before their documents can be checked
+        # so skip websites which already exist in the vector db
+        if not recreate:
+            sources = [
+                s
+                for s in sources
+                if not (
+                    s.source_type == "WEBSITE"
+                    and (s.uri in previous_entries or vector_db.name_exists(name=s.uri))
+                )
+            ]
+        report.sources = len(sources)
+        logger.info(f"Loading knowledge base from {len(sources)} sources")
+
+        embed_queue: Queue = Queue(maxsize=self.queue_size)
+        insert_queue: Queue = Queue(maxsize=self.queue_size)
+        embed_threads = [
+            Thread(target=self._embed_worker, args=(state, embed_queue, insert_queue), daemon=True)
+            for _ in range(max(self.embed_workers, 1))
+        ]
+        insert_thread = Thread(target=self._insert_worker, args=(state, insert_queue), daemon=True)
+        for thread in embed_threads:
+            thread.start()
+        insert_thread.start()
+
+        parsed = self._parse(sources, previous_entries, state)
+        try:
+            for source, result in parsed:
+                if state.cancelled():
+                    break
+                report.parsed += 1
+                state.report_progress()
+                if result.documents is None:
+                    logger.debug(f"Skipping unchanged source: {source.uri}")
+                    report.unchanged += 1
+                    continue
+                documents = self._filter(source, result, state)
+                for i in range(0, len(documents), self.embed_batch_size):
+                    embed_queue.put((source.uri, documents[i : i + self.embed_batch_size]))
+        finally:
+            parsed.close()
+            # Signal each stage to finish once the previous stage is done
+            for _ in embed_threads:
+                embed_queue.put(None)
+            for thread in embed_threads:
+                thread.join()
+            insert_queue.put(None)
+            insert_thread.join()
+        if state.cancelled():
+            logger.warning(f"Cancelled the load of {vector_db.collection}: {report.summary()}")
+            self.last_report = report
+            raise IngestionCancelled(f"Load of {vector_db.collection} was cancelled")
+
+        # The documents are loaded, so the manifest is updated even if the indexes can not be built
+        if self.manifest is not None:
+            self._update_manifest(self.manifest, sources, previous_entries, state)
+
+        try:
+            if state.bulk_load:
+                logger.debug("Creating indexes")
+                vector_db.create_all_indexes()
+            elif knowledge_base.optimize_on is not None and report.inserted > knowledge_base.optimize_on:
+                logger.debug("Optimizing Vector DB")
+                vector_db.optimize()
+        except Exception as e:
+            # Searches still work without the indexes, the db migrations create them
+            logger.error(f"Failed to index {vector_db.collection}: {e}")
+
+        report.elapsed = perf_counter() - start
+        logger.info(report.summary())
+        self.last_report = report
+        return report
+
+    def _parse(
+        self, sources: List[Source], previous_entries: Dict[str, ManifestEntry], state: IngestionState
+    ) -> Generator[Tuple[Source, SourceResult], None, None]:
+        """Read sources and yield results as they complete"""
+
+        def known_hash(source: Source) -> Optional[str]:
+            entry = previous_entries.get(source.uri)
+            return entry.content_hash if entry is not None else None
+
+        if self.parse_workers <= 1 or len(sources) <= 1:
+            for source in sources:
+                try:
+                    yield source, read_source(source, known_hash(source))
+                except Exception as e:
+                    state.report.parsed += 1
+                    state.record_error(f"Failed to read {source.uri}: {e}")
+            return
+
+        # Keep a bounded number of sources in flight so parsed documents
+        # do not pile up in memory while the embed stage catches up
+        source_iter = iter(sources)
+        with ProcessPoolExecutor(max_workers=self.parse_workers) as executor:
+            pending: Dict[Future, Source] = {}
+            for source in source_iter:
+                pending[executor.submit(read_source, source, known_hash(source))] = source
+                if len(pending) >= self.parse_workers * 2:
+                    break
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    source = pending.pop(future)
+                    try:
+                        yield source, future.result()
+                    except Exception as e:
+                        state.report.parsed += 1
+                        state.record_error(f"Failed to read {source.uri}: {e}")
+                    next_source = next(source_iter, None)
+                    if next_source is not None:
+                        pending[
+                            executor.submit(read_source, next_source, known_hash(next_source))
+                        ] = next_source
+
+    def _filter(self, source: Source, result: SourceResult, state: IngestionState) -> List[Document]:
+        """Drop empty documents, duplicates and documents which already exist in the vector db"""
+
+        document_list = result.documents or []
+        pages = set()
+        documents: Dict[str, Document] = {}
+        for document in document_list:
+            pages.add((document.name, document.meta_data.get("page") or document.meta_data.get("url")))
+            content_hash = get_content_hash(document.content)
+            if document.content.strip() == "" or content_hash in documents:
+                continue
+            documents[content_hash] = document
+
+        state.entries[source.uri] = ManifestEntry(
+            source=source.uri,
+            source_type=source.source_type,
+            content_hash=result.content_hash,
+            chunk_hashes=list(documents.keys()),
+        )
+
+        # Drop documents queued by another source in this run
+        for content_hash in state.seen_hashes.intersection(documents.keys()):
+            documents.pop(content_hash)
+        state.seen_hashes.update(documents.keys())
+
+        if not state.recreate:
+            for content_hash in state.vector_db.get_existing_content_hashes(list(documents.keys())):
+                documents.pop(content_hash, None)
+
+        with state.lock:
+            state.report.pages += len(pages)
+            state.report.chunks += len(document_list)
+            state.report.skipped += len(document_list) - len(documents)
+        return list(documents.values())
+
+    def _embed_worker(self, state: IngestionState, embed_queue: Queue, insert_queue: Queue) -> None:
+        while True:
+            batch: Optional[Batch] = embed_queue.get()
+            if batch is None:
+                break
+            if state.cancelled():
+                continue
+            uri, documents = batch
+            try:
+                num_reused = self._reuse_embeddings(state, documents)
+                documents_to_embed = [document for document in documents if document.embedding is None]
+                num_tokens = embed_documents(embedder=state.vector_db.embedder, documents=documents_to_embed)
+            except Exception as e:
+                state.record_error(f"Failed to embed {len(documents)} documents from {uri}: {e}", {uri})
+                continue
+            with state.lock:
+                state.report.embeddings += len(documents_to_embed)
+                state.report.reused_embeddings += num_reused
+                state.report.embedding_tokens += num_tokens
+            insert_queue.put(batch)
+
+    def _reuse_embeddings(self, state: IngestionState, documents: List[Document]) -> int:
+        """Copy embeddings for documents which already exist in a shared collection"""
+
+        num_reused = 0
+        for collection in state.shared_collections:
+            missing = {get_content_hash(d.content): d for d in documents if d.embedding is None}
+            if len(missing) == 0:
+                break
+            for content_hash, embedding in collection.get_embeddings(list(missing.keys())).items():
+                missing[content_hash].embedding = embedding
+                num_reused += 1
+        return num_reused
+
+    def _insert_worker(self, state: IngestionState, insert_queue: Queue) -> None:
+        buffer: List[Document] = []
+        buffer_sources: Set[str] = set()
+        while True:
+            batch: Optional[Batch] = insert_queue.get()
+            if batch is not None:
+                buffer_sources.add(batch[0])
+                buffer.extend(batch[1])
+            if state.cancelled():
+                buffer = []
+            if len(buffer) > 0 and (batch is None or len(buffer) >= self.insert_batch_size):
+                try:
+                    num_inserted = state.vector_db.copy_embedded(documents=buffer, upsert=not state.bulk_load)
+                    with state.lock:
+                        state.report.inserted += num_inserted
+                except Exception as e:
+                    state.record_error(f"Failed to insert {len(buffer)} documents: {e}", buffer_sources)
+                state.report_progress()
+                buffer = []
+                buffer_sources = set()
+            if batch is None:
+                break
+
+    def _update_manifest(
+        self,
+        manifest: IngestionManifest,
+        sources: List[Source],
+        previous_entries: Dict[str, ManifestEntry],
+        state: IngestionState,
+    ) -> None:
+        """Save entries for loaded sources and delete documents which no longer belong to any source"""
+
+        # Websites can be added at runtime using the app or WebsiteTools
+        # so they are missing from the configured urls after a restart and are never pruned
+        source_uris = {source.uri for source in sources}
+        removed_entries = [
+            entry
+            for uri, entry in previous_entries.items()
+            if uri not in source_uris and entry.source_type != "WEBSITE"
+        ]
+        updated_entries = [entry for uri, entry in state.entries.items() if uri not in state.failed_sources]
+        replaced_entries = [
+            previous_entries[entry.source] for entry in updated_entries if entry.source in previous_entries
+        ]
+
+        # Documents are only deleted when no remaining source in the collection references them
+        current_entries = {**previous_entries, **{entry.source: entry for entry in updated_entries}}
+        for entry in removed_entries:
+            current_entries.pop(entry.source, None)
+        referenced_hashes: Set[str] = set()
+        for entry in current_entries.values():
+            referenced_hashes.update(entry.chunk_hashes)
+        stale_hashes: Set[str] = set()
+        for entry in removed_entries + replaced_entries:
+            stale_hashes.update(h for h in entry.chunk_hashes if h not in referenced_hashes)
+
+        collection = state.vector_db.collection
+        state.vector_db.delete_content_hashes(list(stale_hashes))
+        manifest.upsert(collection=collection, entries=updated_entries)
+        manifest.delete(collection=collection, sources=[entry.source for entry in removed_entries])
+        state.report.removed = len(removed_entries)
+        state.report.deleted = len(stale_hashes)
@@ -0,0 +1,147 @@
+from dataclasses import dataclass
+from hashlib import sha256
+from io import BytesIO
+from pathlib import Path
+from typing import List, Literal, Optional
+
+import httpx
+from phi.document import Document
+from phi.document.reader.base import Reader
+from phi.document.reader.pdf import PDFReader
+from phi.knowledge.base import KnowledgeBase
+from phi.knowledge.combined import CombinedKnowledgeBase
+from phi.knowledge.pdf import PDFKnowledgeBase, PDFUrlKnowledgeBase
+from phi.knowledge.website import WebsiteKnowledgeBase
+
+from llm.ingestion.chunker import TokenChunker
+from llm.vectordb import PgVectorDb
+
+SourceType = Literal["PDF_FILE", "PDF_URL", "WEBSITE"]
+
+
+@dataclass(frozen=True)
+class Source:
+    """A single input of a knowledge base: a local file or a url, with the reader used to read it"""
+
+    uri: str
+    source_type: SourceType
+    reader: Reader
+    # Chunks the documents read when the knowledge base has a TokenChunker
+    chunker: Optional[TokenChunker] = None
+
+
+@dataclass
+class SourceResult:
+    """Result of reading a source, documents is None when the source content is unchanged"""
+
+    content_hash: str
+    documents: Optional[List[Document]]
+
+
+def get_sources(knowledge_base: KnowledgeBase) -> Optional[List[Source]]:
+    """Returns the sources for a knowledge base or None if the knowledge base type is not supported"""
+
+    if isinstance(knowledge_base, CombinedKnowledgeBase):
+        sources: List[Source] = []
+        for kb in knowledge_base.sources:
+            kb_sources = get_sources(kb)
+            if kb_sources is None:
+                return None
+            sources.extend(kb_sources)
+        return sources
+
+    chunker: Optional[TokenChunker] = getattr(knowledge_base, "chunker", None)
+    if isinstance(knowledge_base, PDFKnowledgeBase):
+        pdf_path = Path(knowledge_base.path)
+        if pdf_path.exists() and pdf_path.is_dir():
+            return [
+                Source(uri=str(pdf), source_type="PDF_FILE", reader=knowledge_base.reader, chunker=chunker)
+                for pdf in sorted(pdf_path.glob("**/*.pdf"))
+            ]
+        elif pdf_path.exists() and pdf_path.is_file() and pdf_path.suffix == ".pdf":
+            return [
+                Source(
+                    uri=str(pdf_path), source_type="PDF_FILE", reader=knowledge_base.reader, chunker=chunker
+                )
+            ]
+        return []
+
+    if isinstance(knowledge_base, PDFUrlKnowledgeBase):
+        return [
+            Source(uri=url, source_type="PDF_URL", reader=knowledge_base.reader, chunker=chunker)
+            for url in knowledge_base.urls
+        ]
+
+    if isinstance(knowledge_base, WebsiteKnowledgeBase):
+        if knowledge_base.reader is None:
+            return []
+        return [
+            Source(uri=url, source_type="WEBSITE", reader=knowledge_base.reader, chunker=chunker)
+            for url in knowledge_base.urls
+        ]
+
+    return None
+
+
+def get_source_collections(knowledge_base: KnowledgeBase) -> List[PgVectorDb]:
+    """Returns the collections of the knowledge bases a CombinedKnowledgeBase is built from.
+
+    Embeddings in these collections can be reused when loading the combined knowledge base.
+    """
+
+    collections: List[PgVectorDb] = []
+    if isinstance(knowledge_base, CombinedKnowledgeBase):
+        for kb in knowledge_base.sources:
+            if isinstance(kb.vector_db, PgVectorDb):
+                collections.append(kb.vector_db)
+            collections.extend(get_source_collections(kb))
+    return collections
+
+
+def read_source(source: Source, known_hash: Optional[str] = None) -> SourceResult:
+    """Read a source into a list of documents, skipping the parse if its content matches known_hash.
+
+    This is a module level function so it can be sent to a process pool.
+    """
+
+    if source.source_type == "WEBSITE":
+        documents = source.reader.read(url=source.uri)  # type: ignore
+        content_hash = get_source_hash("".join(document.content for document in documents).encode(), source)
+        return SourceResult(content_hash=content_hash, documents=chunk_documents(documents, source))
+
+    if source.source_type == "PDF_FILE":
+        content = Path(source.uri).read_bytes()
+        pdf_name = Path(source.uri).name
+    else:
+        # Error pages would be parsed and their hash stored, so later loads would skip the source
+        response = httpx.get(source.uri, follow_redirects=True)
+        response.raise_for_status()
+        content = response.content
+        pdf_name = source.uri.split("/")[-1].replace(" ", "_")
+
+    content_hash = get_source_hash(content, source)
+    if content_hash == known_hash:
+        return SourceResult(content_hash=content_hash, documents=None)
+
+    # PDFReader names documents using the name of the file object
+    pdf = BytesIO(content)
+    pdf.name = pdf_name  # type: ignore
+    reader = (
+        source.reader if isinstance(source.reader, PDFReader) else PDFReader(**source.reader.model_dump())
+    )
+    return SourceResult(content_hash=content_hash, documents=chunk_documents(reader.read(pdf=pdf), source))
+
+
+def get_source_hash(content: bytes, source: Source) -> str:
+    """Hash of the source content and the chunker, so sources are loaded again when the chunking changes"""
+
+    content_hash = sha256(content)
+    if source.chunker is not None:
+        content_hash.update(source.chunker.fingerprint().encode())
+    return content_hash.hexdigest()
+
+
+def chunk_documents(documents: List[Document], source: Source) -> List[Document]:
+    if source.chunker is None:
+        return documents
+    return source.chunker.chunk_documents(documents)
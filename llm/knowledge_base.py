@@ -1,55 +1,172 @@
-from phi.knowledge.combined import CombinedKnowledgeBase
-from phi.knowledge.pdf import PDFUrlKnowledgeBase, PDFKnowledgeBase
-from phi.knowledge.website import WebsiteKnowledgeBase
-from phi.vectordb.pgvector import PgVector
+from typing import Dict
+
+from phi.knowledge.base import KnowledgeBase
 
 from db.session import db_url
+from llm.answer_cache import AnswerCache
+from llm.embedder import BatchedOpenAIEmbedder, CachedEmbedder
+from llm.embedding_cache import EmbeddingCache
+from llm.ingestion.chunker import TokenChunker
+from llm.ingestion.knowledge_base import (
+    PipelinedCombinedKnowledgeBase,
+    PipelinedPDFKnowledgeBase,
+    PipelinedPDFUrlKnowledgeBase,
+    PipelinedWebsiteKnowledgeBase,
+)
+from llm.ingestion.jobs import IngestionJobs
+from llm.ingestion.manifest import IngestionManifest
+from llm.ingestion.pipeline import IngestionPipeline
+from llm.replica import VectorReplica
+from llm.settings import llm_settings
+from llm.vectordb import PgVectorDb, get_default_index
+from utils.lru import LRUCache
 
-url_pdf_knowledge_base = PDFUrlKnowledgeBase(
+# Embeddings are cached in llm.embedding_cache and shared by all collections
+# so identical chunks are only embedded once
+embedder = CachedEmbedder(
+    embedder=BatchedOpenAIEmbedder(model=llm_settings.embedding_model),
+    cache=EmbeddingCache(
+        table_name="embedding_cache",
+        db_url=db_url,
+        schema="llm",
+        max_entries=llm_settings.embedding_cache_max_entries,
+    ),
+    # Search queries are embedded on every RAG turn and are often repeated
+    query_cache=LRUCache(
+        max_size=llm_settings.query_embedding_cache_size,
+        ttl=llm_settings.query_embedding_cache_ttl,
+    ),
+)
+
+# Answers to repeated questions, stored in llm.answer_cache
+answer_cache = AnswerCache(
+    table_name="answer_cache",
+    db_url=db_url,
+    schema="llm",
+    similarity_threshold=llm_settings.answer_cache_similarity,
+    ttl=llm_settings.answer_cache_ttl,
+)
+
+# Tracks the sources loaded into each collection in llm.ingestion_manifest
+# so load(recreate=False) only processes new and changed sources
+ingestion_manifest = IngestionManifest(
+    table_name="ingestion_manifest",
+    db_url=db_url,
+    schema="llm",
+)
+
+# Split recipes into chunks of at most 500 tokens, starting at headings.
+# Every PDF loaded into pdf_documents, including uploads, uses this chunker so the collection has consistent chunks
+pdf_chunker = TokenChunker(chunk_size=500, chunk_overlap=50)
+
+url_pdf_knowledge_base = PipelinedPDFUrlKnowledgeBase(
     urls=["https://www.family-action.org.uk/content/uploads/2019/07/meals-more-recipes.pdf"],
     # Store this knowledge base in llm.url_pdf_documents
-    vector_db=PgVector(
+    vector_db=PgVectorDb(
         collection="url_pdf_documents",
         db_url=db_url,
         schema="llm",
+        embedder=embedder,
+        index=get_default_index(),
     ),
     num_documents=2,
+    chunker=pdf_chunker,
+    # Parse, embed and insert documents concurrently when loading
+    pipeline=IngestionPipeline(manifest=ingestion_manifest),
 )
 
-local_pdf_knowledge_base = PDFKnowledgeBase(
+local_pdf_knowledge_base = PipelinedPDFKnowledgeBase(
     path="data/pdfs",
     # Store this knowledge base in llm.local_pdf_documents
-    vector_db=PgVector(
+    vector_db=PgVectorDb(
         collection="local_pdf_documents",
         db_url=db_url,
         schema="llm",
+        embedder=embedder,
+        index=get_default_index(),
     ),
     num_documents=3,
+    chunker=pdf_chunker,
+    pipeline=IngestionPipeline(manifest=ingestion_manifest),
 )
 
-pdf_knowledge_base = CombinedKnowledgeBase(
+pdf_knowledge_base = PipelinedCombinedKnowledgeBase(
     sources=[
         url_pdf_knowledge_base,
         local_pdf_knowledge_base,
     ],
     # Store this knowledge base in llm.pdf_documents
-    vector_db=PgVector(
+    vector_db=PgVectorDb(
         collection="pdf_documents",
         db_url=db_url,
         schema="llm",
+        embedder=embedder,
+        index=get_default_index(),
     ),
-    num_documents=2,  # 2 references are added to the prompt.
+    # Conversations search for 2 x context_candidate_multiplier references and add those which fit their token budget
+    num_documents=2,
+    # Fuse vector and full text search so exact identifiers are found
+    search_type="hybrid",
+    # Sources are chunked by their own knowledge bases, documents uploaded to this knowledge base use the same chunker
+    chunker=pdf_chunker,
+    answer_cache=answer_cache,
+    pipeline=IngestionPipeline(manifest=ingestion_manifest),
 )
 
-website_knowledge_base = WebsiteKnowledgeBase(
+website_knowledge_base = PipelinedWebsiteKnowledgeBase(
     urls=["https://docs.phidata.com/introduction"],
     # Number of links to follow from the seed URLs
     max_links=15,
     # Store this knowledge base in llm.website_documents
-    vector_db=PgVector(
+    vector_db=PgVectorDb(
         collection="website_documents",
         db_url=db_url,
         schema="llm",
+        embedder=embedder,
+        index=get_default_index(),
     ),
     num_documents=3,
+    # Documentation pages are split at their headings into chunks of at most 400 tokens
+    # so 3 references fit comfortably in the prompt
+    chunker=TokenChunker(chunk_size=400, chunk_overlap=40),
+    search_type="hybrid",
+    answer_cache=answer_cache,
+    pipeline=IngestionPipeline(manifest=ingestion_manifest),
+)
+
+# Knowledge bases by vector db collection, loaded by the ingestion worker
+knowledge_bases: Dict[str, KnowledgeBase] = {
+    knowledge_base.vector_db.collection: knowledge_base
+    for knowledge_base in (
+        url_pdf_knowledge_base,
+        local_pdf_knowledge_base,
+        pdf_knowledge_base,
+        website_knowledge_base,
+    )
+    if isinstance(knowledge_base.vector_db, PgVectorDb)
+}
+
+# Vector db collections by name, used to manage their indexes
+vector_dbs: Dict[str, PgVectorDb] = {
+    collection: knowledge_base.vector_db
+    for collection, knowledge_base in knowledge_bases.items()
+    if isinstance(knowledge_base.vector_db, PgVectorDb)
+}
+
+# Search the collections used by conversations in memory mapped replicas
+if llm_settings.vector_replica_enabled:
+    for _knowledge_base in (pdf_knowledge_base, website_knowledge_base):
+        if isinstance(_knowledge_base.vector_db, PgVectorDb):
+            _knowledge_base.vector_db.replica = VectorReplica(
+                vector_db=_knowledge_base.vector_db,
+                path=llm_settings.vector_replica_dir,
+                dtype=llm_settings.vector_replica_dtype,
+                refresh_interval=llm_settings.vector_replica_refresh_interval,
+            )
+
+# Knowledge base loads run in the background, stored in llm.ingestion_jobs
+ingestion_jobs = IngestionJobs(
+    table_name="ingestion_jobs",
+    db_url=db_url,
+    schema="llm",
 )
@@ -0,0 +1,470 @@
+import fcntl
+import json
+import os
+import shutil
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from threading import Lock
+from time import monotonic, time
+from typing import TYPE_CHECKING, Any, Dict, Iterator, List, Literal, Optional, Tuple
+
+import numpy as np
+from phi.vectordb.distance import Distance
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.schema import Column, Index, MetaData, Table
+from sqlalchemy.sql.expression import func, select, text
+from sqlalchemy.types import BigInteger, DateTime, String
+
+from utils.log import logger
+
+if TYPE_CHECKING:
+    from llm.vectordb import PgVectorDb
+
+# Files in each replica generation
+VECTORS_FILE = "vectors.bin"
+HASHES_FILE = "hashes.bin"
+ALIVE_FILE = "alive.bin"
+OFFSETS_FILE = "offsets.bin"
+DOCUMENTS_FILE = "documents.jsonl"
+
+# md5 hex digest used as the content_hash
+HASH_DTYPE = np.dtype("S32")
+
+
+class VectorChangeLog:
+    def __init__(self, db_engine: Engine, table_name: str = "vector_changes", schema: Optional[str] = "llm"):
+        """
+        Sequence of inserts and deletes on vector db collections, recorded by triggers on the collection tables.
+
+        :param db_engine: The database engine to use.
+        :param table_name: The name of the table to store changes in.
+        :param schema: The schema to store the table in.
+        """
+        self.table_name: str = table_name
+        self.schema: Optional[str] = schema
+        self.db_engine: Engine = db_engine
+        self.metadata: MetaData = MetaData(schema=self.schema)
+        self.Session: sessionmaker[Session] = sessionmaker(bind=self.db_engine)
+        self.table: Table = self.get_table()
+        self.table_created: bool = False
+
+    def get_table(self) -> Table:
+        return Table(
+            self.table_name,
+            self.metadata,
+            Column("seq", BigInteger, primary_key=True, autoincrement=True),
+            Column("collection", String, nullable=False),
+            Column("content_hash", String),
+            # I for inserts, D for deletes, updates are recorded as a delete and an insert
+            Column("op", String(1), nullable=False),
+            Column("created_at", DateTime(timezone=True), server_default=text("now()")),
+            Index(f"{self.table_name}_collection_seq_idx", "collection", "seq"),
+            extend_existing=True,
+        )
+
+    @property
+    def function_name(self) -> str:
+        return f"{self.schema}.record_{self.table_name}" if self.schema else f"record_{self.table_name}"
+
+    def create(self) -> None:
+        if self.table_created:
+            return
+        self.table.create(self.db_engine, checkfirst=True)
+        with self.Session() as sess, sess.begin():
+            sess.execute(
+                text(
+                    f"""
+                    CREATE OR REPLACE FUNCTION {self.function_name}() RETURNS trigger AS $$
+                    BEGIN
+                        IF TG_OP IN ('DELETE', 'UPDATE') THEN
+                            INSERT INTO {self.table.fullname} (collection, content_hash, op)
+                            VALUES (TG_TABLE_NAME, OLD.content_hash, 'D');
+                        END IF;
+                        IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                            INSERT INTO {self.table.fullname} (collection, content_hash, op)
+                            VALUES (TG_TABLE_NAME, NEW.content_hash, 'I');
+                        END IF;
+                        RETURN NULL;
+                    END;
+                    $$ LANGUAGE plpgsql;
+                    """
+                )
+            )
+        self.table_created = True
+
+    def install(self, table: Table) -> None:
+        """Record changes to the table, tables are recreated when a knowledge base is recreated"""
+
+        self.create()
+        trigger_name = f"{table.name}_{self.table_name}_trigger"
+        with self.Session() as sess, sess.begin():
+            exists = sess.execute(
+                text("SELECT 1 FROM pg_trigger WHERE tgname = :name AND tgrelid = to_regclass(:table_name)"),
+                {"name": trigger_name, "table_name": table.fullname},
+            ).first()
+            if exists is None:
+                logger.debug(f"Creating trigger: {trigger_name}")
+                sess.execute(
+                    text(
+                        f"CREATE TRIGGER {trigger_name} AFTER INSERT OR UPDATE OR DELETE ON {table.fullname} "
+                        f"FOR EACH ROW EXECUTE FUNCTION {self.function_name}()"
+                    )
+                )
+
+    def get_last_seq(self, sess: Session) -> int:
+        return sess.execute(select(func.coalesce(func.max(self.table.c.seq), 0))).scalar_one()
+
+    def get_changes(self, sess: Session, collection: str, after_seq: int) -> List[Tuple[int, str, str]]:
+        stmt = (
+            select(self.table.c.seq, self.table.c.content_hash, self.table.c.op)
+            .where(self.table.c.collection == collection, self.table.c.seq > after_seq)
+            .order_by(self.table.c.seq)
+        )
+        return [(row.seq, row.content_hash, row.op) for row in sess.execute(stmt)]
+
+    def prune(self, retention_seconds: int) -> None:
+        with self.Session() as sess, sess.begin():
+            sess.execute(
+                self.table.delete().where(
+                    self.table.c.created_at
+                    < func.now() - text(f"interval '{int(retention_seconds)} seconds'")
+                )
+            )
+
+
+@dataclass
+class ReplicaState:
+    generation: int
+    count: int
+    dead: int
+    # Bytes of the documents file written for the count rows
+    documents_size: int
+    dim: int
+    dtype: str
+    # Last change log sequence applied to the replica
+    last_seq: int
+    # oid of the collection table, which changes when the collection is recreated
+    table_oid: int
+    synced_at: float
+
+
+@dataclass
+class ReplicaMapping:
+    state: ReplicaState
+    # Identifies the state file, which is replaced on every refresh
+    state_key: Tuple[int, int]
+    vectors: np.ndarray
+    hashes: np.ndarray
+    alive: np.ndarray
+    offsets: np.ndarray
+    documents: Any
+
+
+class VectorReplica:
+    def __init__(
+        self,
+        vector_db: "PgVectorDb",
+        path: str,
+        dtype: Literal["float32", "float16"] = "float32",
+        refresh_interval: float = 5,
+        change_retention: int = 24 * 60 * 60,
+        compact_ratio: float = 0.25,
+    ):
+        """
+        Read replica of a collection's vectors stored in memory mapped files.
+
+        Searches run as a NumPy top-k over the mapped matrix. The replica applies inserts and deletes
+        from the VectorChangeLog at most every refresh_interval seconds. Processes on the same host
+        share the files and their pages, one process refreshes at a time. Postgres remains
+        the source of truth, the replica is rebuilt when it can not be refreshed incrementally.
+
+        :param vector_db: The collection to replicate.
+        :param path: Directory to store the replica files in.
+        :param dtype: float16 halves the memory used by the vectors at a small cost in precision.
+        :param refresh_interval: Minimum number of seconds between refreshes.
+        :param change_retention: Number of seconds changes are kept in the change log.
+        :param compact_ratio: Rebuild the replica when this ratio of rows are deleted.
+        """
+        if vector_db.distance not in (Distance.cosine, Distance.max_inner_product):
+            raise ValueError(f"VectorReplica does not support distance: {vector_db.distance}")
+
+        self.vector_db: "PgVectorDb" = vector_db
+        self.path: Path = Path(path).joinpath(vector_db.collection)
+        self.dtype: str = dtype
+        self.refresh_interval: float = refresh_interval
+        self.change_retention: int = change_retention
+        self.compact_ratio: float = compact_ratio
+        self.change_log: VectorChangeLog = VectorChangeLog(
+            db_engine=vector_db.db_engine, schema=vector_db.schema
+        )
+
+        self.mapping: Optional[ReplicaMapping] = None
+        self.last_refresh: float = 0
+        self.last_prune: float = 0
+        self.lock: Lock = Lock()
+
+    @property
+    def state_path(self) -> Path:
+        return self.path.joinpath("state.json")
+
+    def search(self, query_embedding: List[float], limit: int) -> List[Dict[str, Any]]:
+        """Returns the rows closest to the query embedding, refreshing the replica if it is due"""
+
+        if monotonic() - self.last_refresh > self.refresh_interval:
+            self.refresh()
+        mapping = self.get_mapping()
+        if mapping is None or mapping.state.count == 0:
+            return []
+
+        query = np.asarray(query_embedding, dtype=np.float32)
+        if self.vector_db.distance == Distance.cosine:
+            query = query / (np.linalg.norm(query) or 1)
+        scores = mapping.vectors @ query.astype(mapping.vectors.dtype)
+        scores = np.where(mapping.alive != 0, scores.astype(np.float32), -np.inf)
+
+        limit = min(limit, int(np.count_nonzero(mapping.alive)))
+        if limit <= 0:
+            return []
+        top = np.argpartition(-scores, limit - 1)[:limit]
+        top = top[np.argsort(-scores[top])]
+
+        rows = []
+        for i in top:
+            start = int(mapping.offsets[i])
+            end = int(mapping.offsets[i + 1]) if i + 1 < mapping.state.count else mapping.state.documents_size
+            row = json.loads(bytes(mapping.documents[start:end]))
+            row["embedding"] = mapping.vectors[i].astype(np.float32).tolist()
+            rows.append(row)
+        return rows
+
+    def refresh(self) -> None:
+        """Apply changes from the change log, or rebuild the replica if it can not be refreshed incrementally"""
+
+        self.last_refresh = monotonic()
+        if not self.vector_db.table_exists():
+            return
+
+        self.path.mkdir(parents=True, exist_ok=True)
+        with self.file_lock() as locked:
+            if not locked:
+                return
+            self.change_log.install(self.vector_db.table)
+            state = self.read_state()
+            with self.vector_db.Session() as sess, sess.begin():
+                table_oid = sess.execute(
+                    text("SELECT to_regclass(:table_name)::oid"),
+                    {"table_name": self.vector_db.table.fullname},
+                ).scalar_one()
+                if (
+                    state is None
+                    or state.table_oid != table_oid
+                    or state.dtype != self.dtype
+                    or time() - state.synced_at > self.change_retention
+                    or state.dead > state.count * self.compact_ratio
+                ):
+                    self.rebuild(sess, table_oid, state)
+                    return
+
+                changes = self.change_log.get_changes(sess, self.vector_db.collection, state.last_seq)
+                if len(changes) == 0:
+                    state.synced_at = time()
+                    self.write_state(state)
+                    return
+                self.apply_changes(sess, state, changes)
+
+            if monotonic() - self.last_prune > self.change_retention / 24:
+                self.last_prune = monotonic()
+                self.change_log.prune(self.change_retention)
+
+    def rebuild(self, sess: Session, table_oid: int, previous: Optional[ReplicaState]) -> None:
+        # Sequence read before the rows so changes made during the rebuild are applied on the next refresh
+        last_seq = self.change_log.get_last_seq(sess)
+        generation = previous.generation + 1 if previous is not None else 1
+        generation_path = self.path.joinpath(f"gen-{generation}")
+        shutil.rmtree(generation_path, ignore_errors=True)
+        generation_path.mkdir(parents=True)
+
+        state = ReplicaState(
+            generation=generation,
+            count=0,
+            dead=0,
+            documents_size=0,
+            dim=self.vector_db.dimensions,
+            dtype=self.dtype,
+            last_seq=last_seq,
+            table_oid=table_oid,
+            synced_at=time(),
+        )
+        stmt = select(*self.columns()).execution_options(yield_per=1000)
+        for partition in sess.execute(stmt).partitions():
+            self.append_rows(state, [row._mapping for row in partition])
+        self.write_state(state)
+        logger.info(f"Rebuilt vector replica for {self.vector_db.collection} with {state.count} rows")
+
+        # Processes which mapped the previous generation keep their mapping until they remap
+        if previous is not None:
+            shutil.rmtree(self.path.joinpath(f"gen-{previous.generation}"), ignore_errors=True)
+
+    def apply_changes(self, sess: Session, state: ReplicaState, changes: List[Tuple[int, str, str]]) -> None:
+        # Only the last change to each content hash matters
+        last_ops: Dict[str, str] = {}
+        for _, content_hash, op in changes:
+            last_ops[content_hash] = op
+
+        generation_path = self.path.joinpath(f"gen-{state.generation}")
+        if state.count > 0:
+            hashes = np.fromfile(generation_path.joinpath(HASHES_FILE), dtype=HASH_DTYPE, count=state.count)
+            alive = np.memmap(
+                generation_path.joinpath(ALIVE_FILE), dtype=np.uint8, mode="r+", shape=(state.count,)
+            )
+            changed = np.isin(hashes, np.array(list(last_ops.keys()), dtype=HASH_DTYPE)) & (alive != 0)
+            state.dead += int(np.count_nonzero(changed))
+            alive[changed] = 0
+            alive.flush()
+            del alive
+
+        inserted = [content_hash for content_hash, op in last_ops.items() if op == "I"]
+        if len(inserted) > 0:
+            stmt = select(*self.columns()).where(self.vector_db.table.c.content_hash.in_(inserted))
+            self.append_rows(state, [row._mapping for row in sess.execute(stmt)])
+
+        state.last_seq = changes[-1][0]
+        state.synced_at = time()
+        self.write_state(state)
+        logger.debug(f"Applied {len(changes)} changes to vector replica for {self.vector_db.collection}")
+
+    def append_rows(self, state: ReplicaState, rows: List[Any]) -> None:
+        if len(rows) == 0:
+            return
+
+        vectors = np.asarray([row["embedding"] for row in rows], dtype=np.float32)
+        if self.vector_db.distance == Distance.cosine:
+            norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+            vectors = vectors / np.where(norms == 0, 1, norms)
+
+        generation_path = self.path.joinpath(f"gen-{state.generation}")
+        documents_path = generation_path.joinpath(DOCUMENTS_FILE)
+        offset = documents_path.stat().st_size if documents_path.exists() else 0
+        offsets = []
+        with open(documents_path, "ab") as documents_file:
+            for row in rows:
+                offsets.append(offset)
+                line = json.dumps(
+                    {
+                        "name": row["name"],
+                        "meta_data": row["meta_data"],
+                        "content": row["content"],
+                        "usage": row["usage"],
+                        "content_hash": row["content_hash"],
+                    }
+                ).encode()
+                documents_file.write(line + b"\n")
+                offset += len(line) + 1
+
+        with open(generation_path.joinpath(VECTORS_FILE), "ab") as f:
+            f.write(vectors.astype(self.dtype).tobytes())
+        with open(generation_path.joinpath(HASHES_FILE), "ab") as f:
+            f.write(np.asarray([row["content_hash"] or "" for row in rows], dtype=HASH_DTYPE).tobytes())
+        with open(generation_path.joinpath(ALIVE_FILE), "ab") as f:
+            f.write(np.ones(len(rows), dtype=np.uint8).tobytes())
+        with open(generation_path.joinpath(OFFSETS_FILE), "ab") as f:
+            f.write(np.asarray(offsets, dtype=np.int64).tobytes())
+        state.count += len(rows)
+        state.documents_size = offset
+
+    def get_mapping(self) -> Optional[ReplicaMapping]:
+        """Returns the memory mapped replica, remapping it if another process refreshed it"""
+
+        try:
+            stat = self.state_path.stat()
+        except FileNotFoundError:
+            return None
+        state_key = (stat.st_ino, stat.st_mtime_ns)
+
+        with self.lock:
+            if self.mapping is not None and self.mapping.state_key == state_key:
+                return self.mapping
+
+            state = self.read_state()
+            if state is None:
+                return None
+            generation_path = self.path.joinpath(f"gen-{state.generation}")
+            if state.count == 0:
+                self.mapping = ReplicaMapping(
+                    state=state,
+                    state_key=state_key,
+                    vectors=np.zeros((0, state.dim), dtype=state.dtype),
+                    hashes=np.zeros(0, dtype=HASH_DTYPE),
+                    alive=np.zeros(0, dtype=np.uint8),
+                    offsets=np.zeros(0, dtype=np.int64),
+                    documents=b"",
+                )
+                return self.mapping
+
+            # Files can be longer than count while another process appends to them
+            self.mapping = ReplicaMapping(
+                state=state,
+                state_key=state_key,
+                vectors=np.memmap(
+                    generation_path.joinpath(VECTORS_FILE),
+                    dtype=state.dtype,
+                    mode="r",
+                    shape=(state.count, state.dim),
+                ),
+                hashes=np.memmap(
+                    generation_path.joinpath(HASHES_FILE), dtype=HASH_DTYPE, mode="r", shape=(state.count,)
+                ),
+                alive=np.memmap(
+                    generation_path.joinpath(ALIVE_FILE), dtype=np.uint8, mode="r", shape=(state.count,)
+                ),
+                offsets=np.memmap(
+                    generation_path.joinpath(OFFSETS_FILE), dtype=np.int64, mode="r", shape=(state.count,)
+                ),
+                documents=np.memmap(
+                    generation_path.joinpath(DOCUMENTS_FILE),
+                    dtype=np.uint8,
+                    mode="r",
+                    shape=(state.documents_size,),
+                ),
+            )
+            return self.mapping
+
+    def read_state(self) -> Optional[ReplicaState]:
+        try:
+            return ReplicaState(**json.loads(self.state_path.read_text()))
+        except (FileNotFoundError, ValueError, TypeError):
+            return None
+
+    def write_state(self, state: ReplicaState) -> None:
+        # Replace the file so readers never see a partially written state
+        tmp_path = self.state_path.with_suffix(".tmp")
+        tmp_path.write_text(json.dumps(asdict(state)))
+        os.replace(tmp_path, self.state_path)
+
+    def columns(self) -> List[Any]:
+        table = self.vector_db.table
+        return [
+            table.c.name,
+            table.c.meta_data,
+            table.c.content,
+            table.c.embedding,
+            table.c.usage,
+            table.c.content_hash,
+        ]
+
+    @contextmanager
+    def file_lock(self) -> Iterator[bool]:
+        """Only one process on the host refreshes the replica at a time, others keep using the current files"""
+
+        with open(self.path.joinpath("refresh.lock"), "w") as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
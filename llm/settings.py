@@ -1,3 +1,5 @@
+from typing import Dict, Literal, Optional
+
 from pydantic_settings import BaseSettings
 
 
@@ -17,6 +19,117 @@ class LLMSettings(BaseSettings):
     embedding_model: str = "text-embedding-ada-002"
     default_max_tokens: int = 1024
     default_temperature: float = 0
+    # Maximum number of tokens sent in a single embedding request
+    embedding_max_batch_tokens: int = 100_000
+    # Maximum number of embedding requests in flight per process
+    embedding_concurrency: int = 4
+    # Number of times an embedding request is retried after a rate limit or server error
+    embedding_max_retries: int = 6
+    # Maximum number of embeddings kept in the llm.embedding_cache table
+    embedding_cache_max_entries: int = 1_000_000
+    # Maximum number of search query embeddings kept in memory by each process
+    query_embedding_cache_size: int = 10_000
+    # Number of seconds a search query embedding is kept in memory
+    query_embedding_cache_ttl: float = 3600
+    # Answer repeated first questions of RAG conversations from the answer cache
+    answer_cache_enabled: bool = False
+    # Minimum cosine similarity between questions for an answer cache hit
+    answer_cache_similarity: float = 0.95
+    # Number of seconds a cached answer is returned for
+    answer_cache_ttl: int = 7 * 24 * 60 * 60
+    # Answer identical first questions of RAG conversations asked while one is answered with the same llm stream
+    coalesce_requests: bool = True
+    # Number of processes used to parse documents when loading a knowledge base
+    ingest_parse_workers: int = 2
+    # Number of threads sending embedding requests when loading a knowledge base
+    ingest_embed_workers: int = 2
+    # Number of documents handed to the embedder at once, which packs them into token limited requests
+    ingest_embed_batch_size: int = 256
+    # Number of documents written to the vector db per binary COPY
+    ingest_insert_batch_size: int = 2000
+    # Number of batches buffered between the parse, embed and insert stages
+    ingest_queue_size: int = 8
+    # Number of seconds between checks for queued ingestion jobs
+    ingest_job_poll_interval: float = 5
+    # Number of seconds between progress updates of a running ingestion job
+    ingest_job_heartbeat_interval: float = 5
+    # Running ingestion jobs without a progress update for this many seconds are claimed by another worker
+    ingest_job_stale_after: int = 120
+    # Number of times an ingestion job is started before it is failed
+    ingest_job_max_attempts: int = 3
+    # Default maximum number of tokens in a knowledge base chunk
+    chunk_size: int = 500
+    # Default number of tokens repeated between consecutive chunks
+    chunk_overlap: int = 50
+    # Sections with fewer tokens are merged into the next section
+    chunk_min_size: int = 100
+    # Maximum number of prompt tokens sent to each model by RAG conversations,
+    # including the system prompt, chat history and knowledge base references
+    context_token_budgets: Dict[str, int] = {"gpt-4-1106-preview": 6000, "gpt-3.5-turbo-1106": 3000}
+    # Prompt token budget of models without an entry in context_token_budgets
+    context_token_budget: int = 3000
+    # Fraction of the budget after the prompt reserved for the most recent chat messages
+    context_history_share: float = 0.25
+    # Candidate references searched for per reference in a knowledge base's num_documents
+    context_candidate_multiplier: int = 3
+    # Maximum number of connections to the llm api shared by async chat requests in a process
+    async_llm_max_connections: int = 1000
+    # Connections kept open and opened under load by async conversation storage
+    async_db_pool_size: int = 10
+    async_db_max_overflow: int = 20
+    # Number of threads searching knowledge bases while conversations are read from storage
+    retrieval_workers: int = 16
+    # Number of questions answered at once by batch runs
+    batch_concurrency: int = 8
+    # Admit llm requests within per user token buckets and per model concurrency limits of each process
+    admission_enabled: bool = True
+    # Size of each user's token bucket and tokens added per minute, requests reserve
+    # the prompt token budget of their model and their max_tokens
+    admission_user_tokens: int = 60000
+    admission_user_tokens_per_minute: int = 30000
+    # Maximum number of llm requests in flight per model, and for models without an entry.
+    # Limits apply to each Api and Streamlit process, the cap of a deployment is
+    # the limit times its number of processes, so size them per process.
+    llm_max_concurrency: Dict[str, int] = {}
+    llm_default_max_concurrency: int = 32
+    # Requests waiting for a model, further requests are rejected
+    admission_queue_size: int = 64
+    # Maximum number of seconds a request waits for a model
+    admission_queue_timeout: float = 30
+    # Approximate nearest neighbour index used by the vector db collections
+    vector_index_type: Literal["hnsw", "ivfflat"] = "hnsw"
+    hnsw_m: int = 16
+    hnsw_ef_construction: int = 64
+    # Candidates considered by hnsw searches, higher values trade latency for recall
+    hnsw_ef_search: int = 40
+    ivfflat_lists: int = 100
+    # Lists scanned by ivfflat searches, higher values trade latency for recall
+    ivfflat_probes: int = 10
+    # Memory and parallel workers used to build vector indexes, parallel hnsw builds require pgvector 0.6
+    index_maintenance_work_mem: str = "1GB"
+    index_parallel_workers: int = 4
+    # Index a halfvec or binary quantized copy of the embeddings, requires pgvector 0.7.
+    # Collections with a vector index are searched with the quantization of their index.
+    vector_quantization: Optional[Literal["halfvec", "binary"]] = None
+    # Re-score quantized search candidates with the full precision embeddings
+    vector_rescore: bool = True
+    # Number of quantized search candidates re-scored per result
+    vector_rescore_multiplier: int = 4
+    # Search vectors in a memory mapped replica of each searched collection instead of postgres
+    vector_replica_enabled: bool = False
+    # Directory for the replica files, processes on a host using the same directory share them
+    vector_replica_dir: str = "/tmp/llm-vector-replicas"
+    vector_replica_dtype: Literal["float32", "float16"] = "float32"
+    # Minimum number of seconds between refreshes of a replica from postgres
+    vector_replica_refresh_interval: float = 5
+    # Maximum number of requests in flight when crawling websites
+    crawl_concurrency: int = 16
+    # Maximum number of requests in flight to a single host when crawling websites
+    crawl_per_host_concurrency: int = 8
+    # Minimum number of seconds between requests to the same host when crawling websites
+    crawl_host_delay: float = 0.05
+    # Timeout in seconds for each request when crawling websites
+    crawl_timeout: float = 10
 
 
 # Create LLMSettings object
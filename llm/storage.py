@@ -1,21 +1,25 @@
-from phi.storage.conversation.postgres import PgConversationStorage
-
 from db.session import db_url
+from llm.async_storage import AsyncConversationStorage
+from llm.conversation_storage import PagedConversationStorage
 
-pdf_conversation_storage = PgConversationStorage(
+pdf_conversation_storage = PagedConversationStorage(
     table_name="pdf_conversations",
     db_url=db_url,
     schema="llm",
 )
 
-vision_conversation_storage = PgConversationStorage(
+vision_conversation_storage = PagedConversationStorage(
     table_name="vision_conversations",
     db_url=db_url,
     schema="llm",
 )
 
-website_conversation_storage = PgConversationStorage(
+website_conversation_storage = PagedConversationStorage(
     table_name="website_conversations",
     db_url=db_url,
     schema="llm",
 )
+
+# Used by the async chat endpoints to read and write conversations without blocking the event loop
+pdf_conversation_async_storage = AsyncConversationStorage(storage=pdf_conversation_storage)
+website_conversation_async_storage = AsyncConversationStorage(storage=website_conversation_storage)
@@ -0,0 +1,61 @@
+import asyncio
+from time import perf_counter
+from typing import List, Optional
+
+import httpx
+import numpy as np
+
+# Opens CONCURRENCY concurrent chat streams against the Api and reports time to first token and stream durations.
+# Start mock_llm_server.py, then the Api with a single worker pointed at it:
+#   OPENAI_BASE_URL=http://localhost:8090/v1 OPENAI_API_KEY=mock uvicorn api.main:app --port 8000
+API_URL = "http://localhost:8000/v1/pdf/conversation"
+CONCURRENCY = 500
+MESSAGE = "How do I make chicken curry?"
+
+
+async def create_conversation(client: httpx.AsyncClient, user_name: str) -> str:
+    response = await client.post(f"{API_URL}/create", json={"user_name": user_name})
+    response.raise_for_status()
+    return response.json()["conversation_id"]
+
+
+async def chat(client: httpx.AsyncClient, conversation_id: str) -> Optional[List[float]]:
+    """Returns the time to first token and total time of a streamed response, or None if it failed"""
+
+    start = perf_counter()
+    first_token: Optional[float] = None
+    try:
+        async with client.stream(
+            "POST", f"{API_URL}/chat", json={"message": MESSAGE, "conversation_id": conversation_id}
+        ) as response:
+            response.raise_for_status()
+            async for chunk in response.aiter_text():
+                if first_token is None and "event: token" in chunk:
+                    first_token = perf_counter() - start
+    except httpx.HTTPError as e:
+        print(f"Request failed: {e!r}")
+        return None
+    return [first_token or 0, perf_counter() - start]
+
+
+async def main() -> None:
+    limits = httpx.Limits(max_connections=CONCURRENCY, max_keepalive_connections=CONCURRENCY)
+    async with httpx.AsyncClient(limits=limits, timeout=120) as client:
+        conversation_ids = [
+            await create_conversation(client, user_name=f"load-test-{i}") for i in range(CONCURRENCY)
+        ]
+        start = perf_counter()
+        results = await asyncio.gather(
+            *[chat(client, conversation_id) for conversation_id in conversation_ids]
+        )
+        elapsed = perf_counter() - start
+
+    timings = np.array([result for result in results if result is not None])
+    print(f"{CONCURRENCY} concurrent streams in {elapsed:.1f}s, {CONCURRENCY - len(timings)} failed")
+    if len(timings) > 0:
+        for label, values in (("time to first token", timings[:, 0]), ("stream duration", timings[:, 1])):
+            p50, p95, p99 = np.percentile(values, [50, 95, 99])
+            print(f"{label:<20} p50: {p50:.2f}s  p95: {p95:.2f}s  p99: {p99:.2f}s  max: {values.max():.2f}s")
+
+
+asyncio.run(main())
@@ -0,0 +1,42 @@
+from time import perf_counter
+from typing import Callable, List
+
+import numpy as np
+from phi.document import Document
+from phi.document.reader.pdf import PDFUrlReader
+
+from llm.ingestion.chunker import TokenChunker, get_encoding
+
+# Compares the throughput and chunk sizes of the reader's character chunking and TokenChunker
+PDF_URL = "https://www.family-action.org.uk/content/uploads/2019/07/meals-more-recipes.pdf"
+# Chunk the pages this many times to get stable timings
+REPEAT = 20
+
+pages = PDFUrlReader(chunk=False).read(url=PDF_URL)
+documents: List[Document] = pages * REPEAT
+num_bytes = sum(len(document.content.encode()) for document in documents)
+encoding = get_encoding("cl100k_base")
+print(f"{len(pages)} pages, {num_bytes / 2**20:.1f} MiB chunked {REPEAT} times")
+
+
+def benchmark(label: str, chunk: Callable[[Document], List[Document]]) -> None:
+    start = perf_counter()
+    chunks = [chunk_document for document in documents for chunk_document in chunk(document)]
+    elapsed = perf_counter() - start
+
+    chunk_tokens = [len(encoding.encode_ordinary(document.content)) for document in chunks]
+    print(
+        f"{label:<32}{len(documents) / elapsed:>10.0f} pages/s{num_bytes / 2**20 / elapsed:>8.1f} MiB/s"
+        f"{sum(chunk_tokens) / elapsed:>12.0f} tokens/s{len(chunks) // REPEAT:>8} chunks"
+        f"  tokens min/mean/max: {min(chunk_tokens)}/{np.mean(chunk_tokens):.0f}/{max(chunk_tokens)}"
+    )
+
+
+benchmark("reader (3000 characters)", PDFUrlReader().chunk_document)
+for chunker in [
+    TokenChunker(chunk_size=500, chunk_overlap=50),
+    TokenChunker(chunk_size=250, chunk_overlap=25),
+    TokenChunker(chunk_size=500, chunk_overlap=50, split_on_sentences=False),
+]:
+    boundary = "sentences" if chunker.split_on_sentences else "tokens"
+    benchmark(f"tokens ({chunker.chunk_size}, {boundary})", chunker.chunk_document)
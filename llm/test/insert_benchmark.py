@@ -0,0 +1,81 @@
+from time import perf_counter
+from typing import Callable, List
+
+import numpy as np
+from phi.document import Document
+
+from db.session import db_url
+from llm.vectordb import PgVectorDb
+
+# Compares multi-row inserts with binary COPY for a reload of NUM_DOCUMENTS chunks
+# with embeddings, using scratch collections which are deleted afterwards.
+NUM_DOCUMENTS = 100_000
+BATCH_SIZE = 2000
+DIMENSIONS = 1536
+
+rng = np.random.default_rng(0)
+documents = [
+    Document(
+        name=f"document_{i // 100}",
+        meta_data={"page": i // 10, "chunk": i % 10},
+        content=f"Chunk {i} " + "lorem ipsum dolor sit amet " * 60,
+        embedding=rng.standard_normal(DIMENSIONS, dtype=np.float32).tolist(),
+        usage={"prompt_tokens": 400, "total_tokens": 400},
+    )
+    for i in range(NUM_DOCUMENTS)
+]
+
+
+def benchmark(
+    label: str, write: Callable[[PgVectorDb, List[Document]], None], index: Callable[[PgVectorDb], None]
+) -> float:
+    vector_db = PgVectorDb(collection="insert_benchmark_documents", db_url=db_url, schema="llm")
+    vector_db.delete()
+    start = perf_counter()
+    write(vector_db, documents)
+    write_elapsed = perf_counter() - start
+    index(vector_db)
+    elapsed = perf_counter() - start
+    print(
+        f"{label:<44}write: {write_elapsed:>7.1f}s ({NUM_DOCUMENTS / write_elapsed:>6.0f} documents/s)"
+        f"  total with indexes: {elapsed:>7.1f}s"
+    )
+    vector_db.delete()
+    return write_elapsed
+
+
+def insert(vector_db: PgVectorDb, documents: List[Document]) -> None:
+    # Indexes are maintained during the load
+    vector_db.create()
+    for i in range(0, len(documents), 256):
+        vector_db.insert_embedded(documents[i : i + 256])
+
+
+def copy_upsert(vector_db: PgVectorDb, documents: List[Document]) -> None:
+    vector_db.create()
+    for i in range(0, len(documents), BATCH_SIZE):
+        vector_db.copy_embedded(documents[i : i + BATCH_SIZE], upsert=True)
+
+
+def copy_bulk(vector_db: PgVectorDb, documents: List[Document]) -> None:
+    # Indexes are built once the documents are loaded
+    vector_db.create(create_indexes=False)
+    for i in range(0, len(documents), BATCH_SIZE):
+        vector_db.copy_embedded(documents[i : i + BATCH_SIZE], upsert=False)
+
+
+def create_vector_index(vector_db: PgVectorDb) -> None:
+    vector_db.create_index()
+
+
+def create_all_indexes(vector_db: PgVectorDb) -> None:
+    vector_db.create_all_indexes()
+
+
+baseline = benchmark("insert (256 rows per statement)", insert, create_vector_index)
+for label, write, index in [
+    (f"copy + upsert ({BATCH_SIZE} rows per copy)", copy_upsert, create_vector_index),
+    (f"copy, indexed after load ({BATCH_SIZE} rows)", copy_bulk, create_all_indexes),
+]:
+    elapsed = benchmark(label, write, index)
+    print(f"{'':<44}write: {baseline / elapsed:.1f}x faster")
@@ -0,0 +1,86 @@
+import asyncio
+import json
+import time
+from hashlib import md5
+from typing import Any, AsyncIterator, Dict
+
+import numpy as np
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse
+
+# OpenAI compatible chat completion and embedding api which answers after a fixed delay, used by chat_load_test.py.
+# Run with: uvicorn llm.test.mock_llm_server:app --port 8090
+# and start the Api with OPENAI_BASE_URL=http://localhost:8090/v1 OPENAI_API_KEY=mock
+TIME_TO_FIRST_TOKEN = 0.5
+NUM_TOKENS = 100
+TOKEN_INTERVAL = 0.02
+EMBEDDING_DIMENSIONS = 1536
+EMBEDDING_LATENCY = 0.05
+
+app = FastAPI()
+
+
+def completion_chunk(model: str, content: str, finish_reason: Any = None) -> str:
+    chunk = {
+        "id": "chatcmpl-mock",
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "delta": {"content": content}, "finish_reason": finish_reason}],
+    }
+    return f"data: {json.dumps(chunk)}\n\n"
+
+
+async def stream_completion(model: str) -> AsyncIterator[str]:
+    await asyncio.sleep(TIME_TO_FIRST_TOKEN)
+    for i in range(NUM_TOKENS):
+        yield completion_chunk(model, f"token{i} ")
+        await asyncio.sleep(TOKEN_INTERVAL)
+    yield completion_chunk(model, "", finish_reason="stop")
+    yield "data: [DONE]\n\n"
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    body: Dict[str, Any] = await request.json()
+    model = body.get("model", "mock")
+    if body.get("stream"):
+        return StreamingResponse(stream_completion(model), media_type="text/event-stream")
+
+    await asyncio.sleep(TIME_TO_FIRST_TOKEN + NUM_TOKENS * TOKEN_INTERVAL)
+    return {
+        "id": "chatcmpl-mock",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [
+            {
+                "index": 0,
+                "message": {"role": "assistant", "content": " ".join(f"token{i}" for i in range(NUM_TOKENS))},
+                "finish_reason": "stop",
+            }
+        ],
+        "usage": {"prompt_tokens": 0, "completion_tokens": NUM_TOKENS, "total_tokens": NUM_TOKENS},
+    }
+
+
+@app.post("/v1/embeddings")
+async def embeddings(request: Request):
+    body: Dict[str, Any] = await request.json()
+    texts = body["input"] if isinstance(body["input"], list) else [body["input"]]
+    await asyncio.sleep(EMBEDDING_LATENCY)
+
+    data = []
+    for i, text in enumerate(texts):
+        # The same text always has the same embedding
+        seed = int(md5(str(text).encode()).hexdigest()[:8], 16)
+        embedding = np.random.default_rng(seed).standard_normal(EMBEDDING_DIMENSIONS)
+        data.append(
+            {"object": "embedding", "index": i, "embedding": (embedding / np.linalg.norm(embedding)).tolist()}
+        )
+    return {
+        "object": "list",
+        "model": body.get("model", "mock"),
+        "data": data,
+        "usage": {"prompt_tokens": len(texts), "total_tokens": len(texts)},
+    }
@@ -0,0 +1,92 @@
+from time import perf_counter
+from typing import List, Optional, Set, Tuple
+
+import numpy as np
+from phi.vectordb.pgvector.index import HNSW
+from sqlalchemy.sql.expression import text
+
+from llm.knowledge_base import vector_dbs
+from llm.vectordb import PgVectorDb
+
+# Compares recall@k, index size and query latency of the full precision, halfvec and binary
+# quantized layouts on a copy of a collection, the collection itself is not modified.
+COLLECTION = "pdf_documents"
+NUM_QUERIES = 100
+K = 10
+# Queries are stored embeddings with noise added, so each query is not its own nearest neighbour
+QUERY_NOISE = 0.01
+
+# label, quantization, rescore
+CONFIGURATIONS: List[Tuple[str, Optional[str], bool]] = [
+    ("vector", None, False),
+    ("halfvec", "halfvec", False),
+    ("halfvec + rescore", "halfvec", True),
+    ("binary", "binary", False),
+    ("binary + rescore", "binary", True),
+]
+
+source_db = vector_dbs[COLLECTION]
+benchmark_db = PgVectorDb(
+    collection=f"{COLLECTION}_quantization_benchmark",
+    db_url=source_db.db_url,
+    schema=source_db.schema,
+    embedder=source_db.embedder,
+    distance=source_db.distance,
+    index=HNSW(),
+)
+source_table = f"{source_db.schema}.{source_db.collection}"
+benchmark_table = f"{benchmark_db.schema}.{benchmark_db.collection}"
+
+with benchmark_db.Session() as sess, sess.begin():
+    sess.execute(text(f"DROP TABLE IF EXISTS {benchmark_table}"))
+    sess.execute(text(f"CREATE TABLE {benchmark_table} AS SELECT * FROM {source_table}"))
+    table_size = sess.execute(text(f"SELECT pg_total_relation_size('{benchmark_table}')")).scalar_one()
+    sample = sess.execute(
+        text(f"SELECT embedding FROM {benchmark_table} ORDER BY random() LIMIT {NUM_QUERIES}")
+    ).fetchall()
+
+rng = np.random.default_rng(0)
+queries = [
+    (
+        np.asarray(row.embedding, dtype=np.float32) + rng.normal(0, QUERY_NOISE, benchmark_db.dimensions)
+    ).tolist()
+    for row in sample
+]
+print(
+    f"{benchmark_db.get_count()} documents, table size: {table_size / 2**20:.1f} MiB, {len(queries)} queries"
+)
+
+# Exact nearest neighbours using a sequential scan of the full precision embeddings
+benchmark_db.drop_indexes()
+benchmark_db.quantization = None
+expected: List[Set[str]] = [
+    {row.content_hash for row in benchmark_db._vector_search(query, K)} for query in queries
+]
+
+print(f"{'layout':<20}{'index MiB':>12}{'recall@' + str(K):>12}{'p50 ms':>10}{'p95 ms':>10}")
+for label, quantization, rescore in CONFIGURATIONS:
+    benchmark_db.create_index(rebuild=True, quantization=quantization or "none")  # type: ignore
+    benchmark_db.rescore = rescore
+    index_size = sum(vector_index.size_bytes for vector_index in benchmark_db.get_indexes())
+
+    # Warm up the index before timing queries
+    for query in queries[:10]:
+        benchmark_db._vector_search(query, K)
+
+    latencies: List[float] = []
+    recalls: List[float] = []
+    for query, expected_hashes in zip(queries, expected):
+        start = perf_counter()
+        rows = benchmark_db._vector_search(query, K)
+        latencies.append((perf_counter() - start) * 1000)
+        recalls.append(
+            len({row.content_hash for row in rows} & expected_hashes) / max(len(expected_hashes), 1)
+        )
+
+    print(
+        f"{label:<20}{index_size / 2**20:>12.1f}{np.mean(recalls):>12.3f}"
+        f"{np.percentile(latencies, 50):>10.2f}{np.percentile(latencies, 95):>10.2f}"
+    )
+
+with benchmark_db.Session() as sess, sess.begin():
+    sess.execute(text(f"DROP TABLE {benchmark_table}"))
@@ -0,0 +1,666 @@
+import re
+from concurrent.futures import ThreadPoolExecutor
+from hashlib import md5
+from types import SimpleNamespace
+from math import sqrt
+from time import monotonic
+from typing import TYPE_CHECKING, Any, Dict, List, Literal, Optional, Set, Union
+
+import psycopg
+from pgvector.psycopg import register_vector
+from phi.document import Document
+from phi.vectordb.distance import Distance
+from phi.vectordb.pgvector import PgVector
+from phi.vectordb.pgvector.index import HNSW, Ivfflat
+from pydantic import BaseModel
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.sql.expression import ColumnClause, cast, func, literal_column, select, text
+
+from llm.settings import llm_settings
+from utils.log import logger
+
+if TYPE_CHECKING:
+    from llm.replica import VectorReplica
+
+
+# A term or quoted phrase excluded from a websearch_to_tsquery query, e.g. -bar or -"foo bar"
+NEGATED_TERM = re.compile(r'(^|\s)-("[^"]*"?|\S+)')
+
+
+def strip_negated_terms(query: str) -> str:
+    return NEGATED_TERM.sub(r"\1", query)
+
+
+def clean_content(content: str) -> str:
+    """Replace null characters which postgres can't store in a text column"""
+
+    return content.replace("\x00", "\uFFFD")
+
+
+def get_content_hash(content: str) -> str:
+    """Returns the hash used by PgVector to identify a document's content"""
+
+    return md5(clean_content(content).encode()).hexdigest()
+
+
+# Runs the full text half of hybrid searches alongside the vector half
+_search_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="hybrid-search")
+
+
+def to_vector_literal(embedding: List[float]) -> str:
+    """Returns the text representation of a vector accepted by the vector, halfvec and bit casts"""
+
+    return "[" + ",".join(str(float(value)) for value in embedding) + "]"
+
+
+# Columns written by copy_embedded and their postgres types
+COPY_COLUMNS = ["name", "meta_data", "content", "embedding", "usage", "content_hash"]
+COPY_TYPES = ["varchar", "jsonb", "text", "vector", "jsonb", "varchar"]
+
+
+def get_index_quantization(definition: str) -> Optional[Literal["halfvec", "binary"]]:
+    """Returns the quantization of a vector index from its definition, read with pg_get_indexdef"""
+
+    if re.search(r"\bbit_\w+_ops\b", definition):
+        return "binary"
+    if re.search(r"\bhalfvec_\w+_ops\b", definition):
+        return "halfvec"
+    return None
+
+
+def get_default_index() -> Union[Ivfflat, HNSW]:
+    """Returns the index configured in llm_settings"""
+
+    if llm_settings.vector_index_type == "ivfflat":
+        return Ivfflat(
+            lists=llm_settings.ivfflat_lists, probes=llm_settings.ivfflat_probes, dynamic_lists=False
+        )
+    return HNSW(
+        m=llm_settings.hnsw_m,
+        ef_construction=llm_settings.hnsw_ef_construction,
+        ef_search=llm_settings.hnsw_ef_search,
+    )
+
+
+class VectorIndex(BaseModel):
+    name: str
+    index_type: str
+    valid: bool
+    size_bytes: int
+    definition: str
+
+
+class IndexBuildProgress(BaseModel):
+    phase: str
+    blocks_done: int
+    blocks_total: int
+    tuples_done: int
+    tuples_total: int
+
+
+class IndexStatus(BaseModel):
+    collection: str
+    num_documents: int
+    indexes: List[VectorIndex]
+    # Set while an index is being built on the collection
+    build: Optional[IndexBuildProgress] = None
+    # Error from the last failed index build
+    last_error: Optional[str] = None
+
+
+class PgVectorDb(PgVector):
+    """PgVector collection with batched reads and writes used by the ingestion pipeline"""
+
+    last_index_error: Optional[str] = None
+    # Postgres text search configuration used by lexical and hybrid searches
+    text_search_config: str = "english"
+    # In-memory replica used for vector searches when set
+    replica: Optional["VectorReplica"] = None
+    # Index and search a quantized copy of the embeddings, halfvec halves the index size
+    # and binary reduces it 32 times at a larger cost in recall.
+    # Searches use the quantization of the collection's vector index when it has one.
+    quantization: Optional[Literal["halfvec", "binary"]] = llm_settings.vector_quantization
+    # Seconds between reads of the quantization of the collection's vector index
+    quantization_refresh_interval: float = 60
+    quantization_read_at: Optional[float] = None
+    # Re-score quantized search candidates using the full precision embeddings
+    rescore: bool = llm_settings.vector_rescore
+    # Number of candidates re-scored per result
+    rescore_multiplier: int = llm_settings.vector_rescore_multiplier
+
+    def get_existing_content_hashes(self, content_hashes: List[str]) -> Set[str]:
+        """Returns the subset of content_hashes which already exist in the collection"""
+
+        if len(content_hashes) == 0:
+            return set()
+
+        with self.Session() as sess, sess.begin():
+            stmt = select(self.table.c.content_hash).where(self.table.c.content_hash.in_(content_hashes))
+            return {row.content_hash for row in sess.execute(stmt)}
+
+    def has_same_embedder(self, other: PgVector) -> bool:
+        """Returns True if embeddings stored in the other collection can be reused in this collection"""
+
+        return (
+            self.embedder.__class__ == other.embedder.__class__
+            and getattr(self.embedder, "model", None) == getattr(other.embedder, "model", None)
+            and self.dimensions == other.dimensions
+        )
+
+    def get_embeddings(self, content_hashes: List[str]) -> Dict[str, List[float]]:
+        """Returns the stored embeddings for the given content hashes"""
+
+        if len(content_hashes) == 0:
+            return {}
+
+        with self.Session() as sess, sess.begin():
+            stmt = select(self.table.c.content_hash, self.table.c.embedding).where(
+                self.table.c.content_hash.in_(content_hashes)
+            )
+            return {row.content_hash: list(map(float, row.embedding)) for row in sess.execute(stmt)}
+
+    def delete_content_hashes(self, content_hashes: List[str]) -> None:
+        """Delete the documents with the given content hashes"""
+
+        if len(content_hashes) == 0:
+            return
+
+        with self.Session() as sess, sess.begin():
+            sess.execute(self.table.delete().where(self.table.c.content_hash.in_(content_hashes)))
+        logger.debug(f"Deleted {len(content_hashes)} documents from {self.collection}")
+
+    def insert_embedded(self, documents: List[Document]) -> None:
+        """Insert documents which already have embeddings using a single multi-row statement"""
+
+        rows = self._embedded_rows(documents)
+        if len(rows) == 0:
+            return
+
+        with self.Session() as sess, sess.begin():
+            sess.execute(postgresql.insert(self.table), rows)
+        logger.debug(f"Inserted {len(rows)} documents into {self.collection}")
+
+    def copy_embedded(self, documents: List[Document], upsert: bool = True) -> int:
+        """Write documents which already have embeddings using binary COPY and return the number of rows.
+
+        When upsert is True, rows are copied into a staging table which is merged into the collection
+        with a single statement, updating documents with the same content_hash.
+        Otherwise rows are copied directly into the collection, which is used for bulk loads into new collections.
+        """
+
+        rows = self._embedded_rows(documents)
+        if len(rows) == 0:
+            return 0
+
+        columns = ", ".join(COPY_COLUMNS)
+        table_name = self._qualify(self.collection)
+        staging_table = f"{self.collection}_staging"
+        with self.Session() as sess, sess.begin():
+            connection = sess.connection().connection.driver_connection
+            if not isinstance(connection, psycopg.Connection):
+                raise ValueError("copy_embedded requires the psycopg driver")
+            if connection.adapters.types.get("vector") is None:
+                register_vector(connection)
+
+            if upsert:
+                sess.execute(
+                    text(
+                        f"CREATE TEMP TABLE {staging_table} (LIKE {table_name} INCLUDING DEFAULTS) ON COMMIT DROP"
+                    )
+                )
+            with connection.cursor() as cursor:
+                copy_table = staging_table if upsert else table_name
+                with cursor.copy(f"COPY {copy_table} ({columns}) FROM STDIN (FORMAT BINARY)") as copy:
+                    copy.set_types(COPY_TYPES)
+                    for row in rows:
+                        copy.write_row([row[column] for column in COPY_COLUMNS])
+
+            if upsert:
+                sess.execute(
+                    text(
+                        f"WITH staged AS (SELECT DISTINCT ON (content_hash) * FROM {staging_table}), "
+                        f"updated AS (UPDATE {table_name} AS t SET name = s.name, meta_data = s.meta_data, "
+                        "embedding = s.embedding, usage = s.usage, updated_at = now() "
+                        "FROM staged AS s WHERE t.content_hash = s.content_hash RETURNING t.content_hash) "
+                        f"INSERT INTO {table_name} ({columns}) SELECT {columns} FROM staged "
+                        "WHERE content_hash NOT IN (SELECT content_hash FROM updated)"
+                    )
+                )
+        logger.debug(f"Copied {len(rows)} documents into {self.collection}")
+        return len(rows)
+
+    def _embedded_rows(self, documents: List[Document]) -> List[Dict[str, Any]]:
+        rows = []
+        for document in documents:
+            if document.embedding is None:
+                logger.warning(f"Skipping document without embedding: {document.name}")
+                continue
+            cleaned_content = clean_content(document.content)
+            rows.append(
+                dict(
+                    name=document.name,
+                    meta_data=document.meta_data,
+                    content=cleaned_content,
+                    embedding=document.embedding,
+                    usage=document.usage,
+                    content_hash=md5(cleaned_content.encode()).hexdigest(),
+                )
+            )
+        return rows
+
+    def create(self, create_indexes: bool = True) -> None:
+        """Create the collection table.
+
+        Bulk loads into a new collection pass create_indexes=False and build the indexes with
+        create_all_indexes once the documents are loaded, which is much faster than updating
+        the indexes on every insert.
+        """
+
+        if not self.table_exists():
+            super().create()
+            if create_indexes:
+                self.create_text_index()
+                self.create_content_hash_index()
+
+    def create_all_indexes(self) -> None:
+        """Create the full text, content_hash and vector indexes"""
+
+        self.create_text_index()
+        self.create_content_hash_index()
+        self.create_index()
+
+    def create_content_hash_index(self) -> None:
+        """Create the index used to find existing documents and merge upserts"""
+
+        with self.Session() as sess, sess.begin():
+            sess.execute(
+                text(
+                    f"CREATE INDEX IF NOT EXISTS {self.collection}_content_hash_index "
+                    f"ON {self._qualify(self.collection)} (content_hash)"
+                )
+            )
+
+    def create_text_index(self) -> None:
+        """Create the GIN index used by lexical and hybrid searches"""
+
+        with self.Session() as sess, sess.begin():
+            sess.execute(
+                text(
+                    f"CREATE INDEX IF NOT EXISTS {self.collection}_content_fts_index "
+                    f"ON {self._qualify(self.collection)} USING gin ({self._content_tsvector()})"
+                )
+            )
+
+    def search(
+        self, query: str, limit: int = 5, ef_search: Optional[int] = None, probes: Optional[int] = None
+    ) -> List[Document]:
+        """Returns the documents closest to the query.
+
+        ef_search and probes override the index settings for this query, higher values
+        trade latency for recall.
+        """
+
+        query_embedding = self.embedder.get_embedding(query)
+        if query_embedding is None:
+            logger.error(f"Error getting embedding for Query: {query}")
+            return []
+        return self._to_documents(
+            self._vector_search(query_embedding, limit, ef_search=ef_search, probes=probes)
+        )
+
+    def lexical_search(self, query: str, limit: int = 5) -> List[Document]:
+        """Returns the documents which best match the query terms using postgres full text search"""
+
+        return self._to_documents(self._lexical_search(query, limit))
+
+    def hybrid_search(
+        self,
+        query: str,
+        limit: int = 5,
+        num_candidates: Optional[int] = None,
+        rrf_k: int = 60,
+        ef_search: Optional[int] = None,
+        probes: Optional[int] = None,
+    ) -> List[Document]:
+        """Returns documents ranked by reciprocal rank fusion of vector and full text search results.
+
+        The full text search runs while the query is embedded and the vector search runs,
+        then each document is scored by the sum of 1 / (rrf_k + rank) over both result lists.
+        """
+
+        num_candidates = num_candidates or max(limit * 4, 20)
+        # Questions rarely contain every query term, so any term can match and ranking favours more matches
+        lexical_future = _search_executor.submit(self._lexical_search, query, num_candidates, True)
+
+        vector_rows: List[Any] = []
+        query_embedding = self.embedder.get_embedding(query)
+        if query_embedding is None:
+            logger.error(f"Error getting embedding for Query: {query}")
+        else:
+            vector_rows = self._vector_search(
+                query_embedding, num_candidates, ef_search=ef_search, probes=probes
+            )
+        lexical_rows = lexical_future.result()
+
+        scores: Dict[str, float] = {}
+        rows: Dict[str, Any] = {}
+        for result_rows in (vector_rows, lexical_rows):
+            for rank, row in enumerate(result_rows, start=1):
+                scores[row.content_hash] = scores.get(row.content_hash, 0) + 1 / (rrf_k + rank)
+                rows.setdefault(row.content_hash, row)
+        ranked = sorted(scores, key=lambda content_hash: scores[content_hash], reverse=True)[:limit]
+        return self._to_documents([rows[content_hash] for content_hash in ranked])
+
+    def _search_columns(self) -> List[Any]:
+        return [
+            self.table.c.name,
+            self.table.c.meta_data,
+            self.table.c.content,
+            self.table.c.embedding,
+            self.table.c.usage,
+            self.table.c.content_hash,
+        ]
+
+    def _vector_search(
+        self,
+        query_embedding: List[float],
+        limit: int,
+        ef_search: Optional[int] = None,
+        probes: Optional[int] = None,
+    ) -> List[Any]:
+        # ef_search and probes only apply to searches in postgres
+        if self.replica is not None and ef_search is None and probes is None:
+            try:
+                return [SimpleNamespace(**row) for row in self.replica.search(query_embedding, limit)]
+            except Exception as e:
+                logger.warning(f"Vector replica search failed, searching postgres: {e}")
+
+        self.read_quantization()
+        if self.quantization is None:
+            stmt = select(*self._search_columns()).order_by(
+                self._exact_distance(self.table.c.embedding, query_embedding)
+            )
+            stmt = stmt.limit(limit=limit)
+        else:
+            # Candidates are found using the quantized index then re-scored with the full precision embeddings
+            num_candidates = limit * self.rescore_multiplier if self.rescore else limit
+            quantized_distance = text(
+                f"{self._quantized_expression()} {self._distance_operator()} {self._quantized_query_expression()}"
+            ).bindparams(query_embedding=to_vector_literal(query_embedding))
+            stmt = select(*self._search_columns()).order_by(quantized_distance).limit(num_candidates)
+            if self.rescore:
+                candidates = stmt.subquery()
+                stmt = (
+                    select(*candidates.c)
+                    .order_by(self._exact_distance(candidates.c.embedding, query_embedding))
+                    .limit(limit)
+                )
+            limit = num_candidates
+
+        with self.Session() as sess, sess.begin():
+            if ef_search is None and isinstance(self.index, HNSW):
+                ef_search = self.index.ef_search
+            if probes is None and isinstance(self.index, Ivfflat):
+                probes = self.index.probes
+            if ef_search is not None:
+                # hnsw returns at most ef_search rows
+                sess.execute(text(f"SET LOCAL hnsw.ef_search = {max(int(ef_search), limit)}"))
+            if probes is not None:
+                sess.execute(text(f"SET LOCAL ivfflat.probes = {int(probes)}"))
+            return list(sess.execute(stmt).fetchall())
+
+    def _exact_distance(self, embedding: Any, query_embedding: List[float]) -> Any:
+        if self.distance == Distance.l2:
+            return embedding.l2_distance(query_embedding)
+        if self.distance == Distance.max_inner_product:
+            return embedding.max_inner_product(query_embedding)
+        return embedding.cosine_distance(query_embedding)
+
+    def _quantized_expression(self) -> str:
+        # Must match the expression of the vector index for the index to be used
+        if self.quantization == "halfvec":
+            return f"(embedding::halfvec({self.dimensions}))"
+        if self.quantization == "binary":
+            return f"(binary_quantize(embedding)::bit({self.dimensions}))"
+        return "embedding"
+
+    def _quantized_query_expression(self) -> str:
+        if self.quantization == "halfvec":
+            return f"CAST(:query_embedding AS halfvec({self.dimensions}))"
+        if self.quantization == "binary":
+            return f"binary_quantize(CAST(:query_embedding AS vector({self.dimensions})))::bit({self.dimensions})"
+        return f"CAST(:query_embedding AS vector({self.dimensions}))"
+
+    def _distance_operator(self) -> str:
+        if self.quantization == "binary":
+            return "<~>"
+        if self.distance == Distance.l2:
+            return "<->"
+        if self.distance == Distance.max_inner_product:
+            return "<#>"
+        return "<=>"
+
+    def _index_ops(self) -> str:
+        if self.quantization == "binary":
+            return "bit_hamming_ops"
+        prefix = "halfvec" if self.quantization == "halfvec" else "vector"
+        if self.distance == Distance.l2:
+            return f"{prefix}_l2_ops"
+        if self.distance == Distance.max_inner_product:
+            return f"{prefix}_ip_ops"
+        return f"{prefix}_cosine_ops"
+
+    def _lexical_search(self, query: str, limit: int, match_any: bool = False) -> List[Any]:
+        # websearch_to_tsquery accepts arbitrary user input, so queries can not fail to parse
+        content_tsvector: ColumnClause[Any] = literal_column(self._content_tsvector())
+        ts_query: Any = func.websearch_to_tsquery(
+            literal_column(f"'{self.text_search_config}'::regconfig"), query
+        )
+        if match_any:
+            # Any lexeme of the query, negated terms are dropped as they would match almost every row
+            lexeme = func.unnest(
+                func.tsvector_to_array(
+                    func.to_tsvector(
+                        literal_column(f"'{self.text_search_config}'::regconfig"), strip_negated_terms(query)
+                    )
+                )
+            ).column_valued("lexeme")
+            ts_query = cast(
+                select(func.string_agg(func.quote_literal(lexeme), " | ")).scalar_subquery(),
+                postgresql.TSQUERY,
+            )
+        stmt = (
+            select(*self._search_columns())
+            .where(content_tsvector.op("@@")(ts_query))
+            .order_by(func.ts_rank_cd(content_tsvector, ts_query).desc())
+            .limit(limit)
+        )
+        with self.Session() as sess, sess.begin():
+            return list(sess.execute(stmt).fetchall())
+
+    def _content_tsvector(self) -> str:
+        # Must match the expression of the GIN index for the index to be used
+        return f"to_tsvector('{self.text_search_config}', content)"
+
+    def _to_documents(self, rows: List[Any]) -> List[Document]:
+        return [
+            Document(
+                name=row.name,
+                meta_data=row.meta_data,
+                content=row.content,
+                embedder=self.embedder,
+                embedding=row.embedding,
+                usage=row.usage,
+            )
+            for row in rows
+        ]
+
+    def optimize(self) -> None:
+        self.create_index()
+
+    def read_quantization(self, force: bool = False) -> None:
+        """Use the quantization of the collection's vector index, which any process can rebuild"""
+
+        if (
+            not force
+            and self.quantization_read_at is not None
+            and monotonic() - self.quantization_read_at < self.quantization_refresh_interval
+        ):
+            return
+        self.quantization_read_at = monotonic()
+        try:
+            indexes = [i for i in self.get_indexes() if i.valid and not i.name.endswith("_build")]
+        except Exception as e:
+            logger.warning(f"Could not read the vector indexes of {self.collection}: {e}")
+            return
+        if len(indexes) > 0:
+            self.quantization = get_index_quantization(indexes[0].definition)
+
+    def get_index_name(self, index: Union[Ivfflat, HNSW]) -> str:
+        if index.name is not None:
+            return index.name
+        index_type = "ivfflat" if isinstance(index, Ivfflat) else "hnsw"
+        if self.quantization is not None:
+            index_type = f"{index_type}_{self.quantization}"
+        return f"{self.collection}_{index_type}_index"
+
+    def create_index(
+        self,
+        index: Optional[Union[Ivfflat, HNSW]] = None,
+        rebuild: bool = False,
+        quantization: Optional[Literal["none", "halfvec", "binary"]] = None,
+    ) -> None:
+        """Create an approximate nearest neighbour index on the embedding column.
+
+        The index is built concurrently so the collection can be searched and written to
+        during the build. When rebuild is True, or the index type or quantization changes,
+        the new index replaces the existing vector indexes once it is built.
+        quantization changes the quantization of the index, "none" indexes the full precision
+        embeddings and None keeps the current quantization. Searches in every process use the
+        new quantization once the index is swapped in, they read it from the index definition.
+        """
+
+        index = index or self.index
+        if index is None:
+            return
+
+        self.read_quantization(force=True)
+        current_quantization = self.quantization
+        if quantization is not None:
+            self.quantization = None if quantization == "none" else quantization
+        index_name = self.get_index_name(index)
+        index_expression = f"{self._quantized_expression()} {self._index_ops()}"
+        new_quantization = self.quantization
+        # Searches keep using the current quantization until the new index is built
+        self.quantization = current_quantization
+
+        existing_indexes = {vector_index.name: vector_index for vector_index in self.get_indexes()}
+        if not rebuild and index_name in existing_indexes and existing_indexes[index_name].valid:
+            logger.debug(f"Index {index_name} already exists")
+            self.index = index
+            self.quantization = new_quantization
+            return
+
+        if isinstance(index, Ivfflat):
+            num_lists = index.lists
+            if index.dynamic_lists:
+                num_documents = self.get_count()
+                num_lists = (
+                    int(num_documents / 1000) if num_documents < 1_000_000 else int(sqrt(num_documents))
+                )
+            using = f"ivfflat ({index_expression}) WITH (lists = {max(int(num_lists), 1)})"
+        else:
+            using = (
+                f"hnsw ({index_expression}) "
+                f"WITH (m = {int(index.m)}, ef_construction = {int(index.ef_construction)})"
+            )
+
+        table_name = f"{self.schema}.{self.collection}" if self.schema else self.collection
+        build_name = f"{index_name}_build"
+        self.last_index_error = None
+        try:
+            # CREATE INDEX CONCURRENTLY can not run inside a transaction
+            with self.db_engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+                # Builds are much faster when the graph fits in maintenance_work_mem
+                conn.execute(text(f"SET maintenance_work_mem = '{llm_settings.index_maintenance_work_mem}'"))
+                conn.execute(
+                    text(f"SET max_parallel_maintenance_workers = {int(llm_settings.index_parallel_workers)}")
+                )
+                for key, value in index.configuration.items():
+                    # phi's indexes default to 2GB, the build settings come from llm_settings
+                    if key in ("maintenance_work_mem", "max_parallel_maintenance_workers"):
+                        continue
+                    conn.execute(text(f"SET {key} = '{value}'"))
+                conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {self._qualify(build_name)}"))
+                logger.info(f"Building index {index_name} on {table_name} using {using}")
+                conn.execute(text(f"CREATE INDEX CONCURRENTLY {build_name} ON {table_name} USING {using}"))
+
+            # Swap the new index in place of the existing vector indexes
+            with self.Session() as sess, sess.begin():
+                for existing_index in existing_indexes:
+                    # Left by a failed or interrupted build, it was dropped and is now the new index
+                    if existing_index == build_name:
+                        continue
+                    sess.execute(text(f"DROP INDEX IF EXISTS {self._qualify(existing_index)}"))
+                sess.execute(text(f"ALTER INDEX {self._qualify(build_name)} RENAME TO {index_name}"))
+        except Exception as e:
+            self.last_index_error = str(e)
+            logger.error(f"Failed to build index {index_name}: {e}")
+            raise
+        self.index = index
+        self.quantization = new_quantization
+        logger.info(f"Built index {index_name} on {table_name}")
+
+    def drop_indexes(self) -> None:
+        """Drop the vector indexes on the collection, searches fall back to an exact scan"""
+
+        with self.Session() as sess, sess.begin():
+            for vector_index in self.get_indexes():
+                sess.execute(text(f"DROP INDEX IF EXISTS {self._qualify(vector_index.name)}"))
+
+    def get_indexes(self) -> List[VectorIndex]:
+        """Returns the hnsw and ivfflat indexes on the collection"""
+
+        if not self.table_exists():
+            return []
+
+        with self.Session() as sess, sess.begin():
+            rows = sess.execute(
+                text(
+                    "SELECT c.relname AS name, am.amname AS index_type, i.indisvalid AS valid, "
+                    "pg_relation_size(c.oid) AS size_bytes, pg_get_indexdef(c.oid) AS definition "
+                    "FROM pg_index i "
+                    "JOIN pg_class c ON c.oid = i.indexrelid "
+                    "JOIN pg_am am ON am.oid = c.relam "
+                    "WHERE i.indrelid = to_regclass(:table_name) AND am.amname IN ('hnsw', 'ivfflat')"
+                ),
+                {"table_name": self._qualify(self.collection)},
+            )
+            return [VectorIndex(**row._mapping) for row in rows]
+
+    def get_index_status(self) -> IndexStatus:
+        """Returns the vector indexes on the collection and the progress of any index build"""
+
+        build: Optional[IndexBuildProgress] = None
+        if self.table_exists():
+            with self.Session() as sess, sess.begin():
+                row = sess.execute(
+                    text(
+                        "SELECT phase, blocks_done, blocks_total, tuples_done, tuples_total "
+                        "FROM pg_stat_progress_create_index WHERE relid = to_regclass(:table_name)"
+                    ),
+                    {"table_name": self._qualify(self.collection)},
+                ).first()
+                if row is not None:
+                    build = IndexBuildProgress(**row._mapping)
+
+        return IndexStatus(
+            collection=self.collection,
+            num_documents=self.get_count() if self.table_exists() else 0,
+            indexes=self.get_indexes(),
+            build=build,
+            last_error=self.last_index_error,
+        )
+
+    def _qualify(self, name: str) -> str:
+        return f"{self.schema}.{name}" if self.schema else name
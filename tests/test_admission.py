@@ -0,0 +1,67 @@
+import asyncio
+from typing import List
+
+import pytest
+
+from llm.admission import AdmissionController, AdmissionRejected
+
+
+def test_requests_over_the_token_bucket_are_rejected():
+    controller = AdmissionController(user_tokens=1000, user_tokens_per_minute=600)
+
+    with controller.admit("alice", "gpt-4", 800) as admission:
+        admission.used_tokens = 300
+    # The unused tokens were returned, so the bucket has 700 tokens and refills 10 tokens per second
+    with controller.admit("alice", "gpt-4", 400):
+        pass
+    with pytest.raises(AdmissionRejected) as e:
+        with controller.admit("alice", "gpt-4", 400):
+            pass
+    assert e.value.reason == "rate_limited"
+    assert 9 < e.value.retry_after <= 10
+    # Other users have their own bucket
+    with controller.admit("bob", "gpt-4", 400):
+        pass
+    assert controller.rejected["rate_limited"] == 1
+
+
+def test_waiting_requests_are_admitted_round_robin():
+    controller = AdmissionController(user_tokens=100000, default_max_concurrency=1, queue_size=3)
+    admitted: List[str] = []
+
+    async def chat(user_name: str) -> None:
+        admission = await controller.aadmit(user_name, "gpt-4", 10)
+        admitted.append(user_name)
+        await asyncio.sleep(0)
+        controller.release(admission)
+
+    async def main():
+        running = await controller.aadmit("alice", "gpt-4", 10)
+        # Alice sends more requests before bob, they are admitted in turns
+        tasks = [asyncio.ensure_future(chat(user_name)) for user_name in ("alice", "alice", "bob")]
+        await asyncio.sleep(0.01)
+        with pytest.raises(AdmissionRejected) as e:
+            await controller.aadmit("carol", "gpt-4", 10)
+        assert e.value.reason == "queue_full"
+        controller.release(running)
+        await asyncio.gather(*tasks)
+
+    asyncio.run(main())
+    assert admitted == ["alice", "bob", "alice"]
+    assert controller.models["gpt-4"].running == 0
+
+
+def test_waiting_requests_time_out():
+    controller = AdmissionController(user_tokens=1000, default_max_concurrency=1, queue_timeout=0.01)
+
+    async def main():
+        running = await controller.aadmit("alice", "gpt-4", 100)
+        with pytest.raises(AdmissionRejected) as e:
+            await controller.aadmit("bob", "gpt-4", 100)
+        assert e.value.reason == "queue_timeout"
+        controller.release(running)
+
+    asyncio.run(main())
+    assert controller.models["gpt-4"].num_waiting == 0
+    # The tokens of the rejected request were returned
+    assert controller.buckets["bob"].tokens == pytest.approx(1000)
@@ -0,0 +1,91 @@
+import asyncio
+import threading
+import time
+from types import SimpleNamespace
+from typing import List
+
+import pytest
+
+from llm import batch as batch_module
+from llm.admission import AdmissionController
+from llm.batch import BatchAnswer, BatchQuestion, parse_questions, run_batch
+
+
+def answer_with(arun):
+    async def answer_question(index: int, question: BatchQuestion, conversation) -> BatchAnswer:
+        answer = "".join([chunk async for chunk in arun(question.question)])
+        return BatchAnswer(index=index, question=question.question, answer=answer)
+
+    return answer_question
+
+
+def test_parse_questions():
+    questions = parse_questions(['{"id": "a", "question": "first?"}', "", '{"question": "second?"}'])
+    assert [(q.id, q.question) for q in questions] == [("a", "first?"), (None, "second?")]
+
+    with pytest.raises(ValueError, match="line 2"):
+        parse_questions(['{"question": "first?"}', '{"id": "b"}'])
+
+
+def test_run_batch_bounds_concurrency(monkeypatch):
+    lock = threading.Lock()
+    running: List[int] = [0, 0]
+
+    def run(message: str, stream: bool = True) -> str:
+        with lock:
+            running[0] += 1
+            running[1] = max(running)
+        time.sleep(0.02)
+        with lock:
+            running[0] -= 1
+        return f"answer to {message}"
+
+    monkeypatch.setattr(
+        batch_module,
+        "get_batch_conversation",
+        lambda conversation_type: SimpleNamespace(run=run, memory=SimpleNamespace(llm_messages=[])),
+    )
+    questions = parse_questions([f'{{"id": "{i}", "question": "q{i}"}}' for i in range(10)])
+
+    async def main():
+        return [answer async for answer in run_batch(questions, concurrency=3)]
+
+    answers = asyncio.run(main())
+    assert sorted(answer.index for answer in answers) == list(range(10))
+    assert all(answer.answer == f"answer to q{answer.index}" for answer in answers)
+    assert running[1] == 3
+
+
+def test_run_batch_admits_questions_within_the_user_limits(monkeypatch):
+    controller = AdmissionController(
+        user_tokens=10000, user_tokens_per_minute=6_000_000, default_max_concurrency=1
+    )
+    monkeypatch.setattr(batch_module, "admission_controller", controller)
+    running: List[int] = [0, 0]
+
+    async def arun(message: str):
+        running[0] += 1
+        running[1] = max(running)
+        await asyncio.sleep(0.01)
+        running[0] -= 1
+        yield f"answer to {message}"
+
+    monkeypatch.setattr(
+        batch_module,
+        "get_batch_conversation",
+        lambda conversation_type: SimpleNamespace(
+            llm=SimpleNamespace(model="model", max_tokens=1000), memory=SimpleNamespace(llm_messages=[])
+        ),
+    )
+    monkeypatch.setattr(batch_module, "answer_question", answer_with(arun))
+    questions = parse_questions([f'{{"question": "q{i}"}}' for i in range(6)])
+
+    async def main():
+        return [answer async for answer in run_batch(questions, concurrency=3, user_name="evaluator")]
+
+    answers = asyncio.run(main())
+    assert sorted(answer.answer for answer in answers) == [f"answer to q{i}" for i in range(6)]
+    # The model allows one request at a time and the user's bucket holds two questions
+    assert running[1] == 1
+    assert controller.admitted == 6
+    assert controller.rejected["rate_limited"] > 0
@@ -0,0 +1,74 @@
+import pytest
+import tiktoken
+from phi.document import Document
+
+from llm.ingestion import chunker as chunker_module
+from llm.ingestion.chunker import TokenChunker
+
+# Byte level encoding, so the tests do not need to download an encoding and one byte is one token
+BYTE_ENCODING = tiktoken.Encoding(
+    name="bytes",
+    pat_str=r"\S+|\s+",
+    mergeable_ranks={bytes([i]): i for i in range(256)},
+    special_tokens={},
+)
+
+TEXT = (
+    "# Introduction\nThis guide covers cooking at home. It is short.\n\n"
+    "## Recipes\n" + " ".join(f"Step {i} of the recipe is done." for i in range(30)) + "\n"
+    "2.1 Storing food\nKeep leftovers in the fridge."
+)
+
+
+@pytest.fixture(autouse=True)
+def byte_encoding(monkeypatch):
+    monkeypatch.setattr(chunker_module, "get_encoding", lambda encoding_name: BYTE_ENCODING)
+
+
+def test_chunks_respect_chunk_size():
+    chunker = TokenChunker(chunk_size=100, chunk_overlap=20, min_chunk_size=10)
+    chunks = chunker.chunk_text(TEXT)
+
+    assert all(num_tokens <= 100 for _, num_tokens in chunks)
+    # Chunks end at sentence boundaries
+    assert all(chunk.endswith(".") for chunk, _ in chunks)
+    # Sections start new chunks
+    assert chunks[0][0].startswith("# Introduction")
+    assert chunks[1][0].startswith("## Recipes")
+    assert chunks[-1][0] == "2.1 Storing food\nKeep leftovers in the fridge."
+
+
+def test_chunks_overlap():
+    chunks = TokenChunker(chunk_size=100, chunk_overlap=40, min_chunk_size=10).chunk_text(TEXT)
+    recipe_chunks = [chunk for chunk, _ in chunks if "recipe" in chunk]
+
+    for previous, current in zip(recipe_chunks, recipe_chunks[1:]):
+        last_sentence = previous.rsplit(". ", 1)[-1]
+        assert current.startswith(last_sentence)
+
+
+def test_small_sections_are_merged():
+    chunks = TokenChunker(chunk_size=1000, chunk_overlap=0, min_chunk_size=100).chunk_text(TEXT)
+
+    # The introduction is smaller than min_chunk_size so it is merged with the recipes section
+    assert len(chunks) == 2
+    assert chunks[0][0].startswith("# Introduction") and "## Recipes" in chunks[0][0]
+    assert chunks[1][0].startswith("2.1 Storing food")
+
+
+def test_long_sentences_are_split():
+    chunker = TokenChunker(chunk_size=50, chunk_overlap=10)
+    chunks = chunker.chunk_text("a" * 120)
+    assert [num_tokens for _, num_tokens in chunks] == [50, 50, 20]
+
+    windows = TokenChunker(chunk_size=50, chunk_overlap=10, split_on_sentences=False).chunk_text("a" * 120)
+    assert [num_tokens for _, num_tokens in windows] == [50, 50, 40]
+
+
+def test_chunk_document_metadata():
+    document = Document(name="guide", meta_data={"page": 3}, content=TEXT)
+    chunks = TokenChunker(chunk_size=100, chunk_overlap=20, min_chunk_size=10).chunk_document(document)
+
+    assert [chunk.meta_data["chunk"] for chunk in chunks] == list(range(1, len(chunks) + 1))
+    assert all(chunk.name == "guide" and chunk.meta_data["page"] == 3 for chunk in chunks)
+    assert all(chunk.meta_data["chunk_tokens"] <= 100 for chunk in chunks)
@@ -0,0 +1,76 @@
+import asyncio
+from typing import List
+
+from llm.coalescing import Flight, RequestCoalescer
+
+
+def test_identical_requests_share_one_answer():
+    coalescer = RequestCoalescer()
+    produced: List[str] = []
+
+    async def produce(flight: Flight) -> None:
+        produced.append("answer")
+        for chunk in ("a", "b", "c"):
+            await asyncio.sleep(0.01)
+            flight.publish(chunk)
+
+    async def ask() -> str:
+        flight = coalescer.join("question") or coalescer.start("question", produce)
+        return "".join([chunk async for chunk in coalescer.subscribe(flight)])
+
+    async def main() -> List[str]:
+        first = asyncio.ensure_future(ask())
+        await asyncio.sleep(0.015)
+        # Joins after the first chunk was streamed
+        return list(await asyncio.gather(first, ask()))
+
+    assert asyncio.run(main()) == ["abc", "abc"]
+    assert produced == ["answer"]
+    assert coalescer.stats() == {"in_flight": 0, "started": 1, "joined": 1}
+
+
+def test_answer_is_cancelled_when_every_request_left():
+    coalescer = RequestCoalescer()
+    cancelled: List[bool] = []
+
+    async def produce(flight: Flight) -> None:
+        try:
+            flight.publish("a")
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+
+    async def main():
+        flight = coalescer.start("question", produce)
+        requests = [coalescer.subscribe(flight) for _ in range(2)]
+        for chunks in requests:
+            assert await chunks.__anext__() == "a"
+        await requests[0].aclose()
+        await asyncio.sleep(0)
+        assert cancelled == []
+        await requests[1].aclose()
+        await asyncio.sleep(0)
+
+    asyncio.run(main())
+    assert cancelled == [True]
+    assert coalescer.flights == {}
+
+
+def test_errors_are_raised_to_every_request():
+    coalescer = RequestCoalescer()
+
+    async def produce(flight: Flight) -> None:
+        await asyncio.sleep(0.01)
+        raise RuntimeError("llm unavailable")
+
+    async def ask() -> str:
+        flight = coalescer.join("question") or coalescer.start("question", produce)
+        return "".join([chunk async for chunk in coalescer.subscribe(flight)])
+
+    async def main():
+        return await asyncio.gather(ask(), ask(), return_exceptions=True)
+
+    errors = asyncio.run(main())
+    assert [str(e) for e in errors] == ["llm unavailable", "llm unavailable"]
+    assert coalescer.flights == {}
@@ -0,0 +1,69 @@
+import pytest
+import tiktoken
+from phi.document import Document
+from phi.llm.message import Message
+
+from llm import context as context_module
+from llm.context import ContextAssembler
+
+# Byte level encoding, so the tests do not need to download an encoding and one byte is one token
+BYTE_ENCODING = tiktoken.Encoding(
+    name="bytes",
+    pat_str=r"\S+|\s+",
+    mergeable_ranks={bytes([i]): i for i in range(256)},
+    special_tokens={},
+)
+
+MODEL = "test-model"
+
+
+@pytest.fixture(autouse=True)
+def byte_encoding(monkeypatch):
+    monkeypatch.setattr(context_module, "get_encoding", lambda encoding_name: BYTE_ENCODING)
+
+
+def get_assembler(budget: int, history_share: float = 0.25) -> ContextAssembler:
+    return ContextAssembler(budgets={MODEL: budget}, history_share=history_share)
+
+
+def test_references_fill_budget_in_rank_order():
+    assembler = get_assembler(budget=500, history_share=0)
+    candidates = [
+        Document(name="a", content="a" * 200),
+        Document(name="b", content="b" * 400),
+        Document(name="c", content="c" * 100),
+    ]
+    _, references, report = assembler.assemble(MODEL, prompts=["prompt"], history=[], candidates=candidates)
+
+    # b does not fit after a, the smaller c is used instead
+    assert [document.name for document in references] == ["a", "c"]
+    assert report.references == ["a", "c"] and report.dropped_references == ["b"]
+    assert report.total_tokens <= 500
+
+
+def test_duplicate_references_are_removed():
+    assembler = get_assembler(budget=1000)
+    candidates = [
+        Document(name="a", meta_data={"page": 1}, content="the  same\ncontent and more"),
+        Document(name="a", meta_data={"page": 2}, content="the same content"),
+        Document(name="b", content="other content"),
+    ]
+    _, references, report = assembler.assemble(MODEL, prompts=[], history=[], candidates=candidates)
+
+    assert report.references == ["a:p1", "b"]
+    assert report.duplicate_references == 1
+
+
+def test_history_is_trimmed_to_most_recent_messages():
+    assembler = get_assembler(budget=600, history_share=0.5)
+    history = [Message(role="user" if i % 2 == 0 else "assistant", content=str(i) * 96) for i in range(8)]
+    candidates = [Document(name="a", content="a" * 200)]
+    messages, references, report = assembler.assemble(
+        MODEL, prompts=[], history=history, candidates=candidates
+    )
+
+    # Each message is 100 tokens, 3 fit in the reserved share and the reference leaves no room for a 4th
+    assert len(references) == 1
+    assert messages == history[-3:]
+    assert report.history_messages == 3 and report.dropped_history_messages == 5
+    assert report.total_tokens <= 600
@@ -0,0 +1,107 @@
+import asyncio
+from typing import Any, List, Optional
+
+import pytest
+from phi.conversation import ConversationRow
+
+from api import conversation_cache as conversation_cache_module
+from api.conversation_cache import ConversationCache
+
+
+class FakeConversation:
+    def __init__(self, conversation_id: Optional[str]):
+        self.id = conversation_id
+        self.database_row: Any = {"id": conversation_id}
+
+
+def loader(loads: List[str], conversation_id: Optional[str]):
+    async def load() -> Any:
+        loads.append(str(conversation_id))
+        return FakeConversation(conversation_id)
+
+    return load
+
+
+async def use(cache: ConversationCache, conversation_id: str, loads: List[str]) -> Any:
+    async with cache.checkout("RAG", conversation_id, loader(loads, conversation_id)) as conversation:
+        return conversation
+
+
+def test_conversations_are_reused_and_evicted():
+    cache = ConversationCache(max_size=2, ttl=60)
+    loads: List[str] = []
+
+    async def main():
+        first = await use(cache, "a", loads)
+        assert await use(cache, "a", loads) is first
+        await use(cache, "b", loads)
+        await use(cache, "c", loads)
+        # a was least recently used
+        await use(cache, "a", loads)
+
+    asyncio.run(main())
+    assert loads == ["a", "b", "c", "a"]
+    stats = cache.stats()
+    assert stats["hits"] == 1 and stats["misses"] == 4 and stats["evictions"] == 2
+    assert stats["size"] == 2 and stats["locked"] == 0
+
+
+def test_conversations_expire(monkeypatch):
+    cache = ConversationCache(max_size=2, ttl=10)
+    loads: List[str] = []
+    now = [100.0]
+    monkeypatch.setattr(conversation_cache_module, "monotonic", lambda: now[0])
+
+    async def main():
+        await use(cache, "a", loads)
+        now[0] += 5
+        await use(cache, "a", loads)
+        # Reading the conversation does not extend its ttl
+        now[0] += 6
+        await use(cache, "a", loads)
+        # Writing it does
+        now[0] += 6
+        async with cache.checkout("RAG", "a", loader(loads, "a")) as conversation:
+            conversation.database_row = ConversationRow(id="a", name="renamed")
+        now[0] += 6
+        await use(cache, "a", loads)
+
+    asyncio.run(main())
+    assert loads == ["a", "a"]
+    assert cache.stats()["expirations"] == 1
+
+
+def test_failed_requests_drop_the_conversation():
+    cache = ConversationCache(max_size=2, ttl=60)
+    loads: List[str] = []
+
+    async def main():
+        await use(cache, "a", loads)
+        with pytest.raises(ValueError):
+            async with cache.checkout("RAG", "a", loader(loads, "a")):
+                raise ValueError("write failed")
+        await use(cache, "a", loads)
+
+    asyncio.run(main())
+    assert loads == ["a", "a"]
+    assert cache.stats()["invalidations"] == 1
+
+
+def test_requests_to_a_conversation_are_serialized():
+    cache = ConversationCache(max_size=2, ttl=60)
+    loads: List[str] = []
+    events: List[str] = []
+
+    async def turn(name: str):
+        async with cache.checkout("RAG", "a", loader(loads, "a")):
+            events.append(f"{name} start")
+            await asyncio.sleep(0.01)
+            events.append(f"{name} end")
+
+    async def main():
+        await asyncio.gather(turn("first"), turn("second"))
+
+    asyncio.run(main())
+    assert events == ["first start", "first end", "second start", "second end"]
+    # The second request uses the conversation loaded by the first
+    assert loads == ["a"]
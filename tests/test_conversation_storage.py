@@ -0,0 +1,15 @@
+from datetime import datetime, timezone
+
+import pytest
+
+from llm.conversation_storage import decode_cursor, encode_cursor
+
+
+def test_cursor_round_trip():
+    updated_at = datetime(2024, 1, 2, 3, 4, 5, 678901, tzinfo=timezone.utc)
+    assert decode_cursor(encode_cursor(updated_at, "conversation-id")) == (updated_at, "conversation-id")
+
+
+def test_invalid_cursor():
+    with pytest.raises(ValueError):
+        decode_cursor("not-a-cursor")
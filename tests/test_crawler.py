@@ -0,0 +1,106 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterator
+
+import pytest
+
+from llm.ingestion.crawler import AsyncWebsiteReader, normalize_url
+
+# Fixture site: /page/{i} links to the next two pages using different spellings of the same urls
+NUM_PAGES = 40
+
+
+def render_page(i: int) -> str:
+    links = "".join(
+        f'<a href="/page/{j}">{j}</a><a href="/page/{j}/#top">{j}</a><a href="/page/{j}/?">{j}</a>'
+        for j in (2 * i + 1, 2 * i + 2)
+        if j < NUM_PAGES
+    )
+    return (
+        f'<html><body><main>Page {i}</main>{links}<a href="https://example.com/">external</a></body></html>'
+    )
+
+
+class FixtureSite:
+    def __init__(self, delay: float = 0.05):
+        self.delay = delay
+        self.requests: Dict[str, int] = {}
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+
+
+@pytest.fixture
+def site() -> Iterator[FixtureSite]:
+    fixture_site = FixtureSite()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self) -> None:
+            with fixture_site.lock:
+                fixture_site.requests[self.path] = fixture_site.requests.get(self.path, 0) + 1
+                fixture_site.in_flight += 1
+                fixture_site.max_in_flight = max(fixture_site.max_in_flight, fixture_site.in_flight)
+            time.sleep(fixture_site.delay)
+            with fixture_site.lock:
+                fixture_site.in_flight -= 1
+
+            path = self.path.split("?")[0].rstrip("/")
+            if not path.startswith("/page/"):
+                self.send_response(404)
+                self.end_headers()
+                return
+            body = render_page(int(path.split("/")[-1])).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args) -> None:
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    fixture_site.base_url = f"http://127.0.0.1:{server.server_address[1]}"  # type: ignore
+    yield fixture_site
+    server.shutdown()
+    server.server_close()
+
+
+def test_normalize_url():
+    assert (
+        normalize_url("HTTPS://Docs.Phidata.com:443/intro/?b=2&a=1#top")
+        == "https://docs.phidata.com/intro?a=1&b=2"
+    )
+    assert normalize_url("http://localhost:8000") == "http://localhost:8000/"
+
+
+def test_crawl_deduplicates_urls(site):
+    reader = AsyncWebsiteReader(max_depth=10, max_links=100, max_per_host=4, host_delay=0)
+    result = reader.crawl(f"{site.base_url}/page/0")
+
+    assert len(result) == NUM_PAGES
+    assert result[f"{site.base_url}/page/0"] == "Page 0"
+    # Each page is requested once even though it is linked with different spellings
+    assert all(count == 1 for count in site.requests.values())
+    assert site.max_in_flight <= 4
+
+
+def test_crawl_respects_limits(site):
+    reader = AsyncWebsiteReader(max_depth=3, max_links=100, host_delay=0)
+    assert len(reader.crawl(f"{site.base_url}/page/0")) == 7
+
+    reader = AsyncWebsiteReader(max_depth=10, max_links=5, host_delay=0)
+    assert len(reader.crawl(f"{site.base_url}/page/0")) == 5
+
+
+def test_crawl_is_concurrent(site):
+    reader = AsyncWebsiteReader(max_depth=10, max_links=100, max_per_host=8, host_delay=0)
+    start = time.monotonic()
+    reader.crawl(f"{site.base_url}/page/0")
+
+    # Serially the fixture site takes NUM_PAGES * delay seconds to crawl
+    assert time.monotonic() - start < NUM_PAGES * site.delay / 2
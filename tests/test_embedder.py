@@ -0,0 +1,100 @@
+from types import SimpleNamespace
+from typing import Any, List, Optional
+
+import httpx
+import pytest
+import tiktoken
+from openai import RateLimitError
+
+from llm import embedder as embedder_module
+from llm.embedder import BatchedOpenAIEmbedder
+
+# Byte level encoding, so the tests do not need to download an encoding and one byte is one token
+BYTE_ENCODING = tiktoken.Encoding(
+    name="bytes",
+    pat_str=r"\S+|\s+",
+    mergeable_ranks={bytes([i]): i for i in range(256)},
+    special_tokens={},
+)
+
+
+def rate_limit(retry_after: Optional[str] = None) -> RateLimitError:
+    headers = {"retry-after": retry_after} if retry_after is not None else {}
+    request = httpx.Request("POST", "https://api.openai.com/v1/embeddings")
+    return RateLimitError(
+        "Rate limit reached", response=httpx.Response(429, headers=headers, request=request), body=None
+    )
+
+
+class FakeEmbeddings:
+    """Raises the queued errors, then returns an embedding for each input"""
+
+    def __init__(self, errors: List[Exception]) -> None:
+        self.errors = errors
+        self.calls = 0
+
+    def create(self, input: List[str], **kwargs: Any) -> Any:
+        self.calls += 1
+        if len(self.errors) > 0:
+            raise self.errors.pop(0)
+        return SimpleNamespace(
+            data=[SimpleNamespace(index=i, embedding=[float(len(text))]) for i, text in enumerate(input)],
+            usage=SimpleNamespace(total_tokens=sum(len(text) for text in input)),
+        )
+
+
+@pytest.fixture
+def sleeps(monkeypatch) -> List[float]:
+    monkeypatch.setenv("OPENAI_API_KEY", "test")
+    # Sleeping moves the clock forward, so the tests do not wait
+    clock = [1000.0]
+    slept: List[float] = []
+
+    def sleep(seconds: float) -> None:
+        slept.append(seconds)
+        clock[0] += seconds
+
+    monkeypatch.setattr(embedder_module, "monotonic", lambda: clock[0])
+    monkeypatch.setattr(embedder_module, "sleep", sleep)
+    monkeypatch.setattr(embedder_module.random, "uniform", lambda a, b: 1.0)
+    return slept
+
+
+def get_embedder(errors: List[Exception], **kwargs: Any) -> BatchedOpenAIEmbedder:
+    embedder = BatchedOpenAIEmbedder(**kwargs)
+    embedder._encoding = BYTE_ENCODING
+    embedder._client = SimpleNamespace(embeddings=FakeEmbeddings(errors))  # type: ignore
+    return embedder
+
+
+def test_single_texts_are_retried_after_retry_after(sleeps):
+    embedder = get_embedder([rate_limit(retry_after="5")])
+
+    embedding, usage = embedder.get_embedding_and_usage("query")
+
+    assert embedding == [5.0]
+    assert usage == {"prompt_tokens": 5, "total_tokens": 5}
+    assert embedder._client.embeddings.calls == 2  # type: ignore
+    assert sleeps == [5.0]
+
+
+def test_backoff_grows_with_consecutive_rate_limits(sleeps):
+    embedder = get_embedder([rate_limit(), rate_limit()])
+
+    assert embedder.get_embedding("query") == [5.0]
+    assert sleeps == [1.0, 2.0]
+    # and shrinks again as requests succeed
+    assert embedder._backoff == 1.0
+
+
+def test_backoff_is_shared_by_requests(sleeps):
+    embedder = get_embedder([rate_limit(retry_after="5")], max_retries=0)
+
+    with pytest.raises(RateLimitError):
+        embedder.get_embedding("first")
+    assert sleeps == []
+
+    # The next request waits for the pause of the failed request before it is sent
+    assert embedder.get_embeddings(["second", "third"]) == ([[6.0], [5.0]], 11)
+    assert sleeps == [5.0]
+    assert embedder._client.embeddings.calls == 2  # type: ignore
@@ -0,0 +1,46 @@
+from typing import Any, Dict, List, Optional
+
+from llm.ingestion.jobs import IngestionJob, IngestionWorker
+from llm.ingestion.knowledge_base import PipelinedKnowledgeBase
+from llm.ingestion.pipeline import IngestionPipeline, IngestionReport
+
+
+class FakeJobs:
+    def __init__(self) -> None:
+        self.finished: List[Dict[str, Any]] = []
+
+    def heartbeat(self, job_id: str, worker_id: str, report: Optional[IngestionReport] = None) -> bool:
+        return True
+
+    def finish(
+        self,
+        job_id: str,
+        worker_id: str,
+        report: Optional[IngestionReport] = None,
+        error: Optional[str] = None,
+    ) -> bool:
+        self.finished.append({"id": job_id, "report": report, "error": error})
+        return True
+
+
+class FakeKnowledgeBase(PipelinedKnowledgeBase):
+    fail: bool = False
+
+    def load(self, recreate=False, progress=None, cancel=None) -> None:
+        if self.fail:
+            raise RuntimeError("Embedding api unavailable")
+        self.pipeline.last_report = IngestionReport(sources=1, inserted=5)  # type: ignore
+
+
+def test_failed_job_does_not_report_the_previous_load():
+    jobs = FakeJobs()
+    knowledge_base = FakeKnowledgeBase(pipeline=IngestionPipeline())
+    worker = IngestionWorker(jobs=jobs, knowledge_bases={"documents": knowledge_base})  # type: ignore
+
+    worker.run_job(IngestionJob(id="first", knowledge_base="documents", status="running"))
+    knowledge_base.fail = True
+    worker.run_job(IngestionJob(id="second", knowledge_base="documents", status="running"))
+
+    assert jobs.finished[0]["report"].inserted == 5
+    assert jobs.finished[0]["error"] is None
+    assert jobs.finished[1] == {"id": "second", "report": None, "error": "Embedding api unavailable"}
@@ -0,0 +1,9 @@
+from phi.document.reader.pdf import PDFReader, PDFUrlReader
+
+from llm.ingestion.knowledge_base import PipelinedPDFKnowledgeBase, PipelinedPDFUrlKnowledgeBase
+
+
+def test_pdf_knowledge_bases_have_a_reader():
+    # KnowledgeBase declares reader with a None default, which the pdf knowledge bases must override
+    assert isinstance(PipelinedPDFKnowledgeBase(path="data/pdfs").reader, PDFReader)
+    assert isinstance(PipelinedPDFUrlKnowledgeBase(urls=[]).reader, PDFUrlReader)
@@ -0,0 +1,49 @@
+import asyncio
+from typing import List
+
+from api.sse import HEARTBEAT, event_stream, format_event, stream_stats
+
+
+def test_heartbeats_are_sent_while_waiting():
+    async def events():
+        await asyncio.sleep(0.05)
+        yield format_event("token", {"content": "a"})
+        yield format_event("done", {})
+
+    async def main() -> List[str]:
+        return [frame async for frame in event_stream(events(), heartbeat_interval=0.01)]
+
+    completed = stream_stats.completed
+    frames = asyncio.run(main())
+    assert frames[0] == HEARTBEAT
+    assert frames[-2:] == ['event: token\ndata: {"content": "a"}\n\n', "event: done\ndata: {}\n\n"]
+    assert stream_stats.completed == completed + 1
+
+
+def test_abandoned_streams_are_cancelled():
+    cleaned_up: List[str] = []
+
+    async def events():
+        try:
+            yield format_event("token", {"content": "a"})
+            await asyncio.sleep(10)
+            yield format_event("done", {})
+        except asyncio.CancelledError:
+            # Events can still be awaited after the stream was abandoned
+            await asyncio.sleep(0)
+            cleaned_up.append("partial answer")
+            raise
+
+    async def main():
+        stream = event_stream(events(), heartbeat_interval=1)
+        assert (await stream.__anext__()).startswith("event: token")
+        # The client disconnects while the next event is produced
+        consumer = asyncio.ensure_future(stream.__anext__())
+        await asyncio.sleep(0.01)
+        consumer.cancel()
+        await asyncio.sleep(0.01)
+
+    abandoned = stream_stats.abandoned
+    asyncio.run(main())
+    assert cleaned_up == ["partial answer"]
+    assert stream_stats.abandoned == abandoned + 1
@@ -0,0 +1,100 @@
+from typing import List
+
+from phi.embedder import Embedder
+
+from llm.vectordb import PgVectorDb, VectorIndex
+
+
+class FakeEmbedder(Embedder):
+    dimensions: int = 3
+
+
+class RecordingConnection:
+    """Connection and session which record the statements executed by PgVectorDb.create_index"""
+
+    def __init__(self) -> None:
+        self.statements: List[str] = []
+
+    def connect(self) -> "RecordingConnection":
+        return self
+
+    def execution_options(self, **kwargs) -> "RecordingConnection":
+        return self
+
+    def begin(self) -> "RecordingConnection":
+        return self
+
+    def __call__(self) -> "RecordingConnection":
+        return self
+
+    def __enter__(self) -> "RecordingConnection":
+        return self
+
+    def __exit__(self, *args) -> None:
+        pass
+
+    def execute(self, statement, *args) -> None:
+        self.statements.append(str(statement))
+
+
+def vector_index(name: str) -> VectorIndex:
+    return VectorIndex(name=name, index_type="hnsw", valid=True, size_bytes=0, definition="")
+
+
+def test_rebuild_replaces_a_build_left_by_a_failed_build(monkeypatch):
+    vector_db = PgVectorDb(
+        collection="documents", db_url="postgresql+psycopg://llm@localhost/llm", embedder=FakeEmbedder()
+    )
+    conn = RecordingConnection()
+    monkeypatch.setattr(vector_db, "db_engine", conn)
+    monkeypatch.setattr(vector_db, "Session", conn)
+    # The previous build failed after creating documents_hnsw_index_build
+    monkeypatch.setattr(
+        vector_db,
+        "get_indexes",
+        lambda: [vector_index("documents_hnsw_index"), vector_index("documents_hnsw_index_build")],
+    )
+
+    vector_db.create_index(rebuild=True)
+
+    assert "DROP INDEX CONCURRENTLY IF EXISTS llm.documents_hnsw_index_build" in conn.statements
+    swap = conn.statements[conn.statements.index("DROP INDEX IF EXISTS llm.documents_hnsw_index") :]
+    assert swap == [
+        "DROP INDEX IF EXISTS llm.documents_hnsw_index",
+        "ALTER INDEX llm.documents_hnsw_index_build RENAME TO documents_hnsw_index",
+    ]
+
+
+def test_searches_use_the_quantization_of_the_index(monkeypatch):
+    vector_db = PgVectorDb(
+        collection="documents", db_url="postgresql+psycopg://llm@localhost/llm", embedder=FakeEmbedder()
+    )
+    vector_db.quantization = None
+    # Another process rebuilt the index with halfvec quantization, a build in progress is ignored
+    definitions = {
+        "documents_hnsw_halfvec_index": "CREATE INDEX documents_hnsw_halfvec_index ON llm.documents "
+        "USING hnsw (((embedding)::halfvec(3)) halfvec_cosine_ops)",
+        "documents_hnsw_binary_index_build": "CREATE INDEX documents_hnsw_binary_index_build ON llm.documents "
+        "USING hnsw (((binary_quantize(embedding))::bit(3)) bit_hamming_ops)",
+    }
+    monkeypatch.setattr(
+        vector_db,
+        "get_indexes",
+        lambda: [
+            VectorIndex(name=name, index_type="hnsw", valid=True, size_bytes=0, definition=definition)
+            for name, definition in definitions.items()
+        ],
+    )
+
+    vector_db.read_quantization()
+    assert vector_db.quantization == "halfvec"
+
+    # Read again once the refresh interval passed
+    del definitions["documents_hnsw_halfvec_index"]
+    definitions[
+        "documents_hnsw_index"
+    ] = "CREATE INDEX documents_hnsw_index ON llm.documents USING hnsw (embedding vector_cosine_ops)"
+    vector_db.read_quantization()
+    assert vector_db.quantization == "halfvec"
+    vector_db.read_quantization(force=True)
+    assert vector_db.quantization is None